@@ -0,0 +1,123 @@
+"""
+Benchmark the quote-bound views served over WSGI (threaded) and ASGI (async views).
+
+Runs the app under uvicorn in both modes against a local quote stub that answers after a fixed
+delay, and fires concurrent get_price requests for distinct symbols, so every request misses the
+cache and waits on the stub. WSGI throughput is capped by its thread pool; ASGI throughput should
+keep growing with concurrency up to the API client's connection pool (ALPHA_VANTAGE_POOL_SIZE).
+
+Needs the database from the project settings: a 'bench' user is created to log in with.
+
+Usage (from the repository root):
+    python -m benchmarks.bench_async [--requests 400] [--concurrency 10 50 100] [--delay 0.2]
+"""
+import argparse
+import asyncio
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+import django
+import httpx
+
+from benchmarks.quote_stub import start_stub
+
+
+SERVERS = {
+    'wsgi': ['--interface', 'wsgi', 'stockly.wsgi:application'],
+    'asgi': ['stockly.asgi:application'],
+}
+
+
+def get_session_cookie():
+    """Return a session cookie of the 'bench' user"""
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'stockly.settings')
+    django.setup()
+    from django.conf import settings
+    from django.test import Client
+    from trading.models import User
+
+    user, _ = User.objects.get_or_create(username='bench')
+    client = Client()
+    client.force_login(user)
+    return {settings.SESSION_COOKIE_NAME: client.cookies[settings.SESSION_COOKIE_NAME].value}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(mode: str, stub_url: str, pool_size: int):
+    """Start uvicorn in the given mode and wait until it accepts connections. Returns the process and its URL"""
+    port = free_port()
+    env = {**os.environ, 'ALPHA_VANTAGE_BASE_URL': stub_url, 'ALPHA_VANTAGE_POOL_SIZE': str(pool_size)}
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', '--port', str(port), '--log-level', 'warning', *SERVERS[mode]],
+        env=env,
+    )
+    deadline = time.monotonic() + 15
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.1).close()
+            return process, f'http://127.0.0.1:{port}'
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError(f"{mode} server did not start")
+
+
+async def run_load(base_url: str, cookies: dict, total: int, concurrency: int, offset: int):
+    """Fire 'total' get_price requests, 'concurrency' at a time. Returns the elapsed time, latencies and error count"""
+    latencies, errors = [], 0
+    queue = iter(range(offset, offset + total))
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=base_url, cookies=cookies, limits=limits, timeout=60,
+                                 headers={'X-Requested-With': 'XMLHttpRequest'}) as client:
+        async def worker():
+            nonlocal errors
+            for i in queue:
+                start = time.perf_counter()
+                response = await client.get('/trading/get_price', params={'symbol': f'BENCH{i}'})
+                latencies.append(time.perf_counter() - start)
+                errors += response.status_code != 200
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        return time.perf_counter() - start, latencies, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=400)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[10, 50, 100])
+    parser.add_argument('--delay', type=float, default=0.2, help='Seconds the stub API takes to answer')
+    args = parser.parse_args()
+
+    cookies = get_session_cookie()
+    stub, stub_url = start_stub(delay=args.delay)
+    pool_size = max(args.concurrency)
+
+    print(f"{'mode':>5} {'concurrency':>12} {'req/s':>8} {'p50 (ms)':>9} {'p95 (ms)':>9} {'errors':>7}")
+    offset = 0
+    for mode in SERVERS:
+        process, url = start_server(mode, stub_url, pool_size)
+        try:
+            for concurrency in args.concurrency:
+                elapsed, latencies, errors = asyncio.run(run_load(url, cookies, args.requests, concurrency, offset))
+                offset += args.requests # New symbols, so that every request misses the cache
+                p95 = statistics.quantiles(latencies, n=20)[-1]
+                print(f"{mode:>5} {concurrency:>12} {args.requests / elapsed:>8.1f} {statistics.median(latencies) * 1000:>9.0f} {p95 * 1000:>9.0f} {errors:>7}")
+        finally:
+            process.terminate()
+            process.wait()
+    stub.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""
+Measure the memory and time taken by the transaction history export of a large ledger.
+
+Seeds one user with a ledger of N transactions (with generate_series, so PostgreSQL only), then
+downloads the CSV and NDJSON exports through Django's request handler while tracemalloc traces
+the allocations. Peak memory should stay flat whatever the length of the ledger; time grows
+linearly. The user and its ledger are deleted afterwards.
+
+Usage (from the repository root):
+    python -m benchmarks.bench_export [--rows 1000000]
+"""
+import argparse
+import os
+import time
+import tracemalloc
+
+import django
+
+
+USERNAME = 'bench-export'
+
+
+def export(client, export_format: str):
+    """Download an export and return the number of lines, the seconds taken and the peak traced memory"""
+    start = time.perf_counter()
+    response = client.get('/trading/transactions/export', {'format': export_format})
+    tracemalloc.start()
+    try:
+        lines = sum(chunk.count(b'\n') for chunk in response.streaming_content)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return lines, time.perf_counter() - start, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=1_000_000, help='Transactions in the ledger')
+    args = parser.parse_args()
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'stockly.settings')
+    django.setup()
+    from django.db import connection
+    from django.test import Client
+    from trading.models import Transaction, User
+
+    if connection.vendor != 'postgresql':
+        raise SystemExit("The ledger is seeded with generate_series: run against PostgreSQL")
+
+    User.objects.filter(username=USERNAME).delete()
+    user = User.objects.create_user(username=USERNAME)
+    try:
+        start = time.perf_counter()
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {Transaction._meta.db_table} (user_id, stock_symbol, transaction_type, quantity, price, total, timestamp) "
+                "SELECT %s, 'IBM', 'BUY', 1, 1.00, 1.00, NOW() - n * INTERVAL '1 second' FROM generate_series(1, %s) AS n",
+                [user.pk, args.rows],
+            )
+        print(f"Seeded {args.rows} transactions in {time.perf_counter() - start:.1f}s")
+
+        client = Client(SERVER_NAME='localhost')
+        client.force_login(user)
+        print(f"{'format':>7} {'lines':>9} {'seconds':>8} {'peak (MB)':>10}")
+        for export_format in ('csv', 'ndjson'):
+            lines, seconds, peak = export(client, export_format)
+            print(f"{export_format:>7} {lines:>9} {seconds:>8.1f} {peak / 1024 / 1024:>10.1f}")
+    finally:
+        User.objects.filter(username=USERNAME).delete()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""
+Benchmark the symbol search index against catalogs of growing size.
+
+Synthetic catalogs are built by repeating the real listings file with suffixed symbols and
+compiled to a temporary catalog file, and every query is timed against the index and against the linear scan search_stocks
+used to do. Index latency should stay flat as the catalog grows, except for queries with fewer than ten
+prefix matches (e.g. 'zzzz'), which also look for substrings with a bytes scan of the columns; the
+Python scan grows linearly, and much faster.
+
+Usage (from the repository root):
+    python -m benchmarks.bench_search [--sizes 10000 100000 1000000] [--repeat 200]
+"""
+import argparse
+import csv
+import os
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+from trading.catalog import SymbolCatalog, write_catalog
+
+
+LISTING_FILE = Path(__file__).resolve().parent.parent / 'trading' / 'data' / 'listing_status.csv'
+QUERIES = ['a', 'ibm', 'goog', 'apple', 'apple inc', 'inc', 'business mach', 'zzzz']
+
+
+def build_catalog(size: int, directory: str):
+    """Return a catalog of 'size' stocks built from the listings file, compiled in 'directory'"""
+    with open(LISTING_FILE, 'r') as file:
+        base = list(csv.DictReader(file))
+    rows = []
+    for i in range(size):
+        row = base[i % len(base)]
+        copy = i // len(base)
+        rows.append({**row, 'symbol': f"{row['symbol']}{copy}" if copy else row['symbol'], 'assetType': 'Stock'})
+    path = os.path.join(directory, f'catalog-{size}.bin')
+    write_catalog(path, rows)
+    return SymbolCatalog(path)
+
+
+def linear_search(catalog: SymbolCatalog, q: str, limit: int = 10):
+    """The scan search_stocks performed before the search index existed"""
+    q = q.lower()
+    return [row for row in catalog if q in row['symbol'].lower() or q in row['name'].lower()][:limit]
+
+
+def time_queries(search, repeat: int):
+    """Return the median latency of each query in microseconds"""
+    latencies = {}
+    for q in QUERIES:
+        samples = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            search(q)
+            samples.append(time.perf_counter() - start)
+        latencies[q] = statistics.median(samples) * 1e6
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10_000, 100_000, 1_000_000])
+    parser.add_argument('--repeat', type=int, default=200)
+    parser.add_argument('--skip-linear', action='store_true', help='Only time the index')
+    args = parser.parse_args()
+
+    print(f"{'rows':>10} {'build (s)':>10} {'index p50 (us)':>15} {'index max (us)':>15} {'scan p50 (us)':>14}")
+    with tempfile.TemporaryDirectory() as directory:
+        for size in args.sizes:
+            start = time.perf_counter()
+            catalog = build_catalog(size, directory)
+            build_time = time.perf_counter() - start
+
+            index = time_queries(lambda q: catalog.search(q), args.repeat)
+            scan = '-' if args.skip_linear else f"{statistics.median(time_queries(lambda q: linear_search(catalog, q), max(1, args.repeat // 100)).values()):.0f}"
+            print(f"{size:>10} {build_time:>10.2f} {statistics.median(index.values()):>15.1f} {max(index.values()):>15.1f} {scan:>14}")
+
+
+if __name__ == '__main__':
+    main()
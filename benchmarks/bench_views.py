@@ -0,0 +1,197 @@
+"""
+Benchmark the trading views on seeded data, and save the results as JSON to compare commits.
+
+Seeds benchmark users (see benchmarks.seed), points the quote client at a local stub answering
+after a fixed delay, then runs each scenario with a number of concurrent clients, each logged in
+as its own user. Requests go through Django's request handler in this process (no HTTP server),
+so the database queries of every request can be counted. Reports p50/p99 latency, throughput,
+queries per request and errors for each scenario.
+
+Quotes are cached like in production: the stub delay is only paid on cache misses. Needs the
+database from the project settings.
+
+Usage (from the repository root):
+    python -m benchmarks.bench_views [--requests 200] [--concurrency 4] [--output results.json]
+    python -m benchmarks.bench_views --compare baseline.json --output results.json
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import threading
+import time
+from datetime import datetime, timezone
+
+import django
+
+from benchmarks.quote_stub import start_stub
+from benchmarks.seed import PASSWORD, seed
+
+
+SEARCH_QUERIES = ['a', 'ibm', 'goog', 'apple', 'apple inc', 'inc', 'business mach', 'zzzz']
+AJAX = {'HTTP_X_REQUESTED_WITH': 'XMLHttpRequest'}
+
+
+def _trade(client, path: str, symbol: str):
+    return client.post(path, json.dumps({'symbol': symbol, 'quantity': 1}), 'application/json', **AJAX)
+
+
+# name -> function(client, symbols held by the client's user, request number) sending one request
+SCENARIOS = {
+    'dashboard': lambda client, symbols, i: client.get('/trading/dashboard'),
+    'transactions': lambda client, symbols, i: client.get('/trading/transactions'),
+    'search_stocks': lambda client, symbols, i: client.get('/trading/search_stocks', {'q': SEARCH_QUERIES[i % len(SEARCH_QUERIES)]}),
+    'buy': lambda client, symbols, i: _trade(client, '/trading/buy', symbols[i % len(symbols)]),
+    'sell': lambda client, symbols, i: _trade(client, '/trading/sell', symbols[i % len(symbols)]),
+}
+
+
+def run_scenario(send, clients, total: int, warmup: int):
+    """
+    Send 'total' requests with 'send', spread over the (client, symbols) pairs running concurrently.
+    Returns the elapsed time, and the latency, query count and status code of each request
+    """
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+
+    samples = []
+    counter = iter(range(total))
+    lock = threading.Lock()
+    ready = threading.Barrier(len(clients) + 1)
+
+    def worker(client, symbols):
+        for i in range(warmup):
+            send(client, symbols, i)
+        ready.wait()
+        while True:
+            with lock:
+                i = next(counter, None)
+            if i is None:
+                break
+            start = time.perf_counter()
+            with CaptureQueriesContext(connection) as queries:
+                response = send(client, symbols, i)
+            samples.append((time.perf_counter() - start, len(queries), response.status_code))
+        connection.close()
+
+    threads = [threading.Thread(target=worker, args=pair) for pair in clients]
+    for thread in threads:
+        thread.start()
+    ready.wait()
+    start = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - start, samples
+
+
+def summarize(elapsed: float, samples):
+    """Return the statistics of a scenario run"""
+    latencies = sorted(latency for latency, _, _ in samples)
+    queries = [count for _, count, _ in samples]
+    percentiles = statistics.quantiles(latencies, n=100, method='inclusive')
+    return {
+        'requests': len(samples),
+        'errors': sum(status >= 400 for _, _, status in samples),
+        'throughput': round(len(samples) / elapsed, 1),
+        'p50_ms': round(statistics.median(latencies) * 1000, 2),
+        'p99_ms': round(percentiles[98] * 1000, 2),
+        'queries_mean': round(statistics.mean(queries), 2),
+        'queries_max': max(queries),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results: dict, baseline: dict):
+    """Print the change of every metric from a baseline run, in percent"""
+    print(f"\nChange from {baseline.get('commit') or 'baseline'} ({baseline['timestamp']}):")
+    print(f"{'scenario':>14} {'req/s':>8} {'p50':>8} {'p99':>8} {'queries':>8}")
+    for name, stats in results['scenarios'].items():
+        before = baseline['scenarios'].get(name)
+        if not before:
+            continue
+        changes = [
+            f"{(stats[key] - before[key]) / before[key] * 100:+.0f}%" if before[key] else '-'
+            for key in ('throughput', 'p50_ms', 'p99_ms', 'queries_mean')
+        ]
+        print(f"{name:>14} " + ' '.join(f"{change:>8}" for change in changes))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenarios', nargs='+', choices=list(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument('--requests', type=int, default=200, help='Requests per scenario')
+    parser.add_argument('--concurrency', type=int, default=4, help='Concurrent clients, each logged in as its own user')
+    parser.add_argument('--warmup', type=int, default=5, help='Untimed requests per client before each scenario')
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--holdings', type=int, default=50, help='Stocks held by each user')
+    parser.add_argument('--transactions', type=int, default=5000, help='Transactions of each user')
+    parser.add_argument('--no-seed', action='store_true', help='Reuse the users of a previous run')
+    parser.add_argument('--delay', type=float, default=0.05, help='Seconds the stub API takes to answer')
+    parser.add_argument('--output', help='File to save the results to, as JSON')
+    parser.add_argument('--compare', help='Results of a previous run to compare with')
+    args = parser.parse_args()
+
+    # Settings read at startup: the stub, and no API quota
+    stub, stub_url = start_stub(delay=args.delay)
+    os.environ.update({
+        'ALPHA_VANTAGE_BASE_URL': stub_url,
+        'ALPHA_VANTAGE_POOL_SIZE': str(args.concurrency),
+        'ALPHA_VANTAGE_REQUESTS_PER_MINUTE': str(10 ** 9),
+        'ALPHA_VANTAGE_REQUESTS_PER_DAY': str(10 ** 9),
+    })
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'stockly.settings')
+    django.setup()
+    from django.core.cache import cache
+    from django.db import connection
+    from django.test import Client
+    from trading.models import StockHolding
+
+    usernames = [f'bench{i}' for i in range(args.users)]
+    if not args.no_seed:
+        start = time.perf_counter()
+        seed(args.users, args.holdings, args.transactions)
+        print(f"Seeded {args.users} users in {time.perf_counter() - start:.1f}s")
+
+    clients = []
+    for username in usernames[:args.concurrency]:
+        client = Client(SERVER_NAME='localhost')
+        if not client.login(username=username, password=PASSWORD):
+            raise SystemExit(f"Could not log in as {username}: seed the database first")
+        symbols = list(StockHolding.objects.filter(portfolio__user__username=username).values_list('stock_symbol', flat=True).order_by('stock_symbol'))
+        clients.append((client, symbols))
+    connection.close()
+
+    results = {
+        'commit': git_commit(),
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'environment': {'python': platform.python_version(), 'django': django.get_version(), 'database': connection.vendor},
+        'config': {key: getattr(args, key) for key in ('requests', 'concurrency', 'warmup', 'users', 'holdings', 'transactions', 'delay')},
+        'scenarios': {},
+    }
+    print(f"{'scenario':>14} {'req/s':>8} {'p50 (ms)':>9} {'p99 (ms)':>9} {'queries':>8} {'errors':>7}")
+    for name in args.scenarios:
+        cache.clear()
+        stats = summarize(*run_scenario(SCENARIOS[name], clients, args.requests, args.warmup))
+        results['scenarios'][name] = stats
+        print(f"{name:>14} {stats['throughput']:>8.1f} {stats['p50_ms']:>9.1f} {stats['p99_ms']:>9.1f} {stats['queries_mean']:>8.1f} {stats['errors']:>7}")
+    stub.shutdown()
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+        print(f"\nSaved to {args.output}")
+    if args.compare:
+        with open(args.compare) as file:
+            compare(results, json.load(file))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""
+Local stand-in for the Alpha Vantage quote API, answering every GLOBAL_QUOTE query after a fixed delay.
+
+Point ALPHA_VANTAGE_BASE_URL at it to benchmark the app without hitting the real API or its rate limits.
+
+Usage (from the repository root):
+    python -m benchmarks.quote_stub [--port 8765] [--delay 0.2]
+"""
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+class QuoteHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1' # Keep connections alive
+    delay = 0
+
+    def do_GET(self):
+        time.sleep(self.delay)
+        symbol = parse_qs(urlparse(self.path).query).get('symbol', [''])[0]
+        body = json.dumps({'Global Quote': {
+            '01. symbol': symbol,
+            '02. open': '99.00',
+            '05. price': '100.00',
+            '08. previous close': '98.00',
+        }}).encode()
+        try:
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            pass # The client gave up waiting
+
+    def log_message(self, *args):
+        pass
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128 # Accept bursts of new connections without dropping them
+
+
+def start_stub(port: int = 0, delay: float = 0):
+    """Serve the stub from a background thread. Returns the server and its URL"""
+    handler = type('QuoteHandler', (QuoteHandler,), {'delay': delay})
+    server = StubServer(('127.0.0.1', port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_port}/query'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--delay', type=float, default=0.2, help='Seconds to wait before answering')
+    args = parser.parse_args()
+
+    server, url = start_stub(args.port, args.delay)
+    print(f"Serving quotes at {url} with a {args.delay}s delay")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
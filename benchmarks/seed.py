@@ -0,0 +1,80 @@
+"""
+Seed the database with benchmark users: N users, each holding M stocks bought over K transactions.
+
+Users are named '<prefix>0', '<prefix>1', ... and share the password 'bench'. Their ledgers are
+consistent with their holdings and cost basis (K buys spread over M listed symbols), so the
+trading views and rebuild_cost_basis see realistic data. Seeding again replaces previous users
+with the same prefix.
+
+Usage (from the repository root):
+    python -m benchmarks.seed [--users 20] [--holdings 50] [--transactions 5000]
+"""
+import argparse
+import os
+import time
+from decimal import Decimal
+
+import django
+
+
+PASSWORD = 'bench'
+BALANCE = Decimal('1000000.00') # Enough for every buy of a benchmark run
+
+
+def seed(users: int, holdings: int, transactions: int, prefix: str = 'bench', batch_size: int = 5000):
+    """Create the benchmark users, replacing previous ones. Returns their usernames"""
+    from django.contrib.auth.hashers import make_password
+    from django.db import transaction
+    from trading.catalog import get_stocks
+    from trading.models import Portfolio, StockHolding, Transaction, User
+
+    symbols = get_stocks()[:holdings]
+    if len(symbols) < holdings:
+        raise ValueError(f"The catalog only lists {len(symbols)} stocks")
+    symbols = [row['symbol'] for row in symbols]
+    usernames = [f'{prefix}{i}' for i in range(users)]
+    password = make_password(PASSWORD) # Hashed once: hashing is deliberately slow
+
+    with transaction.atomic():
+        User.objects.filter(username__in=usernames).delete()
+        # bulk_create skips the signal creating portfolios, so they are created here
+        created = User.objects.bulk_create([User(username=username, password=password) for username in usernames])
+        portfolios = Portfolio.objects.bulk_create([Portfolio(user=user, balance=BALANCE) for user in created])
+
+        for user, portfolio in zip(created, portfolios):
+            # K buys, round-robin over the M symbols, at a price depending on the trade
+            positions = {}
+            ledger = []
+            for i in range(transactions):
+                symbol, quantity, price = symbols[i % holdings], 10, Decimal(100 + i % 50)
+                ledger.append(Transaction(
+                    user=user, stock_symbol=symbol, transaction_type=Transaction.BUY,
+                    quantity=quantity, price=price, total=quantity * price,
+                ))
+                held, cost = positions.get(symbol, (0, Decimal(0)))
+                positions[symbol] = (held + quantity, cost + quantity * price)
+            Transaction.objects.bulk_create(ledger, batch_size=batch_size)
+            StockHolding.objects.bulk_create([
+                StockHolding(portfolio=portfolio, stock_symbol=symbol, quantity=quantity, cost_basis=cost)
+                for symbol, (quantity, cost) in positions.items()
+            ], batch_size=batch_size)
+    return usernames
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--holdings', type=int, default=50, help='Stocks held by each user')
+    parser.add_argument('--transactions', type=int, default=5000, help='Transactions of each user')
+    parser.add_argument('--prefix', default='bench')
+    args = parser.parse_args()
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'stockly.settings')
+    django.setup()
+    start = time.perf_counter()
+    usernames = seed(args.users, args.holdings, args.transactions, args.prefix)
+    print(f"Seeded {len(usernames)} users with {args.holdings} holdings and {args.transactions} transactions each in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
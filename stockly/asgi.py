@@ -13,4 +13,7 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "stockly.settings")
 
+# Serve the quote-bound views asynchronously (see TRADING_ASYNC_VIEWS)
+os.environ.setdefault("TRADING_ASYNC_VIEWS", "1")
+
 application = get_asgi_application()
@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
 from pathlib import Path
+import os
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -42,11 +43,14 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # First, to measure everything below it. Disabled unless PERFORMANCE_METRICS is set
+    "trading.middleware.PerformanceMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
+    "trading.middleware.PortfolioMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
 ]
@@ -87,6 +91,155 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+# Point CACHE_BACKEND at a shared backend (e.g. Redis) so that all workers share quotes
+
+CACHES = {
+    "default": {
+        "BACKEND": os.environ.get("CACHE_BACKEND", "django.core.cache.backends.locmem.LocMemCache"),
+        "LOCATION": os.environ.get("CACHE_LOCATION", "stockly"),
+    }
+}
+
+
+# Alpha Vantage API client (see trading/alphavantage.py)
+
+ALPHA_VANTAGE_API_KEY = os.environ.get("ALPHA_VANTAGE_API_KEY")
+
+# Point this at a local stub server for tests and benchmarks
+ALPHA_VANTAGE_BASE_URL = os.environ.get("ALPHA_VANTAGE_BASE_URL", "https://www.alphavantage.co/query")
+
+# Seconds to wait for a connection, and for a response once connected
+ALPHA_VANTAGE_CONNECT_TIMEOUT = 3.05
+ALPHA_VANTAGE_READ_TIMEOUT = 10
+
+# Retries of failed requests, with jittered exponential backoff starting at ~RETRY_BACKOFF seconds
+ALPHA_VANTAGE_MAX_RETRIES = 2
+ALPHA_VANTAGE_RETRY_BACKOFF = 0.5
+
+# Keep-alive connections kept open to the API per process
+ALPHA_VANTAGE_POOL_SIZE = int(os.environ.get("ALPHA_VANTAGE_POOL_SIZE", 10))
+
+# Request quota as (requests, seconds) windows, enforced across all workers. The defaults
+# match a free API key
+ALPHA_VANTAGE_RATE_LIMITS = [
+    (int(os.environ.get("ALPHA_VANTAGE_REQUESTS_PER_MINUTE", 5)), 60),
+    (int(os.environ.get("ALPHA_VANTAGE_REQUESTS_PER_DAY", 25)), 24 * 60 * 60),
+]
+
+# Seconds a quote request may queue for the quota before it is shed
+ALPHA_VANTAGE_RATE_LIMIT_WAIT = 2
+
+# Consecutive failed requests that open the circuit breaker, and seconds it then stays open
+ALPHA_VANTAGE_BREAKER_THRESHOLD = 5
+ALPHA_VANTAGE_BREAKER_COOLDOWN = 60
+
+
+# Quote cache (see trading/quotes.py)
+
+# Cache alias used for stock quotes
+QUOTE_CACHE_ALIAS = "default"
+
+# Seconds a quote is served as fresh
+QUOTE_CACHE_TTL = 60
+
+# Per-symbol overrides of QUOTE_CACHE_TTL, e.g. {"AAPL": 15}
+QUOTE_CACHE_SYMBOL_TTLS = {}
+
+# Seconds an expired quote may still be served while it is refreshed in the background
+QUOTE_CACHE_STALE_TTL = 300
+
+# Seconds the last known quote of a symbol is kept, to be served (flagged as stale) while the API is unavailable
+QUOTE_CACHE_LAST_KNOWN_TTL = 24 * 60 * 60
+
+# Seconds a worker holds the fetch lock for a symbol, and how long others wait on it
+QUOTE_CACHE_LOCK_TIMEOUT = 10
+QUOTE_CACHE_LOCK_WAIT = 5
+
+# Seconds a symbol stays hot after a lookup, i.e. kept warm by the refresh_quotes command
+QUOTE_HOT_WINDOW = 15 * 60
+
+# Seconds between two passes of the refresh_quotes command, and the share of the request
+# quota it may use
+QUOTE_REFRESH_INTERVAL = 15
+QUOTE_REFRESH_SHARE = 0.8
+
+# Maximum number of concurrent upstream fetches for a batch quote lookup
+QUOTE_FETCH_CONCURRENCY = 8
+
+# Maximum number of symbols accepted by the get_prices endpoint
+QUOTE_BATCH_MAX_SYMBOLS = 50
+
+# Seconds between two lookups of the streamed quotes, and between two keep-alive comments on
+# idle streams (see trading/streaming.py)
+QUOTE_STREAM_INTERVAL = 5
+QUOTE_STREAM_HEARTBEAT = 15
+
+# Seconds a user's portfolio valuation is cached, unless they trade meanwhile
+PORTFOLIO_VALUE_TTL = 15
+
+# Seconds rendered dashboard, buy and sell pages are cached. Pages of a user are keyed on their
+# portfolio version, so a trade makes them stale at once; this only bounds the cache size
+PAGE_CACHE_TTL = 10 * 60
+
+# Maximum number of orders accepted by the orders endpoint in one request
+ORDERS_MAX_LEGS = 50
+
+# Route the quote-bound views (get_price, get_prices, portfolio_value, buy, sell) to their async versions in
+# trading/async_views.py. Set by stockly/asgi.py: under WSGI, async views would each run in a
+# throwaway event loop
+TRADING_ASYNC_VIEWS = os.environ.get("TRADING_ASYNC_VIEWS", "0") == "1"
+
+# Measure every request (see trading/middleware.py): Server-Timing headers, a log line per
+# request on the 'trading.metrics' logger, and histograms per view on the metrics endpoint
+PERFORMANCE_METRICS = os.environ.get("PERFORMANCE_METRICS", "0") == "1"
+
+# Write the per-request log lines of PERFORMANCE_METRICS to the console. Off by default: one
+# line per request is a lot of output for a production log
+PERFORMANCE_METRICS_LOG = os.environ.get("PERFORMANCE_METRICS_LOG", "0") == "1"
+
+# Bearer token a Prometheus scraper can send to read the metrics endpoint. Staff users can always read it
+PERFORMANCE_METRICS_TOKEN = os.environ.get("PERFORMANCE_METRICS_TOKEN")
+
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "handlers": {
+        "console": {"class": "logging.StreamHandler"},
+    },
+    "loggers": {
+        "trading.metrics": {"handlers": ["console"], "level": "INFO" if PERFORMANCE_METRICS_LOG else "WARNING", "propagate": False},
+    },
+}
+
+
+# Alpha Vantage listings file the symbol catalog is built from (see trading/catalog.py). It is
+# compiled to a memory-mapped listing_status.bin next to it, on first use or with the build_catalog command
+
+SYMBOL_LISTING_FILE = BASE_DIR / "trading" / "data" / "listing_status.csv"
+
+
+# Sessions
+# https://docs.djangoproject.com/en/5.1/topics/http/sessions/#configuring-the-session-engine
+
+# Database-backed by default: one query per request. "django.contrib.sessions.backends.cache"
+# (with a shared CACHE_BACKEND) or "django.contrib.sessions.backends.signed_cookies" need none,
+# which matters for the AJAX endpoints polled by the pages
+SESSION_ENGINE = os.environ.get("SESSION_ENGINE", "django.contrib.sessions.backends.db")
+
+
+# Authentication
+# https://docs.djangoproject.com/en/5.1/topics/auth/customizing/#specifying-authentication-backends
+
+AUTHENTICATION_BACKENDS = [
+    # Loads the user's portfolio along with the user
+    "trading.backends.PortfolioBackend",
+    # Sessions created before PortfolioBackend was added refer to this one
+    "django.contrib.auth.backends.ModelBackend",
+]
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
@@ -4,4 +4,5 @@ from .models import *
 # Register your models here.
 admin.site.register(Transaction)
 admin.site.register(Portfolio)
-admin.site.register(StockHolding)
\ No newline at end of file
+admin.site.register(StockHolding)
+admin.site.register(PriceSnapshot)
\ No newline at end of file
@@ -0,0 +1,181 @@
+# Clients for the Alpha Vantage quote API
+import asyncio
+import random
+import threading
+import time
+import weakref
+
+import httpx
+import requests
+from django.conf import settings
+
+
+class RetryableResponse(Exception):
+    """Raised for upstream responses that are worth retrying (rate limiting, server errors)"""
+
+
+class QuotaExceeded(Exception):
+    """Raised when the API answers with a 'Note' or 'Information' message (rate limit, quota) instead of data"""
+
+
+class UnknownSymbol(Exception):
+    """Raised when the API has no quote for a symbol: an 'Error Message' or an empty 'Global Quote'. Not worth retrying"""
+
+
+class BaseAlphaVantageClient:
+    """
+    Connection settings and retry policy shared by the sync and async clients.
+
+    Every request has connect and read timeouts, and connection errors, timeouts, 429 and 5xx
+    responses are retried up to 'max_retries' times with jittered exponential backoff.
+    """
+
+    def __init__(self, base_url: str, api_key: str = None, connect_timeout: float = 3.05, read_timeout: float = 10,
+                 max_retries: int = 2, retry_backoff: float = 0.5, pool_size: int = 10):
+        self.base_url = base_url
+        self.api_key = api_key
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.pool_size = pool_size
+
+    @classmethod
+    def from_settings(cls):
+        return cls(
+            base_url=settings.ALPHA_VANTAGE_BASE_URL,
+            api_key=settings.ALPHA_VANTAGE_API_KEY,
+            connect_timeout=settings.ALPHA_VANTAGE_CONNECT_TIMEOUT,
+            read_timeout=settings.ALPHA_VANTAGE_READ_TIMEOUT,
+            max_retries=settings.ALPHA_VANTAGE_MAX_RETRIES,
+            retry_backoff=settings.ALPHA_VANTAGE_RETRY_BACKOFF,
+            pool_size=settings.ALPHA_VANTAGE_POOL_SIZE,
+        )
+
+    def _params(self, params: dict):
+        return {**params, 'apikey': self.api_key}
+
+    def _check_status(self, status_code: int):
+        if status_code == 429 or status_code >= 500:
+            raise RetryableResponse(f"HTTP {status_code}")
+
+    def _global_quote(self, payload: dict):
+        """Return the 'Global Quote' data of a GLOBAL_QUOTE response"""
+        if 'Global Quote' not in payload and ('Note' in payload or 'Information' in payload):
+            raise QuotaExceeded(payload.get('Note') or payload.get('Information'))
+        quote = payload.get('Global Quote') # API contains price data inside 'Global Quote'
+        if not quote:
+            raise UnknownSymbol(payload.get('Error Message', 'No quote for this symbol'))
+        return quote
+
+    def _backoff(self, attempt: int):
+        """Return the delay before retry number 'attempt' (from 0): exponential, with full jitter"""
+        return random.uniform(0, self.retry_backoff * 2 ** attempt)
+
+
+class AlphaVantageClient(BaseAlphaVantageClient):
+    """Fetches quotes over a pooled, keep-alive requests.Session"""
+
+    RETRYABLE_ERRORS = (requests.ConnectionError, requests.Timeout, RetryableResponse)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def _get(self, params: dict):
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = self.session.get(self.base_url, params=self._params(params), timeout=(self.connect_timeout, self.read_timeout))
+                self._check_status(response.status_code)
+                response.raise_for_status()
+                return response
+            except self.RETRYABLE_ERRORS:
+                if attempt == self.max_retries:
+                    raise
+                time.sleep(self._backoff(attempt))
+
+    def query(self, params: dict):
+        """Send a query to the API and return the decoded JSON response"""
+        return self._get(params).json()
+
+    def get_quote(self, symbol: str):
+        """Return the 'Global Quote' data of a symbol"""
+        return self._global_quote(self.query({'function': 'GLOBAL_QUOTE', 'symbol': symbol}))
+
+    def get_daily_csv(self, symbol: str, full: bool = False):
+        """Return the daily prices of a symbol as CSV text: the last 100 days, or the full history if 'full' is set"""
+        response = self._get({'function': 'TIME_SERIES_DAILY', 'symbol': symbol, 'datatype': 'csv', 'outputsize': 'full' if full else 'compact'})
+        # Errors and quota messages are sent as JSON, whatever the requested datatype
+        if response.text.lstrip().startswith('{'):
+            payload = response.json()
+            if 'Note' in payload or 'Information' in payload:
+                raise QuotaExceeded(payload.get('Note') or payload.get('Information'))
+            raise ValueError(payload.get('Error Message', 'Unexpected response'))
+        return response.text
+
+
+class AsyncAlphaVantageClient(BaseAlphaVantageClient):
+    """Fetches quotes over a pooled, keep-alive httpx.AsyncClient. Bound to one event loop"""
+
+    RETRYABLE_ERRORS = (httpx.TransportError, RetryableResponse)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.http = httpx.AsyncClient(
+            timeout=httpx.Timeout(self.read_timeout, connect=self.connect_timeout),
+            limits=httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size),
+        )
+
+    async def query(self, params: dict):
+        """Send a query to the API and return the decoded JSON response"""
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = await self.http.get(self.base_url, params=self._params(params))
+                self._check_status(response.status_code)
+                response.raise_for_status()
+                return response.json()
+            except self.RETRYABLE_ERRORS:
+                if attempt == self.max_retries:
+                    raise
+                await asyncio.sleep(self._backoff(attempt))
+
+    async def get_quote(self, symbol: str):
+        """Return the 'Global Quote' data of a symbol"""
+        return self._global_quote(await self.query({'function': 'GLOBAL_QUOTE', 'symbol': symbol}))
+
+
+_client = None
+_client_lock = threading.Lock()
+
+# Async clients hold connections bound to an event loop, so there is one per loop
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def get_client():
+    """Return the process-wide client, created from settings on first use"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = AlphaVantageClient.from_settings()
+    return _client
+
+
+def get_async_client():
+    """Return the async client of the running event loop, created from settings on first use"""
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = _async_clients[loop] = AsyncAlphaVantageClient.from_settings()
+    return client
+
+
+def reset_client():
+    """Drop the process-wide clients, e.g. after their settings changed"""
+    global _client
+    with _client_lock:
+        _client = None
+        _async_clients.clear()
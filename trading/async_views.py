@@ -0,0 +1,190 @@
+# Async versions of the views that wait on the quote API. When the app is served over ASGI
+# (see stockly/asgi.py) these are routed instead of their sync counterparts, so a request
+# waiting on Alpha Vantage does not hold a worker thread
+from asgiref.sync import sync_to_async
+from django.http import HttpRequest, JsonResponse, HttpResponseBadRequest, StreamingHttpResponse
+from django.contrib.auth.decorators import login_required
+from django.views.decorators.http import require_http_methods, require_GET
+from django.views.decorators.cache import cache_control
+from django.core.exceptions import ValidationError
+from .models import Transaction, StockHolding
+from .alphavantage import UnknownSymbol
+from .governor import QuoteUnavailable
+from .quotes import aget_quote, aget_quotes, aserve_quote, get_quote_entry, trade_price
+from .valuation import aget_portfolio_value
+from .streaming import stream_quotes
+from . import views
+
+
+@login_required
+@require_GET
+@cache_control(private=True, no_cache=True)
+async def get_price(request: HttpRequest):
+    """Return the stock price of a symbol"""
+    # AJAX requests only
+    if request.headers.get('X-Requested-With') != 'XMLHttpRequest':
+        return HttpResponseBadRequest()
+    symbol = request.GET.get('symbol')
+    try:
+        # The cache entry is read once, off the event loop, to revalidate the client's quote and to serve it
+        symbol = symbol.upper()
+        entry = await sync_to_async(get_quote_entry, thread_sensitive=False)(symbol)
+        validators, not_modified = views.quote_not_modified(request, symbol, entry)
+        if not_modified:
+            return not_modified
+        return views.quote_response(symbol, entry, await aserve_quote(symbol, entry), validators)
+    except UnknownSymbol:
+        return JsonResponse({'error': 'Unknown stock symbol'}, status=404)
+    except QuoteUnavailable as e:
+        return views.quote_unavailable(e)
+    except Exception:
+        return JsonResponse({'error': 'Error fetching price'}, status=500)
+
+
+@login_required
+@require_GET
+async def get_prices(request: HttpRequest):
+    """Return the stock prices of several comma-separated symbols. Failed symbols are listed in 'errors'"""
+    # AJAX requests only
+    if request.headers.get('X-Requested-With') != 'XMLHttpRequest':
+        return HttpResponseBadRequest()
+    symbols, error = views.parse_symbols(request)
+    if error:
+        return error
+    return views.prices_response(*await aget_quotes(symbols))
+
+
+@login_required
+@require_GET
+@cache_control(private=True, no_cache=True)
+async def portfolio_value(request: HttpRequest):
+    """Return the market value and day change of each holding, the cash balance and the total equity. For AJAX"""
+    if request.headers.get('X-Requested-With') != 'XMLHttpRequest':
+        return HttpResponseBadRequest()
+    user = await request.auser()
+    return views.valuation_response(request, user.pk, await aget_portfolio_value(user.pk))
+
+
+@login_required
+@require_GET
+async def quote_stream(request: HttpRequest):
+    """Stream the quotes of the user's holdings as Server-Sent Events (see trading/streaming.py). ASGI only"""
+    user = await request.auser()
+    symbols = [symbol async for symbol in StockHolding.objects.filter(portfolio__user=user).values_list('stock_symbol', flat=True)]
+    response = StreamingHttpResponse(stream_quotes(symbols), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no' # Don't let nginx buffer the events
+    return response
+
+
+@login_required
+@require_http_methods(['GET', 'POST'])
+async def buy(request: HttpRequest):
+    """
+    GET: Load the Buy page,
+    POST: Purchase new stock
+    """
+    if request.method != 'POST':
+        return await sync_to_async(views.buy)(request)
+    # Only accept AJAX requests
+    if request.headers.get('X-Requested-With') != 'XMLHttpRequest':
+        return HttpResponseBadRequest()
+    symbol, quantity, error = views.parse_trade(request)
+    if error:
+        return error
+
+    # Verify that quantity is valid
+    if quantity <= 0:
+        return JsonResponse({'error': 'Invalid quantity provided'}, status=400)
+
+    # Verify that the symbol is a listed stock before asking the API for its price
+    symbol = str(symbol).upper()
+    error = views.buy_symbol_error(symbol)
+    if error:
+        return JsonResponse({'error': error}, status=400)
+
+    # Get the actual stock price
+    try:
+        price = trade_price(await aget_quote(symbol))
+    except UnknownSymbol:
+        return JsonResponse({'error': 'Invalid stock symbol'}, status=400)
+    except QuoteUnavailable as e:
+        return views.quote_unavailable(e)
+    except Exception:
+        return JsonResponse({'error': 'Failed to fetch stock price. Please try again later'}, status=500)
+
+    # Perform the transaction. The balance is checked inside it, against the locked portfolio
+    try:
+        await sync_to_async(Transaction.objects.create)(
+            user=await request.auser(),
+            stock_symbol=symbol,
+            transaction_type='BUY',
+            quantity=quantity,
+            price=price
+        )
+    except ValidationError as e:
+        if e.code == 'insufficient_balance':
+            return JsonResponse({'error': 'Insufficient balance'}, status=400)
+        return JsonResponse({'error': 'An error occurred while buying stock. Please try again later'}, status=500)
+    except Exception:
+        return JsonResponse({'error': 'An error occurred while buying stock. Please try again later'}, status=500)
+
+    return JsonResponse({'message': 'Stock purchased successfully'}, status=201)
+
+
+@login_required
+@require_http_methods(['GET', 'POST'])
+async def sell(request: HttpRequest):
+    """
+    GET: Load the Sell page
+    POST: Sell stock
+    """
+    if request.method != 'POST':
+        return await sync_to_async(views.sell)(request)
+    # Only accept AJAX requests
+    if request.headers.get('X-Requested-With') != 'XMLHttpRequest':
+        return HttpResponseBadRequest()
+    symbol, quantity, error = views.parse_trade(request)
+    if error:
+        return error
+
+    # Get the user's holdings. This only avoids fetching a price for stock the user
+    # doesn't own: the quantity is checked again inside the transaction
+    user = await request.auser()
+    quantity_owned = await StockHolding.objects.filter(portfolio__user=user, stock_symbol=str(symbol).upper()).values_list('quantity', flat=True).afirst()
+    if not quantity_owned:
+        return JsonResponse({'error': f'You do not own any stock of {symbol}'}, status=400)
+
+    # Ensure quantity provided is valid
+    if quantity > quantity_owned:
+        return JsonResponse({'error': f'You do not own {quantity} shares of {symbol}'}, status=400)
+    elif quantity <= 0:
+        return JsonResponse({'error': 'Invalid quantity provided'}, status=400)
+
+    # Get stock price
+    try:
+        price = trade_price(await aget_quote(symbol))
+    except UnknownSymbol:
+        return JsonResponse({'error': 'Invalid stock symbol'}, status=400)
+    except QuoteUnavailable as e:
+        return views.quote_unavailable(e)
+    except Exception:
+        return JsonResponse({'error': 'Failed to fetch stock price. Please try again later'}, status=500)
+
+    # Perform the transaction
+    try:
+        await sync_to_async(Transaction.objects.create)(
+            user=user,
+            stock_symbol=symbol,
+            transaction_type='SELL',
+            quantity=quantity,
+            price=price
+        )
+    except ValidationError as e:
+        if e.code == 'insufficient_quantity':
+            return JsonResponse({'error': f'You do not own {quantity} shares of {symbol}'}, status=400)
+        return JsonResponse({'error': 'An error occurred when selling stock. Please try again later'}, status=500)
+    except Exception:
+        return JsonResponse({'error': 'An error occurred when selling stock. Please try again later'}, status=500)
+
+    return JsonResponse({'message': 'Stock(s) sold successfully!'}, status=201)
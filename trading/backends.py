@@ -0,0 +1,23 @@
+from django.contrib.auth.backends import ModelBackend
+
+from .models import User
+
+
+class PortfolioBackend(ModelBackend):
+    """
+    ModelBackend loading the user's portfolio in the same query as the user, so the views
+    reading request.portfolio (see PortfolioMiddleware) don't need a query of their own
+    """
+    def get_user(self, user_id):
+        try:
+            user = User._default_manager.select_related('portfolio').get(pk=user_id)
+        except User.DoesNotExist:
+            return None
+        return user if self.user_can_authenticate(user) else None
+
+    async def aget_user(self, user_id):
+        try:
+            user = await User._default_manager.select_related('portfolio').aget(pk=user_id)
+        except User.DoesNotExist:
+            return None
+        return user if self.user_can_authenticate(user) else None
@@ -0,0 +1,394 @@
+# Process-wide catalog of listed symbols, compiled from the listings file into a memory-mapped binary file
+import copy
+import csv
+import json
+import mmap
+import os
+import re
+import sys
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import date
+
+from django.conf import settings
+
+
+MAGIC = b'STKCAT03' # Changed whenever the layout changes, so that older files are recompiled
+ALIGNMENT = 8
+
+# Names are stored whole, and truncated when rows are returned
+NAME_LENGTH = 50
+
+# Start of every word of a case-folded name: a letter or digit that doesn't follow one
+WORD_START = re.compile(r'(?<![^\W_])[^\W_]')
+
+
+def catalog_path(listing_path):
+    """Return the path of the catalog file compiled from a listings file: next to it, with a .bin extension"""
+    return os.path.splitext(listing_path)[0] + '.bin'
+
+
+def read_listing(path):
+    """Return the rows of a listings file as dicts, and the file's mtime"""
+    with open(path, 'r') as file:
+        mtime = os.fstat(file.fileno()).st_mtime
+        return list(csv.DictReader(file)), mtime
+
+
+def _ordinal(value: str):
+    """Return the ordinal of an ISO date of the listings file, 0 for 'null'"""
+    return date.fromisoformat(value).toordinal() if value and value != 'null' else 0
+
+
+def _groups(codes, size: int):
+    """Return the rows grouped by code, ascending within a group, and the start of each group in them"""
+    groups = [[] for _ in range(size)]
+    for row, code in enumerate(codes):
+        groups[code].append(row)
+    starts = array('I', [0])
+    for group in groups:
+        starts.append(starts[-1] + len(group))
+    return array('I', (row for group in groups for row in group)), starts
+
+
+def write_catalog(path, rows, mtime=None):
+    """
+    Compile rows of the listings file (dicts keyed by its columns) into a catalog file.
+
+    The file holds a header (MAGIC, then the length and JSON of a directory locating the
+    sections) followed by the sections, native-endian arrays aligned on 8 bytes:
+
+        symbols                  fixed-width ASCII symbols, NUL-padded, sorted
+        name_offsets             offset of each row's name in 'names', plus the end of the last one
+        names                    the UTF-8 names, concatenated
+        folded_offsets,          the same for the case-folded names (str.casefold, so that e.g.
+        folded_names             'Straße' is searched as 'strasse'), which search compares
+        exchanges, asset_types,  per-row codes, indexes into the directory's lists of names
+        statuses
+        ipo_dates,               per-row date ordinals, 0 when missing
+        delisting_dates
+        exchange_rows,           rows grouped by exchange, by asset type, and by (exchange, asset
+        asset_type_rows,         type) pair, with the start of each group in the matching
+        pair_rows                *_starts section: every filter is a slice of one of them
+        by_name                  rows sorted by folded name
+        word_rows, word_offsets  row and folded name offset of every later word of a name, sorted
+                                 by the folded name from that word on
+
+    'mtime' is the mtime of the listings file, recorded to detect when it changes. The file is
+    written under a temporary name and renamed, so readers never see a partial file.
+    """
+    rows = sorted(rows, key=lambda row: row['symbol'])
+    symbols = [row['symbol'].encode('ascii') for row in rows]
+    names = [row['name'].encode() for row in rows]
+    exchanges = sorted({row['exchange'] for row in rows})
+    asset_types = sorted({row['assetType'] for row in rows})
+    statuses = sorted({row['status'] for row in rows})
+    if max(len(exchanges), len(asset_types), len(statuses)) > 255:
+        raise ValueError("Too many exchanges, asset types or statuses for one byte codes")
+    exchange_codes = bytes(exchanges.index(row['exchange']) for row in rows)
+    asset_type_codes = bytes(asset_types.index(row['assetType']) for row in rows)
+    pair_codes = [exchange * len(asset_types) + asset_type for exchange, asset_type in zip(exchange_codes, asset_type_codes)]
+    exchange_rows, exchange_starts = _groups(exchange_codes, len(exchanges))
+    asset_type_rows, asset_type_starts = _groups(asset_type_codes, len(asset_types))
+    pair_rows, pair_starts = _groups(pair_codes, len(exchanges) * len(asset_types))
+
+    folded_names = [row['name'].casefold() for row in rows]
+    # Offsets in the UTF-8 bytes of the folded names, which search compares
+    words = sorted(
+        (name[match.start():].encode(), row, len(name[:match.start()].encode()))
+        for row, name in enumerate(folded_names)
+        for match in WORD_START.finditer(name) if match.start()
+    )
+    folded_names = [name.encode() for name in folded_names]
+    if any(offset > 0xFFFF for _, _, offset in words):
+        raise ValueError("Names must be shorter than 64 KiB")
+
+    width = max(map(len, symbols), default=1)
+    sections = {
+        'symbols': ('B', b''.join(symbol.ljust(width, b'\0') for symbol in symbols)),
+        'name_offsets': ('I', _offsets(names)),
+        'names': ('B', b''.join(names)),
+        'folded_offsets': ('I', _offsets(folded_names)),
+        'folded_names': ('B', b''.join(folded_names)),
+        'exchanges': ('B', exchange_codes),
+        'asset_types': ('B', asset_type_codes),
+        'statuses': ('B', bytes(statuses.index(row['status']) for row in rows)),
+        'ipo_dates': ('i', array('i', (_ordinal(row['ipoDate']) for row in rows))),
+        'delisting_dates': ('i', array('i', (_ordinal(row['delistingDate']) for row in rows))),
+        'exchange_rows': ('I', exchange_rows),
+        'exchange_starts': ('I', exchange_starts),
+        'asset_type_rows': ('I', asset_type_rows),
+        'asset_type_starts': ('I', asset_type_starts),
+        'pair_rows': ('I', pair_rows),
+        'pair_starts': ('I', pair_starts),
+        'by_name': ('I', array('I', sorted(range(len(rows)), key=folded_names.__getitem__))),
+        'word_rows': ('I', array('I', (row for _, row, _ in words))),
+        'word_offsets': ('H', array('H', (offset for _, _, offset in words))),
+    }
+
+    directory = {
+        'byteorder': sys.byteorder, 'mtime': mtime, 'rows': len(rows), 'symbol_width': width,
+        'exchanges': exchanges, 'asset_types': asset_types, 'statuses': statuses, 'sections': {},
+    }
+    # The directory's size depends on the offsets it lists, so they are laid out after a generous estimate
+    offset = _align(len(MAGIC) + 4 + len(json.dumps(directory)) + 64 * len(sections))
+    for name, (typecode, data) in sections.items():
+        size = len(bytes(data))
+        directory['sections'][name] = [offset, size, typecode]
+        offset = _align(offset + size)
+    header = json.dumps(directory).encode()
+    start = directory['sections']['symbols'][0]
+    if len(MAGIC) + 4 + len(header) > start:
+        raise ValueError("Catalog directory too large")
+
+    temporary = f'{path}.{os.getpid()}.tmp'
+    with open(temporary, 'wb') as file:
+        file.write(MAGIC + len(header).to_bytes(4, 'little') + header)
+        for name, (typecode, data) in sections.items():
+            file.seek(directory['sections'][name][0])
+            file.write(bytes(data))
+        file.truncate(max(offset, start))
+    os.replace(temporary, path)
+
+
+def _offsets(values):
+    """Return the offset of each value in their concatenation, plus the end of the last one"""
+    offsets = array('I', [0])
+    for value in values:
+        offsets.append(offsets[-1] + len(value))
+    return offsets
+
+
+def _align(offset: int):
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+def compile_catalog(listing_path, path=None):
+    """Compile a listings file into its catalog file (see catalog_path). Returns the path of the catalog file"""
+    path = path or catalog_path(listing_path)
+    rows, mtime = read_listing(listing_path)
+    write_catalog(path, rows, mtime)
+    return path
+
+
+class SymbolCatalog:
+    """
+    Read-only view of the listings of a catalog file (see write_catalog).
+
+    The file is memory-mapped, so every process serving the app shares its pages, and
+    lookups read the columns in place: no Python object is kept per row. Indexing or slicing
+    the catalog returns rows as {'symbol', 'name'} dicts, which lets it be paginated directly;
+    listing() returns every column of a symbol.
+
+    filter() narrows the view to an exchange and/or asset type. Its rows are a slice of an
+    array grouped by those columns, so filtering costs nothing and paging a view O(page size).
+
+    Symbols are found by binary search on the sorted symbol column. Searches ignore case (names
+    are case-folded when the file is compiled) and are ranked in tiers: exact symbol, symbol
+    prefix, name prefix, then prefix of any later word of the name (e.g. 'inc' or 'business
+    machines'). Each of these is a sorted array searched with bisect, in O(log n + limit) whatever
+    the catalog size, plus the matches outside the view. Only when they find fewer than 'limit'
+    rows does a last tier look for the query anywhere in symbols and names (e.g. 'soft' in
+    'Microsoft'), as a bytes.find over their columns.
+
+    A catalog is never closed: requests may still be reading it when the listings are reloaded,
+    so the file is unmapped when the last reference to the catalog or its views is dropped.
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as file:
+            self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.map[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} is not a catalog file of this version")
+        size = int.from_bytes(self.map[len(MAGIC):len(MAGIC) + 4], 'little')
+        directory = json.loads(self.map[len(MAGIC) + 4:len(MAGIC) + 4 + size])
+        if directory['byteorder'] != sys.byteorder:
+            raise ValueError(f"{path} was compiled on a machine of another byte order")
+        self.mtime = directory['mtime']
+        self.width = directory['symbol_width']
+        self.exchange_names = directory['exchanges']
+        self.asset_type_names = directory['asset_types']
+        self.status_names = directory['statuses']
+        self.sections = directory['sections']
+        view = memoryview(self.map)
+        for name, (offset, size, typecode) in self.sections.items():
+            setattr(self, name, view[offset:offset + size].cast(typecode))
+        self.rows = directory['rows']
+        # The rows of this view, and the codes they are filtered on (None for any)
+        self.view = range(self.rows)
+        self.exchange = self.asset_type = None
+
+    @classmethod
+    def load(cls, listing_path):
+        """Open the catalog file of a listings file, compiling it first if it is missing or out of date"""
+        path = catalog_path(listing_path)
+        mtime = os.stat(listing_path).st_mtime
+        try:
+            catalog = cls(path)
+            if catalog.mtime == mtime:
+                return catalog
+        except (OSError, ValueError):
+            pass
+        compile_catalog(listing_path, path)
+        return cls(path)
+
+    def filter(self, exchange: str = None, asset_type: str = None):
+        """
+        Return a view of the listings of the whole catalog on 'exchange' and of 'asset_type' (e.g.
+        'NASDAQ', 'Stock'), either of them being optional. Unknown values match nothing
+        """
+        view = copy.copy(self)
+        view.exchange = None if exchange is None else self._code(self.exchange_names, exchange)
+        view.asset_type = None if asset_type is None else self._code(self.asset_type_names, asset_type)
+        if view.exchange == -1 or view.asset_type == -1:
+            view.view = range(0)
+        elif view.exchange is not None and view.asset_type is not None:
+            view.view = self._group(self.pair_rows, self.pair_starts, view.exchange * len(self.asset_type_names) + view.asset_type)
+        elif view.exchange is not None:
+            view.view = self._group(self.exchange_rows, self.exchange_starts, view.exchange)
+        elif view.asset_type is not None:
+            view.view = self._group(self.asset_type_rows, self.asset_type_starts, view.asset_type)
+        else:
+            view.view = range(self.rows)
+        return view
+
+    @staticmethod
+    def _code(names, value: str):
+        return names.index(value) if value in names else -1
+
+    @staticmethod
+    def _group(rows, starts, code: int):
+        return rows[starts[code]:starts[code + 1]]
+
+    def _symbol(self, row: int):
+        return bytes(self.symbols[row * self.width:(row + 1) * self.width]).rstrip(b'\0')
+
+    def _name(self, row: int):
+        return bytes(self.names[self.name_offsets[row]:self.name_offsets[row + 1]])
+
+    def _folded(self, row: int):
+        return bytes(self.folded_names[self.folded_offsets[row]:self.folded_offsets[row + 1]])
+
+    def _find(self, symbol: str):
+        """Return the row of a symbol listed in this view, or None"""
+        key = symbol.encode('ascii', 'replace')
+        row = bisect_left(range(self.rows), key, key=self._symbol)
+        return row if row < self.rows and self._symbol(row) == key and self._in_view(row) else None
+
+    def _in_view(self, row: int):
+        return (
+            (self.exchange is None or self.exchanges[row] == self.exchange)
+            and (self.asset_type is None or self.asset_types[row] == self.asset_type)
+        )
+
+    def _row(self, row: int):
+        name = self._name(row).decode()
+        return {'symbol': self._symbol(row).decode('ascii'), 'name': name if len(name) < NAME_LENGTH else name[:NAME_LENGTH]+'...'}
+
+    def __len__(self):
+        return len(self.view)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return [self._row(row) for row in self.view[key]]
+        return self._row(self.view[key])
+
+    def __iter__(self):
+        return (self._row(row) for row in self.view)
+
+    def __contains__(self, symbol):
+        return self._find(symbol) is not None
+
+    def get(self, symbol: str):
+        """Return the row of a symbol, or None if it is not listed"""
+        row = self._find(symbol)
+        return None if row is None else self._row(row)
+
+    def listing(self, symbol: str):
+        """Return every column of a symbol's listing, with dates as date objects (None when missing), or None if it is not listed"""
+        row = self._find(symbol)
+        if row is None:
+            return None
+        ipo_date, delisting_date = self.ipo_dates[row], self.delisting_dates[row]
+        return {
+            'symbol': self._symbol(row).decode('ascii'),
+            'name': self._name(row).decode(),
+            'exchange': self.exchange_names[self.exchanges[row]],
+            'asset_type': self.asset_type_names[self.asset_types[row]],
+            'ipo_date': date.fromordinal(ipo_date) if ipo_date else None,
+            'delisting_date': date.fromordinal(delisting_date) if delisting_date else None,
+            'status': self.status_names[self.statuses[row]],
+        }
+
+    def _with_prefix(self, count: int, key, prefix: bytes):
+        """Yield the positions 0 <= i < count whose key(i) starts with 'prefix', in order"""
+        for i in range(bisect_left(range(count), prefix, key=key), count):
+            if not key(i).startswith(prefix):
+                return
+            yield i
+
+    def _containing(self, section: str, offsets, value: bytes):
+        """Yield the rows whose value in a section of concatenated values contains 'value', in order"""
+        base, size, _ = self.sections[section]
+        row, start = 0, self.map.find(value, base, base + size)
+        while start != -1:
+            row = bisect_right(offsets, start - base, lo=row) - 1
+            end = base + offsets[row + 1]
+            if start + len(value) <= end:
+                yield row
+                start = end # The rest of the row can't match again
+            else:
+                start += 1
+            start = self.map.find(value, start, base + size)
+
+    def search(self, query: str, limit: int = 10):
+        """Return up to 'limit' rows of this view whose symbol or name matches 'query', most relevant first"""
+        query = ' '.join(query.casefold().split())
+        if not query or limit <= 0:
+            return []
+        prefix = query.encode()
+        symbol = query.upper().encode()
+        tiers = (
+            # The exact symbol sorts first among the symbols starting with the query
+            self._with_prefix(self.rows, self._symbol, symbol),
+            (self.by_name[i] for i in self._with_prefix(len(self.by_name), lambda i: self._folded(self.by_name[i]), prefix)),
+            (self.word_rows[i] for i in self._with_prefix(
+                len(self.word_rows), lambda i: self._folded(self.word_rows[i])[self.word_offsets[i]:], prefix,
+            )),
+            # Symbols are fixed-width, so their offsets are a range
+            self._containing('symbols', range(0, (self.rows + 1) * self.width, self.width), symbol),
+            self._containing('folded_names', self.folded_offsets, prefix),
+        )
+        results, seen = [], set()
+        for tier in tiers:
+            for row in tier:
+                if row not in seen and self._in_view(row):
+                    seen.add(row)
+                    results.append(self._row(row))
+                    if len(results) == limit:
+                        return results
+        return results
+
+
+_catalog = None
+_catalog_lock = threading.Lock()
+
+
+def get_catalog():
+    """Return the shared symbol catalog, reloading it if the listings file has changed (see SymbolCatalog on the old one)"""
+    global _catalog
+    path = settings.SYMBOL_LISTING_FILE
+    mtime = os.stat(path).st_mtime
+    catalog = _catalog
+    if catalog is None or catalog.mtime != mtime:
+        with _catalog_lock:
+            if _catalog is None or _catalog.mtime != mtime:
+                _catalog = SymbolCatalog.load(path)
+            catalog = _catalog
+    return catalog
+
+
+def get_stocks(exchange: str = None, asset_type: str = 'Stock'):
+    """Return the view of the shared catalog listing the tradable stocks (or another asset type, e.g. 'ETF'), on 'exchange' if given"""
+    return get_catalog().filter(exchange=exchange, asset_type=asset_type)
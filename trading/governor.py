@@ -0,0 +1,107 @@
+# Rate limiting and circuit breaking of upstream API calls, shared by all workers through the cache
+import time
+
+
+class QuoteUnavailable(Exception):
+    """Raised instead of calling the quote API when it is rate limited or failing"""
+
+    def __init__(self, message: str, retry_after: float = 0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class Throttled(QuoteUnavailable):
+    """Raised when no request slot frees up in time"""
+
+
+class CircuitOpen(QuoteUnavailable):
+    """Raised while the circuit breaker is open"""
+
+
+class RateGovernor:
+    """
+    Request quotas shared by all workers through the cache.
+
+    Each (tokens, seconds) limit allows 'tokens' requests per fixed window of 'seconds'. A request
+    is counted with an atomic incr() of the counter of the current window, so workers never need
+    to lock each other out. Windows are fixed rather than sliding: up to twice the quota may go
+    through around the boundary between two windows, so limits should leave that headroom.
+    """
+
+    def __init__(self, cache, limits, prefix: str = 'quote-rate:'):
+        self.cache = cache
+        self.limits = limits
+        self.prefix = prefix
+
+    def _take(self, key: str, seconds: int):
+        """Count a request in the window counter 'key' and return the new count"""
+        self.cache.add(key, 0, timeout=seconds + 1)
+        try:
+            return self.cache.incr(key)
+        except ValueError:
+            # Counter was evicted between add() and incr()
+            self.cache.set(key, 1, timeout=seconds + 1)
+            return 1
+
+    def _release(self, keys):
+        """Uncount a request from the window counters 'keys'"""
+        for key in keys:
+            try:
+                self.cache.decr(key)
+            except ValueError:
+                pass # Evicted: nothing left to give back
+
+    def acquire(self):
+        """
+        Count a request in every window. Returns 0, or the seconds until the full window ends.
+
+        A refused request is not counted in any window, so that callers retrying it don't use
+        up the quota of the other windows.
+        """
+        now = time.time()
+        taken = []
+        for tokens, seconds in self.limits:
+            window = int(now // seconds)
+            key = f'{self.prefix}{seconds}:{window}'
+            count = self._take(key, seconds)
+            taken.append(key)
+            if count > tokens:
+                self._release(taken)
+                return (window + 1) * seconds - now
+        return 0
+
+
+class CircuitBreaker:
+    """
+    Stops calling an upstream that keeps failing, shared by all workers through the cache.
+
+    Opens after 'threshold' consecutive failures and rejects calls for 'cooldown' seconds.
+    Calls then go through again: a success closes the breaker, a failure reopens it.
+    """
+
+    def __init__(self, cache, threshold: int, cooldown: float, prefix: str = 'quote-breaker:'):
+        self.cache = cache
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures_key = f'{prefix}failures'
+        self.open_key = f'{prefix}open-until'
+
+    def check(self):
+        """Raise CircuitOpen if the breaker is open"""
+        open_until = self.cache.get(self.open_key)
+        if open_until is not None and open_until > time.time():
+            raise CircuitOpen('Quote API circuit breaker is open', retry_after=open_until - time.time())
+
+    def record_success(self):
+        self.cache.delete(self.failures_key)
+
+    def record_failure(self, trip: bool = False):
+        """Count a failed call, opening the breaker at the threshold or right away if 'trip' is set"""
+        self.cache.add(self.failures_key, 0, timeout=None)
+        try:
+            failures = self.cache.incr(self.failures_key)
+        except ValueError:
+            self.cache.set(self.failures_key, 1, timeout=None)
+            failures = 1
+        if trip or failures >= self.threshold:
+            self.cache.set(self.open_key, time.time() + self.cooldown, timeout=self.cooldown)
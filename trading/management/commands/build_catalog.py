@@ -0,0 +1,17 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from trading.catalog import SymbolCatalog, catalog_path, compile_catalog
+
+
+class Command(BaseCommand):
+    help = "Compile the listings file into the memory-mapped symbol catalog file, e.g. at deploy time before the web workers start"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--listing', default=settings.SYMBOL_LISTING_FILE, help='Listings file to compile (default: SYMBOL_LISTING_FILE)')
+        parser.add_argument('--output', help='Catalog file to write (default: the listings file with a .bin extension)')
+
+    def handle(self, *args, **options):
+        path = compile_catalog(options['listing'], options['output'] or catalog_path(options['listing']))
+        catalog = SymbolCatalog(path)
+        self.stdout.write(f"{len(catalog)} listings ({len(catalog.filter(asset_type='Stock'))} stocks) compiled to {path}")
@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from trading.governor import QuoteUnavailable
+from trading.models import StockHolding
+from trading.prices import fetch_daily_prices, ingest_prices, parse_price_csv
+
+
+class Command(BaseCommand):
+    help = "Load daily prices into the price history, from the API or from CSV files. Prices already stored are skipped"
+
+    def add_arguments(self, parser):
+        parser.add_argument('symbols', nargs='*', help='Symbols to fetch from the API')
+        parser.add_argument('--held', action='store_true', help='Also fetch every symbol held in a portfolio')
+        parser.add_argument('--full', action='store_true', help='Fetch the full history instead of the last 100 days')
+        parser.add_argument('--file', action='append', default=[], help="CSV file to load (timestamp,open,high,low,close,volume), may be repeated")
+        parser.add_argument('--symbol', help="Symbol of the rows of files without a 'symbol' column")
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--wait', type=float, default=60, help='Seconds to wait for the API request quota before giving up')
+
+    def handle(self, *args, **options):
+        symbols = [symbol.upper() for symbol in options['symbols']]
+        if options['held']:
+            symbols += StockHolding.objects.values_list('stock_symbol', flat=True).distinct().order_by('stock_symbol')
+        if not symbols and not options['file']:
+            raise CommandError("Give symbols to fetch, --held, or --file")
+
+        for path in options['file']:
+            try:
+                with open(path, 'r', newline='') as file:
+                    inserted = ingest_prices(parse_price_csv(file, options['symbol']), options['batch_size'])
+            except (OSError, KeyError, ValueError) as e:
+                raise CommandError(f"Could not load {path}: {e!r}")
+            self.stdout.write(f"{path}: {inserted} new prices")
+
+        for symbol in dict.fromkeys(symbols):
+            try:
+                rows = fetch_daily_prices(symbol, options['full'], wait=options['wait'])
+            except QuoteUnavailable as e:
+                raise CommandError(f"Stopped at {symbol}: {e}")
+            except Exception as e:
+                self.stderr.write(self.style.WARNING(f"{symbol}: could not fetch prices ({e!r})"))
+                continue
+            inserted = ingest_prices(rows, options['batch_size'])
+            self.stdout.write(f"{symbol}: {len(rows)} prices, {inserted} new")
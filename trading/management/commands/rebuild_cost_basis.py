@@ -0,0 +1,88 @@
+from decimal import Decimal
+from functools import partial
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F
+
+from trading.models import Portfolio, StockHolding, Transaction, sold_cost
+from trading.valuation import invalidate_portfolio_value
+
+
+def replay(trades):
+    """
+    Replay a user's (symbol, type, quantity, total) trades, in order, with the arithmetic of
+    Transaction.save. Returns the open positions, as symbol -> [quantity, cost basis, realized P&L],
+    and the lifetime realized P&L
+    """
+    positions, realized_pnl = {}, Decimal(0)
+    for symbol, transaction_type, quantity, total in trades:
+        position = positions.setdefault(symbol, [0, Decimal(0), Decimal(0)])
+        if transaction_type == Transaction.BUY:
+            position[0] += quantity
+            position[1] += total
+        else:
+            # A ledger selling more than it bought is reported as a quantity drift
+            sold = min(quantity, position[0])
+            cost = sold_cost(position[1], position[0], sold) if sold else Decimal(0)
+            position[0] -= sold
+            position[1] -= cost
+            position[2] += total - cost
+            realized_pnl += total - cost
+        if not position[0]:
+            del positions[symbol]
+    return positions, realized_pnl
+
+
+class Command(BaseCommand):
+    help = "Rebuild the cost basis and realized P&L of holdings and portfolios from the transaction ledger, and report drift"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only report drift, without fixing it')
+        parser.add_argument('--chunk-size', type=int, default=2000, help='Transactions fetched from the database at a time')
+
+    def handle(self, *args, **options):
+        checked = drifted = 0
+        for user_id in Portfolio.objects.order_by('user_id').values_list('user_id', flat=True).iterator():
+            checked += 1
+            drifted += self.rebuild(user_id, options['dry_run'], options['chunk_size'])
+
+        action = 'reported' if options['dry_run'] else 'fixed'
+        self.stdout.write(f"{checked} portfolios checked, {drifted} with drift {action}")
+
+    def rebuild(self, user_id, dry_run, chunk_size):
+        """Check the portfolio of a user against its ledger, and fix it unless 'dry_run'. Returns whether it drifted"""
+        with transaction.atomic():
+            # Lock the portfolio like Transaction.save does, so no trade lands during the replay
+            portfolio = Portfolio.objects.select_for_update().get(user_id=user_id)
+            trades = (
+                Transaction.objects.filter(user_id=user_id).order_by('timestamp', 'id')
+                .values_list('stock_symbol', 'transaction_type', 'quantity', 'total')
+                .iterator(chunk_size=chunk_size)
+            )
+            positions, realized_pnl = replay(trades)
+
+            drift = []
+            if portfolio.realized_pnl != realized_pnl:
+                drift.append(f"realized P&L {portfolio.realized_pnl} != {realized_pnl}")
+
+            stale = []
+            for holding in StockHolding.objects.filter(portfolio=portfolio).order_by('stock_symbol'):
+                quantity, cost_basis, pnl = positions.pop(holding.stock_symbol, (0, Decimal(0), Decimal(0)))
+                # Quantities are the source of truth for trading, so they are reported but never changed
+                if holding.quantity != quantity:
+                    drift.append(f"{holding.stock_symbol}: quantity {holding.quantity} != {quantity}, not fixed")
+                if (holding.cost_basis, holding.realized_pnl) != (cost_basis, pnl):
+                    drift.append(f"{holding.stock_symbol}: cost basis {holding.cost_basis} != {cost_basis}, realized P&L {holding.realized_pnl} != {pnl}")
+                    holding.cost_basis, holding.realized_pnl = cost_basis, pnl
+                    stale.append(holding)
+            for symbol, (quantity, _, _) in positions.items():
+                drift.append(f"{symbol}: quantity 0 != {quantity}, not fixed")
+
+            for line in drift:
+                self.stdout.write(f"User {user_id}: {line}")
+            if drift and not dry_run:
+                Portfolio.objects.filter(pk=portfolio.pk).update(realized_pnl=realized_pnl, version=F('version') + 1)
+                StockHolding.objects.bulk_update(stale, ['cost_basis', 'realized_pnl'])
+                transaction.on_commit(partial(invalidate_portfolio_value, user_id))
+        return bool(drift)
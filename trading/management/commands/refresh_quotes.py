@@ -0,0 +1,35 @@
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.management.base import BaseCommand
+
+from trading.models import StockHolding
+from trading.quotes import get_recent_symbols, refresh_quotes
+
+
+class Command(BaseCommand):
+    help = "Keep the quotes of held and recently looked up symbols warm in the shared quote cache"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=settings.QUOTE_REFRESH_INTERVAL, help='Seconds between two passes')
+        parser.add_argument('--once', action='store_true', help='Run a single pass and exit')
+
+    def handle(self, *args, **options):
+        interval = options['interval']
+        if isinstance(caches[settings.QUOTE_CACHE_ALIAS], LocMemCache) and not options['once']:
+            self.stderr.write(self.style.WARNING(
+                "The quote cache is local to this process, so web workers won't see the refreshed quotes. Set CACHE_BACKEND to a shared cache."
+            ))
+
+        while True:
+            started = time.monotonic()
+            # Every held symbol, plus the symbols users looked up recently
+            symbols = set(StockHolding.objects.values_list('stock_symbol', flat=True).distinct()) | get_recent_symbols()
+            # Quotes expiring before the next pass are refreshed now
+            refreshed, due = refresh_quotes(symbols, margin=interval)
+            self.stdout.write(f"{len(symbols)} hot symbols, {due} due, {len(refreshed)} refreshed")
+            if options['once']:
+                return
+            time.sleep(max(0, interval - (time.monotonic() - started)))
@@ -0,0 +1,183 @@
+# Per-request performance metrics: collection, Server-Timing and log output, Prometheus histograms
+import contextvars
+import logging
+import threading
+import time
+from bisect import bisect_left
+
+
+logger = logging.getLogger(__name__)
+
+# Bucket upper bounds of the histograms
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+
+class RequestMetrics:
+    """
+    What one request spent its time on. Updated from the request's thread, from the thread the
+    ORM runs in for async views, and from the workers that fetch the quotes of a batch lookup
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.db_queries = 0
+        self.db_time = 0.0
+        self.quote_calls = [] # Seconds taken by each upstream quote call
+        self.quote_events = {} # Quote cache event (see quotes.STATS_EVENTS) -> count
+
+    def add_query(self, seconds: float):
+        with self.lock:
+            self.db_queries += 1
+            self.db_time += seconds
+
+
+# Metrics of the request being served, if it is measured
+_current = contextvars.ContextVar('request_metrics', default=None)
+
+
+def start_request():
+    """Start measuring the current request. Returns its metrics, and a token for end_request"""
+    metrics = RequestMetrics()
+    return metrics, _current.set(metrics)
+
+
+def end_request(token):
+    _current.reset(token)
+
+
+def record_quote_call(seconds: float):
+    """Record an upstream quote call made for the current request"""
+    metrics = _current.get()
+    if metrics is not None:
+        with metrics.lock:
+            metrics.quote_calls.append(seconds)
+
+
+def record_quote_event(event: str):
+    """Record a quote cache event of the current request"""
+    metrics = _current.get()
+    if metrics is not None:
+        with metrics.lock:
+            metrics.quote_events[event] = metrics.quote_events.get(event, 0) + 1
+
+
+def time_query(execute, sql, params, many, context):
+    """Database execute wrapper timing the queries of measured requests"""
+    metrics = _current.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.add_query(time.perf_counter() - start)
+
+
+def server_timing(metrics: RequestMetrics, duration: float):
+    """Return the Server-Timing header value of a request"""
+    timings = [
+        f'total;dur={duration * 1000:.1f}',
+        f'db;dur={metrics.db_time * 1000:.1f};desc="{metrics.db_queries} queries"',
+        f'quote;dur={sum(metrics.quote_calls) * 1000:.1f};desc="{len(metrics.quote_calls)} calls"',
+    ]
+    if metrics.quote_events:
+        events = ' '.join(f'{event}={count}' for event, count in sorted(metrics.quote_events.items()))
+        timings.append(f'quote-cache;desc="{events}"')
+    return ', '.join(timings)
+
+
+def log_request(view: str, method: str, status: int, metrics: RequestMetrics, duration: float):
+    """Write the metrics of a request as a logfmt line, also passed as the 'metrics' attribute of the record"""
+    record = {
+        'view': view,
+        'method': method,
+        'status': status,
+        'duration_ms': round(duration * 1000, 1),
+        'db_queries': metrics.db_queries,
+        'db_ms': round(metrics.db_time * 1000, 1),
+        'quote_calls': len(metrics.quote_calls),
+        'quote_ms': round(sum(metrics.quote_calls, 0.0) * 1000, 1),
+        **{f'quote_{event}': count for event, count in sorted(metrics.quote_events.items())},
+    }
+    logger.info(' '.join(f'{key}={value}' for key, value in record.items()), extra={'metrics': record})
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1) # The last one is +Inf
+        self.sum = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+
+class Registry:
+    """Histograms and counters aggregated over the requests served by this process, per view name"""
+
+    # name -> (type, help, buckets of histograms)
+    METRICS = {
+        'stockly_requests_total': ('counter', 'Requests served', None),
+        'stockly_request_duration_seconds': ('histogram', 'Wall time of requests', SECONDS_BUCKETS),
+        'stockly_request_db_queries': ('histogram', 'Database queries per request', QUERY_BUCKETS),
+        'stockly_request_db_seconds': ('histogram', 'Time spent in database queries per request', SECONDS_BUCKETS),
+        'stockly_quote_upstream_seconds': ('histogram', 'Latency of upstream quote API calls', SECONDS_BUCKETS),
+        'stockly_quote_cache_events_total': ('counter', 'Quote cache hits, misses and other events', None),
+    }
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.series = {} # (name, labels) -> Histogram or count
+
+    def _observe(self, name: str, labels: tuple, value):
+        series = self.series.get((name, labels))
+        if series is None:
+            series = self.series[(name, labels)] = Histogram(self.METRICS[name][2])
+        series.observe(value)
+
+    def _increment(self, name: str, labels: tuple, value: int = 1):
+        self.series[(name, labels)] = self.series.get((name, labels), 0) + value
+
+    def record(self, view: str, method: str, status: int, metrics: RequestMetrics, duration: float):
+        labels = (('view', view),)
+        with self.lock:
+            self._increment('stockly_requests_total', labels + (('method', method), ('status', str(status))))
+            self._observe('stockly_request_duration_seconds', labels, duration)
+            self._observe('stockly_request_db_queries', labels, metrics.db_queries)
+            self._observe('stockly_request_db_seconds', labels, metrics.db_time)
+            for seconds in metrics.quote_calls:
+                self._observe('stockly_quote_upstream_seconds', labels, seconds)
+            for event, count in metrics.quote_events.items():
+                self._increment('stockly_quote_cache_events_total', labels + (('event', event),), count)
+
+    def reset(self):
+        with self.lock:
+            self.series.clear()
+
+    def expose(self):
+        """Return the metrics in the Prometheus text exposition format"""
+        def format_labels(labels):
+            return '{' + ','.join(f'{key}="{value}"' for key, value in labels) + '}'
+
+        lines = []
+        with self.lock:
+            series = sorted(self.series.items())
+            for name, (kind, description, buckets) in self.METRICS.items():
+                lines += [f'# HELP {name} {description}', f'# TYPE {name} {kind}']
+                for (series_name, labels), value in series:
+                    if series_name != name:
+                        continue
+                    if kind == 'counter':
+                        lines.append(f'{name}{format_labels(labels)} {value}')
+                        continue
+                    cumulative = 0
+                    for bound, count in zip((*buckets, '+Inf'), value.counts):
+                        cumulative += count
+                        lines.append(f'{name}_bucket{format_labels(labels + (("le", bound),))} {cumulative}')
+                    lines.append(f'{name}_sum{format_labels(labels)} {value.sum}')
+                    lines.append(f'{name}_count{format_labels(labels)} {cumulative}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
@@ -0,0 +1,73 @@
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.utils.functional import SimpleLazyObject
+
+from . import metrics
+
+
+class PerformanceMiddleware:
+    """
+    Measure the wall time, database queries and time, upstream quote calls and quote cache events
+    of every request. They are sent back in a Server-Timing header, logged to 'trading.metrics',
+    and aggregated per view name for the metrics endpoint. Enabled by PERFORMANCE_METRICS.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.PERFORMANCE_METRICS:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        request_metrics, token = metrics.start_request()
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            metrics.end_request(token)
+        return self.report(request, response, request_metrics, time.perf_counter() - start)
+
+    async def __acall__(self, request):
+        request_metrics, token = metrics.start_request()
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            metrics.end_request(token)
+        return self.report(request, response, request_metrics, time.perf_counter() - start)
+
+    def report(self, request, response, request_metrics, duration):
+        # Streamed content is sent after this point, so only its first chunk is measured
+        match = request.resolver_match
+        view = match.view_name if match else 'unresolved'
+        response['Server-Timing'] = metrics.server_timing(request_metrics, duration)
+        metrics.log_request(view, request.method, response.status_code, request_metrics, duration)
+        metrics.registry.record(view, request.method, response.status_code, request_metrics, duration)
+        return response
+
+
+class PortfolioMiddleware:
+    """
+    Give views the logged in user's portfolio as request.portfolio. It is loaded on first use, at
+    most once per request, and comes with the user itself when PortfolioBackend loaded it
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        request.portfolio = SimpleLazyObject(lambda: request.user.portfolio)
+        # Returns the coroutine of an async handler as is: nothing is done after the view
+        return self.get_response(request)
@@ -0,0 +1,38 @@
+# Generated by Django 5.1.6 on 2026-10-18 03:10
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trading', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name='stockholding',
+            name='unique_stock_holding',
+        ),
+        migrations.AlterField(
+            model_name='stockholding',
+            name='portfolio',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='holdings', to='trading.portfolio'),
+        ),
+        migrations.AlterField(
+            model_name='transaction',
+            name='user',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='transactions', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['user', '-timestamp', '-id'], name='transaction_user_history'),
+        ),
+        migrations.AddConstraint(
+            model_name='stockholding',
+            constraint=models.UniqueConstraint(fields=('portfolio', 'stock_symbol'), name='unique_stock_holding', opclasses=['int8_ops', 'varchar_pattern_ops']),
+        ),
+    ]
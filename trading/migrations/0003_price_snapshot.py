@@ -0,0 +1,29 @@
+# Generated by Django 5.1.6 on 2026-10-18 03:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trading', '0002_trading_query_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PriceSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('stock_symbol', models.CharField(max_length=10)),
+                ('timestamp', models.DateTimeField()),
+                ('open', models.DecimalField(decimal_places=4, max_digits=12, null=True)),
+                ('high', models.DecimalField(decimal_places=4, max_digits=12, null=True)),
+                ('low', models.DecimalField(decimal_places=4, max_digits=12, null=True)),
+                ('close', models.DecimalField(decimal_places=4, max_digits=12)),
+                ('volume', models.BigIntegerField(null=True)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('stock_symbol', 'timestamp'), name='unique_price_snapshot')],
+            },
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.1.6 on 2026-10-18 03:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trading', '0003_price_snapshot'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='portfolio',
+            name='realized_pnl',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=14),
+        ),
+        migrations.AddField(
+            model_name='stockholding',
+            name='cost_basis',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=14),
+        ),
+        migrations.AddField(
+            model_name='stockholding',
+            name='realized_pnl',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=14),
+        ),
+    ]
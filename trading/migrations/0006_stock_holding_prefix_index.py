@@ -0,0 +1,25 @@
+# Generated by Django 5.1.6 on 2026-10-18 04:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trading', '0005_portfolio_version'),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name='stockholding',
+            name='unique_stock_holding',
+        ),
+        migrations.AddIndex(
+            model_name='stockholding',
+            index=models.Index(fields=['portfolio', 'stock_symbol'], name='stock_holding_symbol_prefix', opclasses=['int8_ops', 'varchar_pattern_ops']),
+        ),
+        migrations.AddConstraint(
+            model_name='stockholding',
+            constraint=models.UniqueConstraint(fields=('portfolio', 'stock_symbol'), name='unique_stock_holding'),
+        ),
+    ]
@@ -1,11 +1,28 @@
 from django.db import models
 from django.contrib.auth.models import User
-from django.db import transaction
+from django.db import transaction, connection
+from django.db.models import F
 from django.core.exceptions import ValidationError
-from decimal import Decimal
+from decimal import Decimal, ROUND_HALF_UP
+from functools import partial
 
 # Create your models here.
 
+CENT = Decimal('0.01')
+
+
+def sold_cost(cost_basis: Decimal, quantity: int, sold: int):
+    """Return the share of a holding's cost basis taken out by selling 'sold' of its 'quantity' shares, at average cost"""
+    # Rounded like the ROUND() used by Transaction._remove_from_holding
+    return (cost_basis * sold / quantity).quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+def _invalidate_portfolio_value(user_id):
+    # Imported here: the valuation module depends on these models
+    from .valuation import invalidate_portfolio_value
+    invalidate_portfolio_value(user_id)
+
+
 class Transaction(models.Model):
     BUY = 'BUY'
     SELL = 'SELL'
@@ -14,7 +31,8 @@ class Transaction(models.Model):
         (SELL, 'Sell'),
     ]
 
-    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='transactions')
+    # Indexed by the leading column of 'transaction_user_history'
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='transactions', db_index=False)
     stock_symbol = models.CharField(max_length=10)
     transaction_type = models.CharField(max_length=4, choices=TRANSACTION_TYPES)
     quantity = models.PositiveSmallIntegerField()
@@ -22,48 +40,171 @@ class Transaction(models.Model):
     total = models.DecimalField(max_digits=12, decimal_places=2, editable=False)
     timestamp = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # Transaction history, paginated by descending (timestamp, id)
+            models.Index(fields=['user', '-timestamp', '-id'], name='transaction_user_history'),
+        ]
+
     def save(self, *args, **kwargs):
         # Use atomic transactions for consistency
         with transaction.atomic():
             self.total = Decimal(self.quantity) * Decimal(self.price)
             self.stock_symbol = self.stock_symbol.upper()
-            super().save(*args, **kwargs) # Save the Transaction object
+            amount = self.total.quantize(CENT, rounding=ROUND_HALF_UP) # As stored
 
-            # Get the user's portfolio
-            portfolio = Portfolio.objects.get(user=self.user)
-
-            # Get or create the stock holding
-            holding, created = StockHolding.objects.get_or_create(portfolio=portfolio, stock_symbol=self.stock_symbol)
+            # Balance and quantity are only changed by conditional UPDATEs, so they can never go
+            # negative even under concurrent trades. The portfolio row is always written first:
+            # its row lock serializes the trades of a user without risk of deadlock
+            portfolio = Portfolio.objects.filter(user_id=self.user_id)
 
             # Handle transaction types
             if self.transaction_type == 'BUY':
-                # Ensure user has enough balance for the purchase
-                if portfolio.balance < self.total:
-                    raise ValidationError("Insufficient balance to complete the purchase.")
-
-                # Deduct balance for the purchase
-                portfolio.balance -= self.total
-                portfolio.save()
-                
-                # Increase the stock holding quantity
-                holding.quantity += self.quantity
-                holding.save()
-            
-            else:
-                # Ensure user has enough stock to sell
-                if holding.quantity < self.quantity:
-                    raise ValidationError(f"Insufficient quantity of {self.stock_symbol} to sell.")
+                # Deduct balance for the purchase, if the user has enough of it
+                if not portfolio.filter(balance__gte=self.total).update(balance=F('balance') - self.total, version=F('version') + 1):
+                    raise ValidationError("Insufficient balance to complete the purchase.", code='insufficient_balance')
+
+                # Increase the stock holding quantity and its cost basis
+                self._add_to_holding(amount)
 
+            else:
                 # Add balance for the sale
-                portfolio.balance += self.total
-                portfolio.save()
-                
-                # Decrease the stock holding quantity
-                holding.quantity -= self.quantity
-                if holding.quantity == 0:
-                    holding.delete()
+                portfolio.update(balance=F('balance') + self.total, version=F('version') + 1)
+
+                # Decrease the stock holding quantity and its cost basis, if the user has enough stock to sell
+                cost = self._remove_from_holding(amount)
+                if cost is None:
+                    raise ValidationError(f"Insufficient quantity of {self.stock_symbol} to sell.", code='insufficient_quantity')
+
+                # Book the realized P&L on the portfolio, and delete the holding if it was emptied
+                self._close_sale(amount - cost)
+
+            super().save(*args, **kwargs) # Save the Transaction object
+            transaction.on_commit(partial(_invalidate_portfolio_value, self.user_id))
+
+    @classmethod
+    def create_batch(cls, user, orders):
+        """
+        Execute several trades of a user in one atomic batch.
+
+        'orders' is a list of dicts with 'symbol', 'transaction_type', 'quantity' and 'price'.
+        Orders are validated in sequence against one locked snapshot of the user's portfolio
+        and holdings, then all accepted trades are written with bulk statements. Returns, for
+        each order, the created Transaction or the ValidationError that rejected it.
+        """
+        with transaction.atomic():
+            # Lock the portfolio first, like save(), then the holdings involved
+            portfolio = Portfolio.objects.select_for_update().get(user=user)
+            symbols = {order['symbol'].upper() for order in orders}
+            # symbol -> [quantity, cost basis, realized P&L]
+            positions = {
+                symbol: [quantity, cost_basis, realized_pnl]
+                for symbol, quantity, cost_basis, realized_pnl in StockHolding.objects.select_for_update()
+                .filter(portfolio=portfolio, stock_symbol__in=symbols)
+                .values_list('stock_symbol', 'quantity', 'cost_basis', 'realized_pnl')
+            }
+            balance, realized_pnl = portfolio.balance, Decimal(0)
+
+            results, accepted = [], []
+            for order in orders:
+                trade = cls(
+                    user=user,
+                    stock_symbol=order['symbol'].upper(),
+                    transaction_type=order['transaction_type'],
+                    quantity=order['quantity'],
+                    price=Decimal(str(order['price'])).quantize(Decimal('0.01')),
+                )
+                trade.total = Decimal(trade.quantity) * trade.price
+                position = positions.setdefault(trade.stock_symbol, [0, Decimal(0), Decimal(0)])
+
+                if trade.transaction_type == 'BUY':
+                    if balance < trade.total:
+                        results.append(ValidationError("Insufficient balance to complete the purchase.", code='insufficient_balance'))
+                        continue
+                    balance -= trade.total
+                    position[0] += trade.quantity
+                    position[1] += trade.total
                 else:
-                    holding.save()
+                    if position[0] < trade.quantity:
+                        results.append(ValidationError(f"Insufficient quantity of {trade.stock_symbol} to sell.", code='insufficient_quantity'))
+                        continue
+                    # Same arithmetic as save()
+                    cost = sold_cost(position[1], position[0], trade.quantity)
+                    balance += trade.total
+                    realized_pnl += trade.total - cost
+                    position[0] -= trade.quantity
+                    position[1] -= cost
+                    position[2] += trade.total - cost
+                results.append(trade)
+                accepted.append(trade)
+
+            if accepted:
+                cls.objects.bulk_create(accepted)
+                Portfolio.objects.filter(pk=portfolio.pk).update(balance=balance, realized_pnl=F('realized_pnl') + realized_pnl, version=F('version') + 1)
+
+                # The rows are locked, so the new positions can be written as absolute values
+                traded = {trade.stock_symbol for trade in accepted}
+                StockHolding.objects.bulk_create(
+                    [
+                        StockHolding(portfolio=portfolio, stock_symbol=symbol, quantity=quantity, cost_basis=cost_basis, realized_pnl=pnl)
+                        for symbol, (quantity, cost_basis, pnl) in positions.items() if symbol in traded and quantity
+                    ],
+                    update_conflicts=True,
+                    unique_fields=['portfolio', 'stock_symbol'],
+                    update_fields=['quantity', 'cost_basis', 'realized_pnl'],
+                )
+                emptied = [symbol for symbol in traded if not positions[symbol][0]]
+                if emptied:
+                    StockHolding.objects.filter(portfolio=portfolio, stock_symbol__in=emptied).delete()
+                transaction.on_commit(partial(_invalidate_portfolio_value, user.pk))
+
+        return results
+
+    def _add_to_holding(self, amount: Decimal):
+        """Add the bought quantity and its cost to the user's holding in a single upsert, creating the holding if needed"""
+        holding_table = connection.ops.quote_name(StockHolding._meta.db_table)
+        portfolio_table = connection.ops.quote_name(Portfolio._meta.db_table)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {holding_table} (portfolio_id, stock_symbol, quantity, cost_basis, realized_pnl) "
+                f"SELECT id, %s, %s, %s, 0 FROM {portfolio_table} WHERE user_id = %s "
+                f"ON CONFLICT (portfolio_id, stock_symbol) DO UPDATE SET quantity = {holding_table}.quantity + EXCLUDED.quantity, "
+                f"cost_basis = {holding_table}.cost_basis + EXCLUDED.cost_basis",
+                [self.stock_symbol, self.quantity, amount, self.user_id],
+            )
+
+    def _remove_from_holding(self, amount: Decimal):
+        """
+        Take the sold quantity out of the user's holding in a single UPDATE, along with its share of
+        the cost basis, and add the realized P&L to the holding. Returns the cost of the sold shares,
+        or None if the user doesn't hold enough stock.
+        """
+        holding_table = connection.ops.quote_name(StockHolding._meta.db_table)
+        portfolio_table = connection.ops.quote_name(Portfolio._meta.db_table)
+        with connection.cursor() as cursor:
+            # The portfolio row is locked, so the holding can't change between the subquery and the UPDATE
+            cursor.execute(
+                f"UPDATE {holding_table} AS holding SET quantity = holding.quantity - %s, "
+                f"cost_basis = holding.cost_basis - sold.cost, realized_pnl = holding.realized_pnl + %s - sold.cost "
+                f"FROM (SELECT id, ROUND(cost_basis * %s / quantity, 2) AS cost FROM {holding_table} "
+                f"WHERE portfolio_id = (SELECT id FROM {portfolio_table} WHERE user_id = %s) AND stock_symbol = %s AND quantity >= %s) AS sold "
+                f"WHERE holding.id = sold.id RETURNING sold.cost",
+                [self.quantity, amount, self.quantity, self.user_id, self.stock_symbol, self.quantity],
+            )
+            row = cursor.fetchone()
+        return None if row is None else row[0]
+
+    def _close_sale(self, realized_pnl: Decimal):
+        """Add the realized P&L of a sale to the portfolio and delete the holding if it is now empty, in one statement"""
+        holding_table = connection.ops.quote_name(StockHolding._meta.db_table)
+        portfolio_table = connection.ops.quote_name(Portfolio._meta.db_table)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"WITH emptied AS (DELETE FROM {holding_table} WHERE quantity = 0 AND stock_symbol = %s "
+                f"AND portfolio_id = (SELECT id FROM {portfolio_table} WHERE user_id = %s)) "
+                f"UPDATE {portfolio_table} SET realized_pnl = realized_pnl + %s WHERE user_id = %s",
+                [self.stock_symbol, self.user_id, realized_pnl, self.user_id],
+            )
 
     def __str__(self):
         return f"{self.user.username} {self.transaction_type} {self.quantity} of {self.stock_symbol} at {self.price}"
@@ -72,22 +213,56 @@ class Transaction(models.Model):
 class Portfolio(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='portfolio')
     balance = models.DecimalField(max_digits=10, decimal_places=2, default=10000.00)
+    # Lifetime realized P&L of all sales, including those of positions since closed
+    realized_pnl = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    # Bumped by every trade, in the same statement as the balance. Keys the cached pages of the user
+    version = models.PositiveIntegerField(default=0)
 
     def __str__(self):
         return f"{self.user.username}'s Portfolio"
 
 
 class StockHolding(models.Model):
-    portfolio = models.ForeignKey(Portfolio, on_delete=models.CASCADE, related_name='holdings')
+    # Indexed by the leading column of 'unique_stock_holding'
+    portfolio = models.ForeignKey(Portfolio, on_delete=models.CASCADE, related_name='holdings', db_index=False)
     stock_symbol = models.CharField(max_length=10)
     quantity = models.PositiveIntegerField(default=0)
+    # Maintained by Transaction.save at average cost: the cost of the shares still held, and
+    # the realized P&L of the shares sold since the position was opened
+    cost_basis = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    realized_pnl = models.DecimalField(max_digits=14, decimal_places=2, default=0)
 
     class Meta:
         constraints = [
             models.UniqueConstraint(fields=['portfolio', 'stock_symbol'], name='unique_stock_holding')
         ]
+        indexes = [
+            # Symbol prefix search in a portfolio (sell_search): on PostgreSQL the pattern operator
+            # class lets LIKE 'PREFIX%' use the index whatever the collation, which the unique
+            # index above can't do while it serves equality lookups and ordering
+            models.Index(fields=['portfolio', 'stock_symbol'], opclasses=['int8_ops', 'varchar_pattern_ops'], name='stock_holding_symbol_prefix'),
+        ]
 
     def __str__(self):
         return f"{self.portfolio.user.username}'s {self.stock_symbol}: {self.quantity} shares"
     
-    
\ No newline at end of file
+    
+
+class PriceSnapshot(models.Model):
+    """Price of a stock at a point in time: a daily bar, or a quote captured from the API"""
+    stock_symbol = models.CharField(max_length=10)
+    timestamp = models.DateTimeField()
+    open = models.DecimalField(max_digits=12, decimal_places=4, null=True)
+    high = models.DecimalField(max_digits=12, decimal_places=4, null=True)
+    low = models.DecimalField(max_digits=12, decimal_places=4, null=True)
+    close = models.DecimalField(max_digits=12, decimal_places=4)
+    volume = models.BigIntegerField(null=True)
+
+    class Meta:
+        constraints = [
+            # Makes repeated loads idempotent, and serves lookups of a symbol's history by time
+            models.UniqueConstraint(fields=['stock_symbol', 'timestamp'], name='unique_price_snapshot')
+        ]
+
+    def __str__(self):
+        return f"{self.stock_symbol} at {self.timestamp}: {self.close}"
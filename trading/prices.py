@@ -0,0 +1,106 @@
+# Price history: parsing of daily price CSVs and bulk ingestion into PriceSnapshot
+import csv
+import io
+from datetime import datetime, timezone
+from decimal import Decimal
+from itertools import islice
+
+from django.db import connection, transaction
+
+from .alphavantage import get_client
+from .models import PriceSnapshot
+from .quotes import call_api
+
+
+# Columns of the rows handled by the pipeline, in order
+COLUMNS = ('stock_symbol', 'timestamp', 'open', 'high', 'low', 'close', 'volume')
+
+
+def _parse_timestamp(value: str):
+    """Parse a date ('2025-02-14') or date and time, as UTC unless an offset is given"""
+    timestamp = datetime.fromisoformat(value)
+    return timestamp if timestamp.tzinfo else timestamp.replace(tzinfo=timezone.utc)
+
+
+def _decimal(value):
+    return Decimal(value) if value else None
+
+
+def parse_price_csv(file, symbol: str = None):
+    """
+    Yield price rows, as tuples in COLUMNS order, from a CSV of daily (or intraday) prices.
+
+    The format is the one sent by TIME_SERIES_DAILY with datatype=csv: timestamp, open, high,
+    low, close and volume columns. A file holding several symbols needs a 'symbol' column;
+    otherwise 'symbol' is used for every row.
+    """
+    for row in csv.DictReader(file):
+        row_symbol = row.get('symbol') or symbol
+        if not row_symbol:
+            raise ValueError("No symbol given for the price rows")
+        yield (
+            row_symbol.upper(),
+            _parse_timestamp(row['timestamp']),
+            _decimal(row.get('open')),
+            _decimal(row.get('high')),
+            _decimal(row.get('low')),
+            Decimal(row['close']),
+            int(row['volume']) if row.get('volume') else None,
+        )
+
+
+def fetch_daily_prices(symbol: str, full: bool = False, wait: float = 0):
+    """Fetch the daily prices of a symbol from the API and return them as price rows"""
+    text = call_api(get_client().get_daily_csv, symbol, full, wait=wait)
+    return list(parse_price_csv(io.StringIO(text), symbol))
+
+
+def ingest_prices(rows, batch_size: int = 5000):
+    """
+    Store price rows in batches, skipping those already stored for their (symbol, timestamp).
+
+    Each batch is written in its own transaction: on PostgreSQL it is streamed with COPY into
+    a staging table, then moved over with a single INSERT ... ON CONFLICT DO NOTHING, so
+    repeated loads of the same prices are idempotent. Returns the number of rows inserted.
+    """
+    rows = iter(rows)
+    inserted = 0
+    while batch := list(islice(rows, batch_size)):
+        with transaction.atomic():
+            if connection.vendor == 'postgresql':
+                inserted += _copy_batch(batch)
+            else:
+                inserted += _bulk_create_batch(batch)
+    return inserted
+
+
+def _copy_batch(batch):
+    """Insert a batch of new rows with COPY and a single upsert. Returns the number of rows inserted"""
+    table = connection.ops.quote_name(PriceSnapshot._meta.db_table)
+    columns = ', '.join(connection.ops.quote_name(column) for column in COLUMNS)
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(
+        ['' if value is None else value.isoformat() if isinstance(value, datetime) else value for value in row]
+        for row in batch
+    )
+    buffer.seek(0)
+    with connection.cursor() as cursor:
+        cursor.execute("DROP TABLE IF EXISTS price_snapshot_staging")
+        cursor.execute(f"CREATE TEMPORARY TABLE price_snapshot_staging ON COMMIT DROP AS SELECT {columns} FROM {table} WITH NO DATA")
+        cursor.copy_expert(f"COPY price_snapshot_staging ({columns}) FROM STDIN WITH (FORMAT csv)", buffer)
+        cursor.execute(
+            f"INSERT INTO {table} ({columns}) SELECT {columns} FROM price_snapshot_staging "
+            f"ON CONFLICT (stock_symbol, timestamp) DO NOTHING"
+        )
+        return cursor.rowcount
+
+
+def _bulk_create_batch(batch):
+    """Portable version of _copy_batch, for databases without COPY"""
+    symbols = {row[0] for row in batch}
+    bounds = {'timestamp__gte': min(row[1] for row in batch), 'timestamp__lte': max(row[1] for row in batch)}
+    existing = set(PriceSnapshot.objects.filter(stock_symbol__in=symbols, **bounds).values_list('stock_symbol', 'timestamp'))
+    new = {row[:2]: row for row in batch if row[:2] not in existing}
+    PriceSnapshot.objects.bulk_create([PriceSnapshot(**dict(zip(COLUMNS, row))) for row in new.values()], ignore_conflicts=True)
+    return len(new)
+
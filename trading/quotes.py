@@ -0,0 +1,571 @@
+# Shared quote cache in front of the Alpha Vantage API
+import asyncio
+import contextvars
+import logging
+import threading
+import time
+import weakref
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+
+from . import metrics
+from .alphavantage import QuotaExceeded, UnknownSymbol, get_async_client
+from .catalog import get_catalog
+from .governor import CircuitBreaker, QuoteUnavailable, RateGovernor, Throttled
+from .utils import get_stock_price_data
+
+
+logger = logging.getLogger(__name__)
+
+QUOTE_KEY_PREFIX = 'quote:'
+LOCK_KEY_PREFIX = 'quote-lock:'
+STATS_KEY_PREFIX = 'quote-stats:'
+HOT_KEY_PREFIX = 'quote-hot:'
+STATS_EVENTS = ('hit', 'miss', 'stale', 'coalesced', 'fallback', 'shed')
+
+# Upstream fetches currently running in this process, keyed by symbol
+_inflight: dict[str, Future] = {}
+_inflight_lock = threading.Lock()
+
+# Upstream fetches currently awaited by async views, keyed by event loop then symbol
+_async_inflight = weakref.WeakKeyDictionary()
+
+# When this process last recorded a lookup of each symbol in the hot symbols, and last forgot the old ones
+_hot_marked: dict[str, float] = {}
+_hot_pruned_at = 0.0
+
+# Number of hot symbol keys read per cache round-trip by get_recent_symbols
+HOT_SCAN_BATCH = 1000
+
+# Quote cache events counted by this process since they were last added to the shared counters
+_stats_pending: dict[str, int] = {}
+_stats_lock = threading.Lock()
+_stats_flush_lock = threading.Lock()
+_stats_flushed_at = 0.0
+
+# Seconds between two flushes of the counts of this process to the shared counters
+STATS_FLUSH_INTERVAL = 1
+
+# Background workers used to revalidate stale quotes
+_refresh_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='quote-refresh')
+
+# Workers used to fetch the misses of a batch lookup concurrently
+_fetch_executor = ThreadPoolExecutor(max_workers=settings.QUOTE_FETCH_CONCURRENCY, thread_name_prefix='quote-fetch')
+
+
+def _quote_cache():
+    return caches[settings.QUOTE_CACHE_ALIAS]
+
+
+def _quote_key(symbol: str):
+    return f'{QUOTE_KEY_PREFIX}{symbol}'
+
+
+async def _in_thread(func, *args):
+    """Run blocking cache work on a worker thread, so that a remote cache doesn't block the event loop"""
+    return await sync_to_async(func, thread_sensitive=False)(*args)
+
+
+def get_quote_ttl(symbol: str):
+    """Return the number of seconds a quote for 'symbol' is considered fresh"""
+    return settings.QUOTE_CACHE_SYMBOL_TTLS.get(symbol, settings.QUOTE_CACHE_TTL)
+
+
+def _record(event: str):
+    """
+    Count a cache event. The counts of this process are added to the shared counters at most
+    once every STATS_FLUSH_INTERVAL seconds, on a background worker, so lookups don't pay a
+    cache round-trip per event
+    """
+    global _stats_flushed_at
+    metrics.record_quote_event(event)
+    with _stats_lock:
+        _stats_pending[event] = _stats_pending.get(event, 0) + 1
+        now = time.monotonic()
+        flush = now - _stats_flushed_at >= STATS_FLUSH_INTERVAL
+        if flush:
+            _stats_flushed_at = now
+    if flush:
+        _refresh_executor.submit(_flush_stats)
+
+
+def _flush_stats():
+    """Add the cache events counted by this process to the shared counters"""
+    with _stats_flush_lock:
+        with _stats_lock:
+            counts = dict(_stats_pending)
+            _stats_pending.clear()
+        cache = _quote_cache()
+        for event, count in counts.items():
+            key = f'{STATS_KEY_PREFIX}{event}'
+            cache.add(key, 0, timeout=None)
+            try:
+                cache.incr(key, count)
+            except ValueError:
+                # Counter was evicted between add() and incr()
+                cache.set(key, count, timeout=None)
+
+
+def get_quote_cache_stats():
+    """
+    Return the hit/miss/stale/coalesced/fallback/shed counters of the quote cache. Those of other
+    processes may lag by up to STATS_FLUSH_INTERVAL seconds
+    """
+    _flush_stats()
+    keys = {event: f'{STATS_KEY_PREFIX}{event}' for event in STATS_EVENTS}
+    values = _quote_cache().get_many(keys.values())
+    return {event: values.get(key, 0) for event, key in keys.items()}
+
+
+def reset_quote_cache_stats():
+    """Reset all quote cache counters to zero"""
+    with _stats_flush_lock:
+        with _stats_lock:
+            _stats_pending.clear()
+        _quote_cache().delete_many([f'{STATS_KEY_PREFIX}{event}' for event in STATS_EVENTS])
+
+
+def store_quote(symbol: str, price_data: dict):
+    """Write a freshly fetched quote to the shared cache, and return its cache entry"""
+    # Entries outlive their stale window to be served as the last known quote if the API is unavailable
+    timeout = max(get_quote_ttl(symbol) + settings.QUOTE_CACHE_STALE_TTL, settings.QUOTE_CACHE_LAST_KNOWN_TTL)
+    entry = {'data': price_data, 'fetched_at': time.time()}
+    _quote_cache().set(_quote_key(symbol), entry, timeout=timeout)
+    return entry
+
+
+def _is_fresh(symbol: str, entry):
+    return entry is not None and time.time() - entry['fetched_at'] < get_quote_ttl(symbol)
+
+
+def _get_fresh_entry(symbol: str):
+    """Return the cache entry of a symbol if it is fresh, else None"""
+    entry = _quote_cache().get(_quote_key(symbol))
+    return entry if _is_fresh(symbol, entry) else None
+
+
+def _wait_for_quote(symbol: str):
+    """Poll the cache while another worker fetches 'symbol', and return the entry it stores. Returns None on timeout"""
+    deadline = time.monotonic() + settings.QUOTE_CACHE_LOCK_WAIT
+    while time.monotonic() < deadline:
+        time.sleep(0.05)
+        entry = _get_fresh_entry(symbol)
+        if entry is not None:
+            return entry
+    return None
+
+
+async def _await_quote(symbol: str):
+    """Like _wait_for_quote, without blocking the event loop"""
+    deadline = time.monotonic() + settings.QUOTE_CACHE_LOCK_WAIT
+    while time.monotonic() < deadline:
+        await asyncio.sleep(0.05)
+        entry = await _in_thread(_get_fresh_entry, symbol)
+        if entry is not None:
+            return entry
+    return None
+
+
+def _governor():
+    return RateGovernor(_quote_cache(), settings.ALPHA_VANTAGE_RATE_LIMITS)
+
+
+def _breaker():
+    return CircuitBreaker(_quote_cache(), settings.ALPHA_VANTAGE_BREAKER_THRESHOLD, settings.ALPHA_VANTAGE_BREAKER_COOLDOWN)
+
+
+def _admit(deadline: float):
+    """Return 0 if the API may be called now, else the seconds to wait. Raises QuoteUnavailable to shed the call"""
+    try:
+        _breaker().check()
+        delay = _governor().acquire()
+        if delay and time.monotonic() + delay > deadline:
+            raise Throttled('Quote API request quota reached', retry_after=delay)
+    except QuoteUnavailable:
+        _record('shed')
+        raise
+    return delay
+
+
+def _record_outcome(error: Exception = None):
+    """
+    Report the outcome of an API call to the circuit breaker. Quota messages open it right away,
+    and unknown symbols count as successes: the API answered
+    """
+    if error is None or isinstance(error, UnknownSymbol):
+        _breaker().record_success()
+    else:
+        _breaker().record_failure(trip=isinstance(error, QuotaExceeded))
+
+
+def call_api(func, *args, wait: float = 0):
+    """
+    Return func(*args), a call to the API made through the circuit breaker and the rate governor.
+
+    Waits up to 'wait' seconds for a request slot, and raises QuoteUnavailable if the call is shed.
+    """
+    deadline = time.monotonic() + wait
+    delay = _admit(deadline)
+    while delay:
+        time.sleep(delay)
+        delay = _admit(deadline)
+    start = time.perf_counter()
+    try:
+        result = func(*args)
+    except Exception as e:
+        _record_outcome(e)
+        raise
+    finally:
+        metrics.record_quote_call(time.perf_counter() - start)
+    _record_outcome()
+    return result
+
+
+async def _acall_upstream(symbol: str, wait: float):
+    """Fetch a quote with the async client, like call_api"""
+    deadline = time.monotonic() + wait
+    delay = await _in_thread(_admit, deadline)
+    while delay:
+        await asyncio.sleep(delay)
+        delay = await _in_thread(_admit, deadline)
+    start = time.perf_counter()
+    try:
+        price_data = await get_async_client().get_quote(symbol)
+    except Exception as e:
+        await _in_thread(_record_outcome, e)
+        raise
+    finally:
+        metrics.record_quote_call(time.perf_counter() - start)
+    await _in_thread(_record_outcome)
+    return price_data
+
+
+def _fetch_from_upstream(symbol: str, wait: float = None):
+    """
+    Fetch a quote from the API, store it in the cache and return its cache entry.
+
+    Concurrent calls for the same symbol share a single upstream request: within this
+    process through a shared Future, and across workers through a lock key in the cache.
+    The call may wait 'wait' seconds (default ALPHA_VANTAGE_RATE_LIMIT_WAIT) for the rate
+    governor, and raises QuoteUnavailable if it is shed.
+    """
+    with _inflight_lock:
+        future = _inflight.get(symbol)
+        is_leader = future is None
+        if is_leader:
+            future = Future()
+            _inflight[symbol] = future
+
+    if not is_leader:
+        _record('coalesced')
+        return future.result()
+
+    cache = _quote_cache()
+    lock_key = f'{LOCK_KEY_PREFIX}{symbol}'
+    has_lock = False
+    try:
+        # If another worker is already fetching this symbol, wait for its result
+        has_lock = cache.add(lock_key, 1, timeout=settings.QUOTE_CACHE_LOCK_TIMEOUT)
+        entry = None if has_lock else _wait_for_quote(symbol)
+        if entry is None:
+            price_data = call_api(get_stock_price_data, symbol, wait=settings.ALPHA_VANTAGE_RATE_LIMIT_WAIT if wait is None else wait)
+            entry = store_quote(symbol, price_data)
+        future.set_result(entry)
+        return entry
+    except Exception as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with _inflight_lock:
+            _inflight.pop(symbol, None)
+        if has_lock:
+            cache.delete(lock_key)
+
+
+async def _afetch_from_upstream(symbol: str):
+    """
+    Async version of _fetch_from_upstream, used by the async views.
+
+    Concurrent calls on one event loop share an asyncio Future. Cache operations run on worker
+    threads, and the upstream request is awaited.
+    """
+    loop = asyncio.get_running_loop()
+    inflight = _async_inflight.setdefault(loop, {})
+    future = inflight.get(symbol)
+    if future is not None:
+        _record('coalesced')
+        return await asyncio.shield(future)
+
+    future = inflight[symbol] = loop.create_future()
+    cache = _quote_cache()
+    lock_key = f'{LOCK_KEY_PREFIX}{symbol}'
+    has_lock = False
+    try:
+        # If another worker is already fetching this symbol, wait for its result
+        has_lock = await _in_thread(cache.add, lock_key, 1, settings.QUOTE_CACHE_LOCK_TIMEOUT)
+        entry = None if has_lock else await _await_quote(symbol)
+        if entry is None:
+            price_data = await _acall_upstream(symbol, settings.ALPHA_VANTAGE_RATE_LIMIT_WAIT)
+            entry = await _in_thread(store_quote, symbol, price_data)
+        future.set_result(entry)
+        return entry
+    except Exception as e:
+        future.set_exception(e)
+        future.exception() # Mark as retrieved: there may be no other caller waiting on it
+        raise
+    finally:
+        inflight.pop(symbol, None)
+        if has_lock:
+            await _in_thread(cache.delete, lock_key)
+
+
+def _refresh(symbol: str):
+    try:
+        # Never queue for the rate governor: the stale quote is good enough meanwhile
+        _fetch_from_upstream(symbol, wait=0)
+    except QuoteUnavailable:
+        pass
+    except Exception:
+        logger.warning("Background refresh of quote %s failed", symbol, exc_info=True)
+
+
+def _schedule_refresh(symbol: str):
+    """Revalidate a stale quote in the background unless a fetch is already running"""
+    with _inflight_lock:
+        if symbol in _inflight:
+            return
+    _refresh_executor.submit(_refresh, symbol)
+
+
+def _serve_cached(symbol: str, entry):
+    """Return the cached quote data of an entry, or None on a miss. Stale entries are revalidated"""
+    age = None if entry is None else time.time() - entry['fetched_at']
+    if age is None or age >= get_quote_ttl(symbol) + settings.QUOTE_CACHE_STALE_TTL:
+        # Entries past their stale window are only kept as a fallback
+        _record('miss')
+        return None
+    if age < get_quote_ttl(symbol):
+        _record('hit')
+    else:
+        _record('stale')
+        _schedule_refresh(symbol)
+    return entry['data']
+
+
+def _lookup_many(symbols):
+    """Return the cache entries of 'symbols' read in one round-trip, the quote data they serve, and the symbols missed"""
+    entries = _quote_cache().get_many([_quote_key(symbol) for symbol in symbols])
+    results, misses = {}, []
+    for symbol in symbols:
+        price_data = _serve_cached(symbol, entries.get(_quote_key(symbol)))
+        if price_data is None:
+            misses.append(symbol)
+        else:
+            results[symbol] = price_data
+    return entries, results, misses
+
+
+def _mark_hot(symbol: str):
+    """
+    Record a lookup of 'symbol' for the background refresher (see the refresh_quotes command).
+
+    Each symbol has a key of its own holding its last lookup, so workers never overwrite each
+    other's lookups. The key is rewritten at most once a minute per symbol and process, so
+    lookups of already hot symbols don't touch the cache.
+    """
+    global _hot_pruned_at
+    now = time.time()
+    if now - _hot_marked.get(symbol, 0) < 60:
+        return
+    _hot_marked[symbol] = now
+    if now - _hot_pruned_at >= 60:
+        _hot_pruned_at = now
+        for marked, seen in list(_hot_marked.items()):
+            if now - seen >= 60:
+                _hot_marked.pop(marked, None)
+    _quote_cache().set(f'{HOT_KEY_PREFIX}{symbol}', now, timeout=settings.QUOTE_HOT_WINDOW)
+
+
+def get_recent_symbols():
+    """
+    Return the listed symbols looked up by get_quote within the last QUOTE_HOT_WINDOW seconds.
+
+    The cache can't list its keys, so the keys of every symbol of the catalog are read, a batch
+    per round-trip
+    """
+    cutoff = time.time() - settings.QUOTE_HOT_WINDOW
+    symbols = [listing['symbol'] for listing in get_catalog()]
+    recent = set()
+    for start in range(0, len(symbols), HOT_SCAN_BATCH):
+        keys = {f'{HOT_KEY_PREFIX}{symbol}': symbol for symbol in symbols[start:start + HOT_SCAN_BATCH]}
+        recent.update(keys[key] for key, seen in _quote_cache().get_many(keys).items() if seen > cutoff)
+    return recent
+
+
+def _last_known(entry):
+    """Return the data of a cache entry flagged as a stale, last known quote"""
+    _record('fallback')
+    as_of = datetime.fromtimestamp(entry['fetched_at'], tz=timezone.utc).isoformat()
+    return {**entry['data'], 'stale': True, 'as_of': as_of}
+
+
+def trade_price(price_data: dict):
+    """Return the price a trade executes at. Last known quotes served while the API is unavailable can't be traded on"""
+    if price_data.get('stale'):
+        raise QuoteUnavailable('Only a last known price is available')
+    return float(price_data['05. price'])
+
+
+def get_quote_entry(symbol: str):
+    """
+    Record a lookup of an upper-cased symbol and return its cache entry, or None. Views that
+    revalidate quotes read it once, and pass it to quote_fetched_at and serve_quote
+    """
+    _mark_hot(symbol)
+    return _quote_cache().get(_quote_key(symbol))
+
+
+def quote_fetched_at(symbol: str, entry):
+    """Return when the cache entry of a symbol was fetched, or None if it is missing or not fresh"""
+    if not _is_fresh(symbol, entry):
+        return None
+    return datetime.fromtimestamp(entry['fetched_at'], tz=timezone.utc)
+
+
+def serve_quote(symbol: str, entry):
+    """
+    Return the cache entry the quote of a symbol is served from, given its current one (see get_quote).
+    Fetched quotes come with their new entry, last known quotes with a copy of their stale entry
+    """
+    if _serve_cached(symbol, entry) is not None:
+        return entry
+    try:
+        return _fetch_from_upstream(symbol)
+    except Exception:
+        if entry is None:
+            raise
+        return {**entry, 'data': _last_known(entry)}
+
+
+def get_quote(symbol: str):
+    """
+    Return the Alpha Vantage 'Global Quote' data for a symbol, served from the quote cache.
+
+    Fresh entries are returned directly. Stale entries are returned immediately while a
+    background refresh runs. Misses block on a (coalesced) upstream fetch; if it fails, the
+    last known quote is returned instead, flagged with 'stale' and 'as_of' keys.
+    """
+    symbol = symbol.upper()
+    return serve_quote(symbol, get_quote_entry(symbol))['data']
+
+
+async def aserve_quote(symbol: str, entry):
+    """Async version of serve_quote. Stale entries are still revalidated on the background workers"""
+    if _serve_cached(symbol, entry) is not None:
+        return entry
+    try:
+        return await _afetch_from_upstream(symbol)
+    except Exception:
+        if entry is None:
+            raise
+        return {**entry, 'data': _last_known(entry)}
+
+
+async def aget_quote(symbol: str):
+    """Async version of get_quote"""
+    symbol = symbol.upper()
+    entry = await _in_thread(get_quote_entry, symbol)
+    return (await aserve_quote(symbol, entry))['data']
+
+
+def get_quotes(symbols):
+    """
+    Return quotes for several symbols at once.
+
+    Cached entries are read in a single cache round-trip and misses are fetched concurrently,
+    falling back to the last known quote like get_quote. Returns a tuple (quotes, errors) of
+    dicts keyed by upper-cased symbol: every symbol is in exactly one of them, errors holding
+    the exception raised by its fetch.
+    """
+    symbols = list(dict.fromkeys(symbol.upper() for symbol in symbols))
+    entries, results, misses = _lookup_many(symbols)
+    errors = {}
+    # In the request's context, so its metrics count the fetches
+    pending = {symbol: _fetch_executor.submit(contextvars.copy_context().run, _fetch_from_upstream, symbol) for symbol in misses}
+
+    for symbol, future in pending.items():
+        try:
+            results[symbol] = future.result()['data']
+        except Exception as e:
+            entry = entries.get(_quote_key(symbol))
+            if entry is None:
+                errors[symbol] = e
+            else:
+                results[symbol] = _last_known(entry)
+    return results, errors
+
+
+async def aget_quotes(symbols):
+    """Async version of get_quotes: misses are fetched concurrently on the event loop"""
+    symbols = list(dict.fromkeys(symbol.upper() for symbol in symbols))
+    entries, results, misses = await _in_thread(_lookup_many, symbols)
+    errors = {}
+
+    fetched = await asyncio.gather(*(_afetch_from_upstream(symbol) for symbol in misses), return_exceptions=True)
+    for symbol, fetched_entry in zip(misses, fetched):
+        entry = entries.get(_quote_key(symbol))
+        if not isinstance(fetched_entry, Exception):
+            results[symbol] = fetched_entry['data']
+        elif entry is None:
+            errors[symbol] = fetched_entry
+        else:
+            results[symbol] = _last_known(entry)
+    return results, errors
+
+
+def refresh_quotes(symbols, margin: float = 0):
+    """
+    Fetch the quotes of those 'symbols' that are not cached or go stale within 'margin' seconds.
+
+    Used by the refresh_quotes command to keep hot symbols warm. The stalest quotes are fetched
+    first, concurrently, within QUOTE_REFRESH_SHARE of the request quota so that user requests
+    keep the rest. Returns the list of symbols refreshed and the number that were due.
+    """
+    symbols = list(dict.fromkeys(symbol.upper() for symbol in symbols))
+    entries = _quote_cache().get_many([_quote_key(symbol) for symbol in symbols])
+    now = time.time()
+    due = []
+    for symbol in symbols:
+        entry = entries.get(_quote_key(symbol))
+        age = float('inf') if entry is None else now - entry['fetched_at']
+        if age >= get_quote_ttl(symbol) - margin:
+            due.append((age, symbol))
+    due.sort(reverse=True)
+
+    limits = [(int(tokens * settings.QUOTE_REFRESH_SHARE), seconds) for tokens, seconds in settings.ALPHA_VANTAGE_RATE_LIMITS]
+    if any(tokens < 1 for tokens, _ in limits):
+        raise ImproperlyConfigured("QUOTE_REFRESH_SHARE leaves the refresher no request in some ALPHA_VANTAGE_RATE_LIMITS window")
+    budget = RateGovernor(_quote_cache(), limits, prefix='quote-refresh-rate:')
+    pending = {}
+    for _, symbol in due:
+        # Refused requests are not counted, so the budget left is used by the next pass
+        if budget.acquire():
+            break
+        pending[symbol] = _fetch_executor.submit(_fetch_from_upstream, symbol, 0)
+
+    refreshed = []
+    for symbol, future in pending.items():
+        try:
+            future.result()
+            refreshed.append(symbol)
+        except QuoteUnavailable:
+            pass
+        except Exception:
+            logger.warning("Refresh of quote %s failed", symbol, exc_info=True)
+    return refreshed, len(due)
+
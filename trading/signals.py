@@ -1,10 +1,29 @@
 from django.db.models.signals import post_save
+from django.db.backends.signals import connection_created
+from django.core.signals import setting_changed
 from django.dispatch import receiver
 from django.contrib.auth.models import User
+from .alphavantage import reset_client
+from .metrics import time_query
 from .models import Portfolio
 
 @receiver(post_save, sender=User)
 def create_user_portfolio(sender, instance, created, **kwargs):
     """Automatically create a portfolio for each new user"""
     if created:
-        Portfolio.objects.create(user=instance)
\ No newline at end of file
+        Portfolio.objects.create(user=instance)
+
+
+@receiver(setting_changed)
+def reset_alpha_vantage_client(sender, setting, **kwargs):
+    """Rebuild the API client when its settings are overridden (e.g. in tests)"""
+    if setting.startswith('ALPHA_VANTAGE_'):
+        reset_client()
+
+
+@receiver(connection_created)
+def install_query_timer(sender, connection, **kwargs):
+    """Time the queries of requests measured by PerformanceMiddleware. A no-op for other queries"""
+    # First in line, so that wrappers added and removed with execute_wrapper() stay last
+    if time_query not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, time_query)
@@ -3,6 +3,8 @@ document.addEventListener('DOMContentLoaded', () => {
     const searchButton = document.querySelector('#search-button');
     const stockRows = document.querySelectorAll('.stock-row');
     const buyButton = document.getElementById('buyButton');
+    const exchangeSelect = document.querySelector('#exchange-select');
+    const assetTypeSelect = document.querySelector('#asset-type-select');
 
     // Add event listeners to each stock row in the table
     stockRows.forEach(row => {
@@ -50,7 +52,10 @@ document.addEventListener('DOMContentLoaded', () => {
         searchResults.innerHTML = '';
 
         try {
-            const response = await fetch(`/trading/search_stocks?q=${encodeURIComponent(query)}`);
+            // Search the exchange and asset type the listing is filtered on
+            const exchange = exchangeSelect.value ? `&exchange=${encodeURIComponent(exchangeSelect.value)}` : '';
+            const assetType = `&asset_type=${encodeURIComponent(assetTypeSelect.value)}`;
+            const response = await fetch(`/trading/search_stocks?q=${encodeURIComponent(query)}${exchange}${assetType}`);
             if (!response.ok) throw new Error(`HTTP error! Status: ${response.status}`);
 
             const data = await response.json();
@@ -118,11 +123,7 @@ document.addEventListener('DOMContentLoaded', () => {
         document.getElementById('overlayStockPrice').textContent = 'loading...';
         document.getElementById('quantity').value = '1';
         try {
-            const response = await fetch(`/trading/get_price?symbol=${encodeURIComponent(symbol)}`, {
-                headers: {
-                    'X-Requested-With': 'XMLHttpRequest'
-                }
-            });
+            const response = await fetchRevalidated(`/trading/get_price?symbol=${encodeURIComponent(symbol)}`);
 
             if (!response.ok) {
                 console.error('Error fetching stock price:', error);
@@ -193,12 +194,7 @@ document.addEventListener('DOMContentLoaded', () => {
                 }
                 async function fetchUserBalance() {
                     try {
-                        const response = await fetch(`/trading/get_balance`, {
-                            method: 'GET',
-                            headers: {
-                                'X-Requested-With': 'XMLHttpRequest'
-                            }
-                        });
+                        const response = await fetchRevalidated(`/trading/get_balance`);
                         if (!response.ok) {
                             throw new Error(`HTTP error! Status: ${response.status}`);
                         }
@@ -1,10 +1,10 @@
 document.addEventListener('DOMContentLoaded', function () {
     const tableRows = document.querySelectorAll('#stocks-table-body tr');
     const totalStockValueElement = document.getElementById('total-stock-value');
-    let totalStockValue = 0;
-    let stocksProcessed = 0;
+    let totalStockValue = null;
     let totalStocks = tableRows.length;
     let encounteredError = false;
+    let encounteredStale = false;
 
     // Function to format the price value
     function formatPrice(price) {
@@ -14,7 +14,7 @@ document.addEventListener('DOMContentLoaded', function () {
     // Function to update the total stock value
     function finalizeTotalStockValue() {
         totalStockValueElement.querySelector('.spinner-border').classList.add('d-none');
-        totalStockValueElement.innerHTML += encounteredError ? 'N/A' : `$${totalStockValue.toFixed(2)}`;
+        totalStockValueElement.innerHTML += encounteredError || totalStockValue === null ? 'N/A' : `$${totalStockValue}`;
     }
 
     // Function to create an alert
@@ -30,59 +30,101 @@ document.addEventListener('DOMContentLoaded', function () {
         totalStockValueElement.textContent = 'N/A';
     }
 
-    // Loop through each row and fetch stock data
-    tableRows.forEach(row => {
-        const symbol = row.getAttribute('data-symbol');
-        const quantity = row.getAttribute('data-quantity');
+    // Function to fill a row's price cells, or mark them 'N/A' when no data is given
+    function fillRow(row, data) {
+        const fields = data ? {
+            'open-price': data.open,
+            'previous-close': data.previous_close,
+            'price': data.price,
+            'total': data.market_value,
+            'average-cost': data.average_cost,
+            'unrealized-pnl': data.unrealized_pnl
+        } : {};
 
-        fetch(`/trading/get_price?symbol=${symbol}`, {
-            method: 'GET',
-            headers: { 'X-Requested-With': 'XMLHttpRequest' }
-        })
-        .then(response => response.json())
-        .then(data => {
-            const fields = {
-                'open-price': data.open,
-                'previous-close': data.previous_close,
-                'price': data.price,
-                'total': data.price * quantity
-            };
+        ['open-price', 'previous-close', 'price', 'total', 'average-cost', 'unrealized-pnl'].forEach(className => {
+            const cell = row.querySelector(`.${className}`);
+            const spinner = cell.querySelector('.spinner-border');
+            const priceValue = cell.querySelector('.price-value');
 
-            Object.keys(fields).forEach(className => {
-                const cell = row.querySelector(`.${className}`);
-                const spinner = cell.querySelector('.spinner-border');
-                const priceValue = cell.querySelector('.price-value');
+            spinner.classList.add('d-none'); // Hide spinner
+            priceValue.classList.remove('d-none'); // Show value
 
-                spinner.classList.add('d-none'); // Hide spinner
-                priceValue.classList.remove('d-none'); // Show value
+            priceValue.textContent = data ? formatPrice(fields[className]) : 'N/A';
+        });
+
+        if (data) {
+            encounteredStale = encounteredStale || Boolean(data.stale);
+        } else {
+            encounteredError = true;
+        }
+    }
 
-                priceValue.textContent = data.error ? 'N/A' : formatPrice(fields[className]);
+    // Apply the prices pushed by the server (only served over ASGI) to every holding as they change
+    function streamQuotes(holdings) {
+        const url = document.getElementById('stocks-table-body').dataset.quoteStream;
+        if (!url || !window.EventSource) {
+            return;
+        }
+        const rows = Object.fromEntries(Array.from(tableRows, row => [row.getAttribute('data-symbol'), row]));
+        const source = new EventSource(url);
+        source.addEventListener('quote', event => {
+            const quote = JSON.parse(event.data);
+            const holding = holdings[quote.symbol];
+            if (!holding) {
+                return;
+            }
+            const marketValue = parseFloat(quote.price) * holding.quantity;
+            Object.assign(holding, {
+                price: quote.price,
+                open: quote.open,
+                previous_close: quote.previous_close,
+                market_value: marketValue.toFixed(2),
+                unrealized_pnl: (marketValue - parseFloat(holding.cost_basis)).toFixed(2),
+                stale: Boolean(quote.stale)
             });
+            if (rows[quote.symbol]) {
+                fillRow(rows[quote.symbol], holding);
+            }
+            // The total is only known when every holding could be priced
+            if (!encounteredError) {
+                const total = Object.values(holdings).reduce((sum, position) => sum + parseFloat(position.market_value), 0);
+                totalStockValueElement.textContent = `$${total.toFixed(2)}`;
+            }
+        });
+    }
 
-            if (!data.error) {
-                totalStockValue += fields.total;
-            } else {
-                encounteredError = true;
+    // Value the whole portfolio on the server in a single request
+    if (totalStocks > 0) {
+        fetchRevalidated('/trading/portfolio_value')
+        .then(response => {
+            if (!response.ok) {
+                throw new Error(`HTTP error! Status: ${response.status}`);
             }
+            return response.json();
+        })
+        .then(data => {
+            const holdings = Object.fromEntries(data.holdings.map(holding => [holding.symbol, holding]));
+            tableRows.forEach(row => fillRow(row, holdings[row.getAttribute('data-symbol')]));
+            // Covers every holding, not only those on this page
+            totalStockValue = data.holdings_value;
+            encounteredError = encounteredError || Object.keys(data.errors).length > 0;
+            streamQuotes(holdings);
         })
         .catch(() => {
-            encounteredError = true;
-            row.querySelectorAll('.spinner-border').forEach(spinner => spinner.classList.add('d-none'));
-            row.querySelectorAll('.price-value').forEach(value => {
-                value.classList.remove('d-none');
-                value.textContent = 'N/A';
-            });
+            tableRows.forEach(row => fillRow(row, null));
         })
         .finally(() => {
-            stocksProcessed++;
-            if (stocksProcessed === totalStocks) {
-                finalizeTotalStockValue();
-            }
+            finalizeTotalStockValue();
             if (encounteredError) {
                 const alertDiv = createAlert('warning', 'Error fetching prices for one or more stock. Please try again later.');
                 document.getElementById('alert').innerHTML = '';
                 document.getElementById('alert').appendChild(alertDiv);
+            } else if (encounteredStale) {
+                // Last known prices, served while the price API is unavailable
+                const alertDiv = createAlert('info', 'Live prices are temporarily unavailable. Showing the last known price for one or more stock.');
+                document.getElementById('alert').innerHTML = '';
+                document.getElementById('alert').appendChild(alertDiv);
             }
         });
-    });
+    }
 });
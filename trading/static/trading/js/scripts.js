@@ -1,3 +1,27 @@
+// GET an AJAX endpoint, sending the ETag of the response kept from the previous request as
+// If-None-Match: unchanged responses come back as empty 304s and are served from that copy
+async function fetchRevalidated(url) {
+    const key = `revalidated:${url}`;
+    const cached = JSON.parse(sessionStorage.getItem(key) || 'null');
+    const headers = { 'X-Requested-With': 'XMLHttpRequest' };
+    if (cached) {
+        headers['If-None-Match'] = cached.etag;
+    }
+    const response = await fetch(url, { headers });
+    if (response.status === 304 && cached) {
+        return new Response(cached.body, { status: 200, headers: { 'Content-Type': 'application/json' } });
+    }
+    const etag = response.headers.get('ETag');
+    if (response.ok && etag) {
+        try {
+            sessionStorage.setItem(key, JSON.stringify({ etag, body: await response.clone().text() }));
+        } catch (error) {
+            // Storage full or disabled: the next request is a plain one
+        }
+    }
+    return response;
+}
+
 document.addEventListener('DOMContentLoaded', () => {
 
     // Get the user's balance
@@ -8,12 +32,7 @@ document.addEventListener('DOMContentLoaded', () => {
 
     async function fetchUserBalance() {
         try {
-            const response = await fetch(`/trading/get_balance`, {
-                method: 'GET',
-                headers: {
-                    'X-Requested-With': 'XMLHttpRequest'
-                }
-            });
+            const response = await fetchRevalidated(`/trading/get_balance`);
     
             if (!response.ok) {
                 throw new Error(`HTTP error! Status: ${response.status}`);
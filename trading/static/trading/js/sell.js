@@ -19,9 +19,7 @@ document.addEventListener("DOMContentLoaded", () => {
         }
 
         try {
-            const response = await fetch(`/trading/sell_search?q=${query}`, {
-                headers: { "X-Requested-With": "XMLHttpRequest" }
-            });
+            const response = await fetchRevalidated(`/trading/sell_search?q=${encodeURIComponent(query)}`);
             const data = await response.json();
             resultsContainer.innerHTML = "";
             if (data.stocks && data.stocks.length > 0) {
@@ -67,11 +65,7 @@ document.addEventListener("DOMContentLoaded", () => {
         document.getElementById('quantity').value = '1';
         
         try {
-            const response = await fetch(`/trading/get_price?symbol=${encodeURIComponent(symbol)}`, {
-                headers: {
-                    'X-Requested-With': 'XMLHttpRequest'
-                }
-            });
+            const response = await fetchRevalidated(`/trading/get_price?symbol=${encodeURIComponent(symbol)}`);
 
             if (!response.ok) {
                 const data = await response.json();
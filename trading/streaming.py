@@ -0,0 +1,96 @@
+# Server-Sent Events quote streaming: one fan-out task per process pushes quote updates to every subscriber
+import asyncio
+import contextvars
+import json
+import logging
+
+from django.conf import settings
+
+from .quotes import aget_quotes
+from .utils import format_quote
+
+
+logger = logging.getLogger(__name__)
+
+# Events a subscriber may fall behind by before updates to it are dropped
+SUBSCRIBER_BACKLOG = 100
+
+
+class QuoteBroadcaster:
+    """
+    Pushes quote updates to the subscribers of this process.
+
+    While anyone is subscribed, a single task looks up the quotes of the distinct subscribed
+    symbols every QUOTE_STREAM_INTERVAL seconds (one aget_quotes batch: served from the shared
+    quote cache, fetched on misses like any lookup) and queues the quotes that changed to the
+    subscribers of their symbol. The quote API and cache load depend on the number of distinct
+    symbols, not on the number of subscribers.
+    """
+    def __init__(self):
+        self.subscribers = {} # Queue -> subscribed symbols
+        self.latest = {} # Symbol -> last quote pushed
+        self.task = None
+
+    def subscribe(self, symbols):
+        """Return a queue receiving the quotes of 'symbols': the latest known ones at once, then every change"""
+        queue = asyncio.Queue(maxsize=SUBSCRIBER_BACKLOG)
+        self.subscribers[queue] = {symbol.upper() for symbol in symbols}
+        for symbol in self.subscribers[queue]:
+            if symbol in self.latest:
+                queue.put_nowait(self.latest[symbol])
+        if self.task is None or self.task.done() or self.task.get_loop() is not asyncio.get_running_loop():
+            # In a context of its own, so that the lookups aren't counted in the metrics of the subscribing request
+            self.task = asyncio.create_task(self._run(), context=contextvars.Context())
+        return queue
+
+    def unsubscribe(self, queue):
+        self.subscribers.pop(queue, None)
+
+    async def _run(self):
+        while self.subscribers:
+            try:
+                await self.publish()
+            except Exception:
+                logger.warning("Quote stream update failed", exc_info=True)
+            await asyncio.sleep(settings.QUOTE_STREAM_INTERVAL)
+
+    async def publish(self):
+        """Look up the subscribed symbols once, and push the quotes that changed since the last pass"""
+        symbols = set().union(*self.subscribers.values())
+        # Forget symbols nobody follows anymore
+        self.latest = {symbol: quote for symbol, quote in self.latest.items() if symbol in symbols}
+        quotes, _ = await aget_quotes(sorted(symbols))
+        for symbol, price_data in quotes.items():
+            try:
+                quote = format_quote(symbol, price_data)
+            except KeyError:
+                continue
+            if self.latest.get(symbol) == quote:
+                continue
+            self.latest[symbol] = quote
+            for queue, subscribed in list(self.subscribers.items()):
+                if symbol in subscribed:
+                    try:
+                        queue.put_nowait(quote)
+                    except asyncio.QueueFull:
+                        pass # The client is not reading: it gets the next change
+
+
+broadcaster = QuoteBroadcaster()
+
+
+async def stream_quotes(symbols, broadcaster: QuoteBroadcaster = broadcaster):
+    """Yield the quote updates of 'symbols' as Server-Sent Events, with a comment line to keep idle connections open"""
+    queue = broadcaster.subscribe(symbols)
+    try:
+        # Reconnect delay of the browser's EventSource, in milliseconds
+        yield f'retry: {settings.QUOTE_STREAM_INTERVAL * 1000:.0f}\n\n'
+        while True:
+            try:
+                quote = await asyncio.wait_for(queue.get(), timeout=settings.QUOTE_STREAM_HEARTBEAT)
+            except asyncio.TimeoutError:
+                yield ': keep-alive\n\n'
+                continue
+            yield f'event: quote\ndata: {json.dumps(quote)}\n\n'
+    finally:
+        broadcaster.unsubscribe(queue)
@@ -1,11 +1,43 @@
-from django.test import TestCase, Client
+from django.test import TestCase, TransactionTestCase, Client, AsyncRequestFactory, override_settings, skipUnlessDBFeature
 from django.urls import reverse
-from django.core.exceptions import ValidationError
+from django.core.cache import cache
+from django.core.management import call_command, CommandError
+from django.core.exceptions import ImproperlyConfigured, ValidationError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.db.models import Sum
 from django.db.utils import IntegrityError
+from datetime import date
+from decimal import Decimal
+from unittest import mock, skipUnless
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import StringIO
+from urllib.parse import parse_qs, urlparse
+import asyncio
 import json
+import requests
+import os
+import tempfile
+import threading
 import time
-from trading.models import User, Transaction, Portfolio, StockHolding
-from trading.utils import get_valid_symbols
+from trading import async_views, quotes, streaming
+from trading.alphavantage import AlphaVantageClient, AsyncAlphaVantageClient, QuotaExceeded, UnknownSymbol, get_client
+from trading.catalog import SymbolCatalog, get_catalog, get_stocks
+from trading.governor import CircuitOpen, RateGovernor, Throttled
+from trading.metrics import registry
+from trading.models import User, Transaction, Portfolio, StockHolding, PriceSnapshot
+from trading.prices import ingest_prices, parse_price_csv
+from trading.utils import get_valid_symbols, stream_transactions
+
+
+def _fake_quote(symbol: str, price: str = '100.00'):
+    """Return a 'Global Quote' payload as returned by Alpha Vantage"""
+    return {
+        '01. symbol': symbol,
+        '02. open': '99.00',
+        '05. price': price,
+        '08. previous close': '98.00',
+    }
 
 
 class TradingModelTestCase(TestCase):
@@ -172,6 +204,108 @@ class TradingModelTestCase(TestCase):
         self.assertEqual(balance, 10000.00)        
 
 
+    def test_transaction_query_count(self):
+        """Test that a trade runs a fixed number of statements, whether or not the holding exists"""
+        # Every count includes the SAVEPOINT and RELEASE SAVEPOINT of Transaction.save's atomic block
+        # BUY: guarded balance UPDATE, holding upsert, Transaction INSERT
+        for _ in range(2):
+            with self.assertNumQueries(5):
+                Transaction.objects.create(user=self.user, stock_symbol='EXAMPLE', transaction_type='BUY', quantity=10, price=200.00)
+
+        # SELL: balance UPDATE, guarded holding UPDATE, realized P&L UPDATE (which deletes an emptied holding), Transaction INSERT
+        for _ in range(2):
+            with self.assertNumQueries(6):
+                Transaction.objects.create(user=self.user, stock_symbol='EXAMPLE', transaction_type='SELL', quantity=10, price=200.00)
+        self.assertFalse(StockHolding.objects.exists())
+        self.assertEqual(Portfolio.objects.get(user=self.user).balance, 10000.00)
+
+
+
+class CostBasisTestCase(TestCase):
+
+    # (type, quantity, price)
+    TRADES = [('BUY', 10, '100.00'), ('BUY', 10, '130.00'), ('SELL', 5, '150.00'), ('BUY', 2, '10.01'), ('SELL', 3, '90.00')]
+
+    def setUp(self):
+        """Set up a test user"""
+        cache.clear()
+        self.user = User.objects.create_user(username="testuser", password="testpassword")
+
+    def _trade(self, user, transaction_type, quantity, price, symbol='IBM'):
+        """Helper method to create a transaction"""
+        Transaction.objects.create(user=user, stock_symbol=symbol, transaction_type=transaction_type, quantity=quantity, price=Decimal(price))
+
+    def _position(self, user, symbol='IBM'):
+        """Helper method to get the (quantity, cost basis, realized P&L) of a holding and the portfolio's realized P&L"""
+        return (
+            StockHolding.objects.filter(portfolio__user=user, stock_symbol=symbol).values_list('quantity', 'cost_basis', 'realized_pnl').first(),
+            Portfolio.objects.get(user=user).realized_pnl,
+        )
+
+
+    def test_average_cost(self):
+        """Test that sales take their share of the cost basis at average cost, and that realized P&L outlives the holding"""
+        self._trade(self.user, 'BUY', 10, '100.00')
+        self._trade(self.user, 'BUY', 10, '130.00')
+        self.assertEqual(self._position(self.user), ((20, Decimal('2300.00'), Decimal('0.00')), Decimal('0.00')))
+
+        # 5 of 20 shares carry 575.00 of the cost basis
+        self._trade(self.user, 'SELL', 5, '150.00')
+        self.assertEqual(self._position(self.user), ((15, Decimal('1725.00'), Decimal('175.00')), Decimal('175.00')))
+
+        # Closing the position deletes the holding, but not the portfolio's realized P&L
+        self._trade(self.user, 'SELL', 15, '100.00')
+        self.assertEqual(self._position(self.user), (None, Decimal('-50.00')))
+
+        # A new position starts from a clean slate
+        self._trade(self.user, 'BUY', 3, '10.01')
+        self._trade(self.user, 'SELL', 1, '12.00')
+        self.assertEqual(self._position(self.user), ((2, Decimal('20.02'), Decimal('1.99')), Decimal('-48.01')))
+
+
+    def test_batch_matches_save(self):
+        """Test that create_batch maintains the same cost basis and realized P&L as single trades"""
+        for trade in self.TRADES:
+            self._trade(self.user, *trade)
+
+        other = User.objects.create_user(username="otheruser", password="testpassword")
+        results = Transaction.create_batch(other, [
+            {'symbol': 'ibm', 'transaction_type': transaction_type, 'quantity': quantity, 'price': price}
+            for transaction_type, quantity, price in self.TRADES
+        ])
+        self.assertTrue(all(isinstance(result, Transaction) for result in results))
+        self.assertEqual(self._position(other), self._position(self.user))
+
+
+    def test_rebuild_cost_basis(self):
+        """Test that the rebuild command reports drift from the ledger, and fixes it unless it's a dry run"""
+        for trade in self.TRADES:
+            self._trade(self.user, *trade)
+        self._trade(self.user, 'BUY', 1, '50.00', symbol='AAPL')
+        expected = self._position(self.user)
+        StockHolding.objects.filter(stock_symbol='IBM').update(cost_basis=0, realized_pnl=0)
+        Portfolio.objects.filter(user=self.user).update(realized_pnl=0)
+
+        out = StringIO()
+        call_command('rebuild_cost_basis', '--dry-run', stdout=out)
+        self.assertIn('IBM: cost basis 0.00 != ', out.getvalue())
+        self.assertNotIn('AAPL', out.getvalue())
+        self.assertIn('1 portfolios checked, 1 with drift reported', out.getvalue())
+        self.assertEqual(Portfolio.objects.get(user=self.user).realized_pnl, 0)
+
+        out = StringIO()
+        call_command('rebuild_cost_basis', '--chunk-size', '2', stdout=out)
+        self.assertEqual(self._position(self.user), expected)
+        self.assertEqual(self._position(self.user, 'AAPL')[0], (1, Decimal('50.00'), Decimal('0.00')))
+
+        # Quantities are reported, but left alone
+        StockHolding.objects.filter(stock_symbol='AAPL').update(quantity=3)
+        out = StringIO()
+        call_command('rebuild_cost_basis', stdout=out)
+        self.assertIn('AAPL: quantity 3 != 1, not fixed', out.getvalue())
+        self.assertEqual(StockHolding.objects.get(stock_symbol='AAPL').quantity, 3)
+
+
 
 class TradingViewTestCase(TestCase):
 
@@ -242,23 +376,50 @@ class TradingViewTestCase(TestCase):
         response = self.client.get(reverse('transactions'))
         self.assertEqual(response.status_code, 200)
         self.assertEqual(len(response.context['transactions_data']), 10)
-        self.assertEqual(response.context['current_page'], 1)
-        self.assertIsNone(response.context['previous_page_number'])
-        self.assertEqual(response.context['next_page_number'], 2)
+        self.assertIsNone(response.context['previous_cursor'])
+        self.assertIsNotNone(response.context['next_cursor'])
         # Check that the recent transaction is in the first page
         self.assertContains(response, f'<td class="stock-symbol" id="stock-symbol-{transaction.id}"')
 
         # Get the second page
-        response = self.client.get(reverse('transactions'), {'page': 2})
+        response = self.client.get(reverse('transactions'), {'after': response.context['next_cursor']})
         self.assertEqual(response.status_code, 200)
         self.assertEqual(len(response.context['transactions_data']), 6)
-        self.assertEqual(response.context['current_page'], 2)
-        self.assertEqual(response.context['previous_page_number'], 1)
-        self.assertIsNone(response.context['next_page_number'])
+        self.assertIsNotNone(response.context['previous_cursor'])
+        self.assertIsNone(response.context['next_cursor'])
         # Check that the recent transaction is NOT in this page
         self.assertNotContains(response, f'<td class="stock-symbol" id="stock-symbol-{transaction.id}"')
 
-    
+        # Go back to the first page
+        response = self.client.get(reverse('transactions'), {'before': response.context['previous_cursor']})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['transactions_data']), 10)
+        self.assertEqual(response.context['transactions_data'][0], transaction)
+        self.assertIsNone(response.context['previous_cursor'])
+
+
+    def test_transactions_view_keyset_pagination(self):
+        """Test that cursor pages cover the history exactly once, in order, including timestamp ties"""
+        Portfolio.objects.filter(user=self.user).update(balance=100000)
+        transactions = self._create_transactions(25)
+        # Give several transactions the same timestamp, so that pages must be split on the id
+        Transaction.objects.filter(id__in=[t.id for t in transactions[5:15]]).update(timestamp=transactions[5].timestamp)
+        expected = list(Transaction.objects.order_by('-timestamp', '-id').values_list('id', flat=True))
+
+        seen, params = [], {}
+        while True:
+            response = self.client.get(reverse('transactions'), params)
+            seen += [t.id for t in response.context['transactions_data']]
+            if not response.context['next_cursor']:
+                break
+            params = {'after': response.context['next_cursor']}
+        self.assertEqual(seen, expected)
+
+        # Invalid cursors fall back to the first page
+        response = self.client.get(reverse('transactions'), {'after': 'not-a-cursor'})
+        self.assertEqual([t.id for t in response.context['transactions_data']], expected[:10])
+
+
     def test_buy_view_get(self):
         """Test that the buy page is rendered correctly for GET requests"""
         all_stocks = get_valid_symbols()
@@ -495,6 +656,16 @@ class TradingViewTestCase(TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertJSONEqual(response.content, {'stocks': []})
 
+        # Symbols are matched by prefix, whatever the case of the query, not by substring
+        self._create_holding('AGOO', 5)
+        response = self.client.get(
+            reverse('sell_search'),
+            {'q': 'goo'},
+            "application/json",
+            HTTP_X_REQUESTED_WITH='XMLHttpRequest'
+        )
+        self.assertJSONEqual(response.content, {'stocks': [['GOOGL', 10]]})
+
         # No query given
         response = self.client.get(
             reverse('sell_search'),
@@ -503,4 +674,1501 @@ class TradingViewTestCase(TestCase):
             HTTP_X_REQUESTED_WITH='XMLHttpRequest'
         )
         self.assertEqual(response.status_code, 400)
-        self.assertJSONEqual(response.content, {'message': "Missing search query parameter 'q'"})
\ No newline at end of file
+        self.assertJSONEqual(response.content, {'message': "Missing search query parameter 'q'"})
+
+
+class QuoteCacheTestCase(TestCase):
+
+    def setUp(self):
+        """Start every test with an empty quote cache"""
+        cache.clear()
+        quotes.reset_quote_cache_stats()
+
+
+    @mock.patch('trading.quotes.get_stock_price_data', side_effect=_fake_quote)
+    def test_quote_served_from_cache(self, upstream):
+        """Test that repeated lookups of a fresh quote hit the API only once"""
+        self.assertEqual(quotes.get_quote('ibm')['05. price'], '100.00')
+        self.assertEqual(quotes.get_quote('IBM')['05. price'], '100.00')
+        upstream.assert_called_once_with('IBM')
+        self.assertEqual(quotes.get_quote_cache_stats(), {'hit': 1, 'miss': 1, 'stale': 0, 'coalesced': 0, 'fallback': 0, 'shed': 0})
+
+
+    @override_settings(QUOTE_CACHE_SYMBOL_TTLS={'IBM': 0})
+    @mock.patch('trading.quotes.get_stock_price_data', side_effect=_fake_quote)
+    def test_stale_quote_is_served_and_refreshed(self, upstream):
+        """Test that an expired quote is returned immediately and revalidated in the background"""
+        quotes.get_quote('IBM')
+        with mock.patch('trading.quotes._schedule_refresh') as schedule_refresh:
+            self.assertEqual(quotes.get_quote('IBM')['05. price'], '100.00')
+        schedule_refresh.assert_called_once_with('IBM')
+        self.assertEqual(upstream.call_count, 1)
+        self.assertEqual(quotes.get_quote_cache_stats()['stale'], 1)
+
+
+    def test_concurrent_misses_are_coalesced(self):
+        """Test that concurrent lookups of an uncached symbol share one upstream request"""
+        release = threading.Event()
+        calls = []
+
+        def slow_upstream(symbol):
+            calls.append(symbol)
+            release.wait(5)
+            return _fake_quote(symbol)
+
+        results = []
+        with mock.patch('trading.quotes.get_stock_price_data', side_effect=slow_upstream):
+            threads = [threading.Thread(target=lambda: results.append(quotes.get_quote('IBM'))) for _ in range(5)]
+            for thread in threads:
+                thread.start()
+            # Let every thread reach the in-flight request before releasing it
+            while quotes.get_quote_cache_stats()['coalesced'] < 4:
+                time.sleep(0.01)
+            release.set()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(calls, ['IBM'])
+        self.assertEqual(len(results), 5)
+
+
+    @mock.patch('trading.quotes.get_stock_price_data', side_effect=KeyError('Global Quote'))
+    def test_failed_fetch_is_not_cached(self, upstream):
+        """Test that upstream errors propagate and are not stored in the cache"""
+        for _ in range(2):
+            with self.assertRaises(KeyError):
+                quotes.get_quote('IBM')
+        self.assertEqual(upstream.call_count, 2)
+
+
+    def test_get_quotes_batch(self):
+        """Test that a batch lookup mixes cached and fetched quotes and reports failures separately"""
+        def upstream(symbol):
+            if symbol == 'BAD':
+                raise KeyError('Global Quote')
+            return _fake_quote(symbol)
+
+        with mock.patch('trading.quotes.get_stock_price_data', side_effect=upstream) as fetch:
+            quotes.get_quote('IBM')
+            results, errors = quotes.get_quotes(['ibm', 'AAPL', 'BAD', 'AAPL'])
+
+        self.assertEqual(set(results), {'IBM', 'AAPL'})
+        self.assertEqual(set(errors), {'BAD'})
+        self.assertEqual(fetch.call_count, 3) # IBM once, then AAPL and BAD
+
+
+    @mock.patch('trading.quotes.get_stock_price_data', side_effect=_fake_quote)
+    def test_get_prices_view(self, upstream):
+        """Test the batch price endpoint"""
+        User.objects.create_user(username="testuser", password="testpassword")
+        self.client.login(username="testuser", password="testpassword")
+
+        response = self.client.get(reverse('get_prices'), {'symbols': 'IBM,aapl'}, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(response.status_code, 200)
+        self.assertJSONEqual(response.content, {
+            'prices': {
+                'IBM': {'symbol': 'IBM', 'price': '100.00', 'open': '99.00', 'previous_close': '98.00'},
+                'AAPL': {'symbol': 'AAPL', 'price': '100.00', 'open': '99.00', 'previous_close': '98.00'},
+            },
+            'errors': {},
+        })
+
+        # Missing symbols and non-AJAX requests are rejected
+        response = self.client.get(reverse('get_prices'), {'symbols': ' , '}, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get(reverse('get_prices'), {'symbols': 'IBM'})
+        self.assertEqual(response.status_code, 400)
+
+
+
+@override_settings(ALPHA_VANTAGE_RATE_LIMITS=[], ALPHA_VANTAGE_BREAKER_THRESHOLD=3, ALPHA_VANTAGE_BREAKER_COOLDOWN=60)
+class QuoteGovernorTestCase(TestCase):
+
+    def setUp(self):
+        """Start every test with an empty quote cache and a closed circuit breaker"""
+        cache.clear()
+        quotes.reset_quote_cache_stats()
+
+    def _expire(self, symbol: str):
+        """Helper method to age the cached quote of a symbol past its stale window"""
+        key = f'{quotes.QUOTE_KEY_PREFIX}{symbol}'
+        entry = cache.get(key)
+        entry['fetched_at'] -= 24 * 60 * 60
+        cache.set(key, entry)
+
+
+    def test_quota_message_detected(self):
+        """Test that rate limit payloads raise QuotaExceeded instead of KeyError"""
+        client = AlphaVantageClient(base_url='http://127.0.0.1:1/query')
+        for payload in [{'Note': 'Thank you for using Alpha Vantage!'}, {'Information': 'Our standard API rate limit is 25 requests per day.'}]:
+            with mock.patch.object(AlphaVantageClient, 'query', return_value=payload):
+                with self.assertRaises(QuotaExceeded):
+                    client.get_quote('IBM')
+
+
+    def test_unknown_symbol(self):
+        """Test that unknown symbols are neither retried, cached nor counted as failures, and answered with a 404"""
+        client = AlphaVantageClient(base_url='http://127.0.0.1:1/query')
+        for payload in [{'Error Message': 'Invalid API call.'}, {'Global Quote': {}}]:
+            with mock.patch.object(AlphaVantageClient, 'query', return_value=payload):
+                with self.assertRaises(UnknownSymbol):
+                    client.get_quote('XXXX')
+
+        User.objects.create_user(username="testuser", password="testpassword")
+        self.client.login(username="testuser", password="testpassword")
+        with mock.patch('trading.quotes.get_stock_price_data', side_effect=UnknownSymbol('Invalid API call.')) as upstream:
+            for _ in range(4):
+                response = self.client.get(reverse('get_price'), {'symbol': 'XXXX'}, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+                self.assertEqual(response.status_code, 404)
+        self.assertEqual(upstream.call_count, 4)
+        self.assertIsNone(cache.get(f'{quotes.QUOTE_KEY_PREFIX}XXXX'))
+        # The breaker stays closed
+        with mock.patch('trading.quotes.get_stock_price_data', side_effect=_fake_quote):
+            self.assertEqual(quotes.get_quote('IBM')['05. price'], '100.00')
+
+
+    def test_breaker_opens_after_repeated_failures(self):
+        """Test that the breaker stops upstream calls after the failure threshold, then lets one through after the cooldown"""
+        with mock.patch('trading.quotes.get_stock_price_data', side_effect=requests.ConnectionError) as upstream:
+            for _ in range(3):
+                with self.assertRaises(requests.ConnectionError):
+                    quotes.get_quote('IBM')
+            with self.assertRaises(CircuitOpen):
+                quotes.get_quote('IBM')
+        self.assertEqual(upstream.call_count, 3)
+        self.assertEqual(quotes.get_quote_cache_stats()['shed'], 1)
+
+        # Once the cooldown is over, a successful call closes the breaker
+        cache.delete('quote-breaker:open-until')
+        with mock.patch('trading.quotes.get_stock_price_data', side_effect=_fake_quote):
+            self.assertEqual(quotes.get_quote('IBM')['05. price'], '100.00')
+            self.assertEqual(quotes.get_quote('AAPL')['05. price'], '100.00')
+
+
+    def test_last_known_quote_served_while_unavailable(self):
+        """Test that the last known quote is served, flagged stale, when the API answers with a quota message"""
+        with mock.patch('trading.quotes.get_stock_price_data', side_effect=_fake_quote):
+            quotes.get_quote('IBM')
+        self._expire('IBM')
+
+        with mock.patch('trading.quotes.get_stock_price_data', side_effect=QuotaExceeded('Note')) as upstream:
+            for _ in range(2):
+                price_data = quotes.get_quote('IBM')
+                self.assertTrue(price_data['stale'])
+                self.assertEqual(price_data['05. price'], '100.00')
+            results, errors = quotes.get_quotes(['IBM', 'AAPL'])
+        # A quota message opens the breaker right away
+        upstream.assert_called_once_with('IBM')
+        self.assertTrue(results['IBM']['stale'])
+        self.assertIsInstance(errors['AAPL'], CircuitOpen)
+        stats = quotes.get_quote_cache_stats()
+        self.assertEqual((stats['fallback'], stats['shed']), (3, 3))
+
+
+    @override_settings(ALPHA_VANTAGE_RATE_LIMITS=[(2, 60)], ALPHA_VANTAGE_RATE_LIMIT_WAIT=0)
+    @mock.patch('trading.quotes.get_stock_price_data', side_effect=_fake_quote)
+    def test_requests_over_quota_are_shed(self, upstream):
+        """Test that the rate governor sheds upstream calls once the quota is used up"""
+        quotes.get_quote('IBM')
+        quotes.get_quote('AAPL')
+        with self.assertRaises(Throttled):
+            quotes.get_quote('GOOGL')
+        self.assertEqual(upstream.call_count, 2)
+        # Cached quotes are still served
+        self.assertEqual(quotes.get_quote('IBM')['05. price'], '100.00')
+
+
+    def test_governor_refills_each_window(self):
+        """Test that the quota renews with each window, and that the governor reports when it will"""
+        governor = RateGovernor(cache, [(2, 1)])
+        start = time.time()
+        self.assertEqual([governor.acquire() for _ in range(2)], [0, 0])
+        delay = governor.acquire()
+        self.assertGreater(delay, 0)
+        self.assertLessEqual(delay, 1)
+        if time.time() - start < 1: # Still in the first window
+            time.sleep(delay)
+        self.assertEqual(governor.acquire(), 0)
+
+
+    def test_governor_refusals_not_counted(self):
+        """Test that a request refused by one window is not counted in any window"""
+        governor = RateGovernor(cache, [(5, 60), (1, 24 * 60 * 60)])
+        self.assertEqual(governor.acquire(), 0)
+        window = int(time.time() // 60)
+        for _ in range(3):
+            self.assertGreater(governor.acquire(), 0)
+        self.assertEqual(cache.get(f'quote-rate:60:{window}'), 1)
+        self.assertEqual(cache.get(f'quote-rate:86400:{int(time.time() // 86400)}'), 1)
+
+
+    @mock.patch('trading.quotes.get_stock_price_data', side_effect=_fake_quote)
+    def test_views_with_last_known_quote(self, upstream):
+        """Test that price views flag last known quotes, and that trades are refused on them"""
+        User.objects.create_user(username="testuser", password="testpassword")
+        self.client.login(username="testuser", password="testpassword")
+        quotes.get_quote('IBM')
+        self._expire('IBM')
+        upstream.side_effect = QuotaExceeded('Note')
+
+        response = self.client.get(reverse('get_price'), {'symbol': 'IBM'}, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json()['stale'])
+        self.assertIn('as_of', response.json())
+
+        response = self.client.post(reverse('buy'), json.dumps({'symbol': 'IBM', 'quantity': 1}), content_type='application/json', HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(response.status_code, 503)
+        self.assertFalse(Transaction.objects.exists())
+
+        response = self.client.get(reverse('get_price'), {'symbol': 'AAPL'}, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(response.status_code, 503)
+        self.assertIn('Retry-After', response)
+
+
+
+@override_settings(ALPHA_VANTAGE_RATE_LIMITS=[])
+class QuoteRefresherTestCase(TestCase):
+
+    def setUp(self):
+        """Start every test with an empty quote cache and no hot symbols"""
+        cache.clear()
+        quotes._hot_marked.clear()
+
+    def _refresh(self):
+        """Helper method to run a single pass of the refresh_quotes command"""
+        call_command('refresh_quotes', '--once', '--interval', '0', stdout=StringIO())
+
+
+    @mock.patch('trading.quotes.get_stock_price_data', side_effect=_fake_quote)
+    def test_lookups_mark_symbols_hot(self, upstream):
+        """Test that looked up symbols are recorded as hot until the window passes"""
+        quotes._hot_marked['OLD'] = quotes._hot_pruned_at = 0
+        quotes.get_quote('ibm')
+        quotes.get_quote('AAPL')
+        self.assertEqual(quotes.get_recent_symbols(), {'IBM', 'AAPL'})
+        with override_settings(QUOTE_HOT_WINDOW=0):
+            self.assertEqual(quotes.get_recent_symbols(), set())
+        # This process forgets lookups it no longer needs to throttle
+        self.assertEqual(set(quotes._hot_marked), {'IBM', 'AAPL'})
+
+
+    def test_refresh_held_and_recent_symbols(self):
+        """Test that the refresher fetches held and recently looked up symbols that are missing or expiring"""
+        user = User.objects.create_user(username="testuser", password="testpassword")
+        StockHolding.objects.create(portfolio=user.portfolio, stock_symbol='AAPL', quantity=5)
+        with mock.patch('trading.quotes.get_stock_price_data', side_effect=_fake_quote) as upstream:
+            quotes.get_quote('IBM')
+            self._refresh()
+            self.assertEqual(sorted(call.args[0] for call in upstream.call_args_list), ['AAPL', 'IBM'])
+
+            # Both quotes are fresh now
+            self._refresh()
+            self.assertEqual(upstream.call_count, 2)
+
+            with override_settings(QUOTE_CACHE_SYMBOL_TTLS={'IBM': 0}):
+                self._refresh()
+            self.assertEqual(upstream.call_args.args, ('IBM',))
+            self.assertEqual(upstream.call_count, 3)
+
+        # Requests are now served from the cache
+        with mock.patch('trading.quotes.get_stock_price_data') as upstream:
+            quotes.get_quote('AAPL')
+            upstream.assert_not_called()
+
+
+    @override_settings(ALPHA_VANTAGE_RATE_LIMITS=[(10, 60)], QUOTE_REFRESH_SHARE=0.5)
+    @mock.patch('trading.quotes.get_stock_price_data', side_effect=_fake_quote)
+    def test_refresh_within_budget(self, upstream):
+        """Test that the refresher only uses its share of the request quota, stalest quotes first"""
+        symbols = [f'SYM{i}' for i in range(8)]
+        quotes.store_quote('SYM0', _fake_quote('SYM0'))
+        refreshed, due = quotes.refresh_quotes(symbols, margin=quotes.get_quote_ttl('SYM0'))
+        self.assertEqual(due, 8)
+        self.assertEqual(len(refreshed), 5)
+        self.assertNotIn('SYM0', refreshed)
+        # The refused refresh is not counted against the budget
+        self.assertEqual(cache.get(f'quote-refresh-rate:60:{int(time.time() // 60)}'), 5)
+        # User requests still have their share
+        self.assertEqual(quotes.get_quote('OTHER')['05. price'], '100.00')
+
+
+    @override_settings(ALPHA_VANTAGE_RATE_LIMITS=[(5, 60), (25, 24 * 60 * 60)], QUOTE_REFRESH_SHARE=0.1)
+    def test_refresh_share_without_budget(self):
+        """Test that a refresh share leaving no request in a window is rejected"""
+        with self.assertRaises(ImproperlyConfigured):
+            quotes.refresh_quotes(['IBM'])
+
+
+
+@override_settings(ALPHA_VANTAGE_RATE_LIMITS=[])
+class PortfolioValueTestCase(TestCase):
+
+    def setUp(self):
+        """Set up a logged in test user holding two stocks"""
+        cache.clear()
+        self.user = User.objects.create_user(username="testuser", password="testpassword")
+        StockHolding.objects.create(portfolio=self.user.portfolio, stock_symbol='IBM', quantity=10, cost_basis=900)
+        StockHolding.objects.create(portfolio=self.user.portfolio, stock_symbol='AAPL', quantity=5, cost_basis=550)
+        self.client.login(username="testuser", password="testpassword")
+
+    def _get_value(self):
+        """Helper method to request the portfolio valuation"""
+        response = self.client.get(reverse('portfolio_value'), HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+
+    @mock.patch('trading.quotes.get_stock_price_data', side_effect=_fake_quote)
+    def test_portfolio_value(self, upstream):
+        """Test the market value, day change and unrealized P&L of each holding, and the portfolio totals"""
+        valuation = self._get_value()
+        self.assertEqual(valuation['holdings'], [
+            {'symbol': 'AAPL', 'quantity': 5, 'price': '100.00', 'open': '99.00', 'previous_close': '98.00',
+             'market_value': '500.00', 'day_change': '10.00', 'day_change_percent': '2.04',
+             'cost_basis': '550.00', 'average_cost': '110.00', 'unrealized_pnl': '-50.00', 'unrealized_pnl_percent': '-9.09'},
+            {'symbol': 'IBM', 'quantity': 10, 'price': '100.00', 'open': '99.00', 'previous_close': '98.00',
+             'market_value': '1000.00', 'day_change': '20.00', 'day_change_percent': '2.04',
+             'cost_basis': '900.00', 'average_cost': '90.00', 'unrealized_pnl': '100.00', 'unrealized_pnl_percent': '11.11'},
+        ])
+        self.assertEqual(valuation['errors'], {})
+        self.assertEqual(
+            (valuation['balance'], valuation['holdings_value'], valuation['day_change'], valuation['total_equity']),
+            ('10000.00', '1500.00', '30.00', '11500.00'),
+        )
+        self.assertEqual((valuation['realized_pnl'], valuation['unrealized_pnl']), ('0.00', '50.00'))
+
+        # Non-AJAX requests are rejected
+        response = self.client.get(reverse('portfolio_value'))
+        self.assertEqual(response.status_code, 400)
+
+
+    @mock.patch('trading.quotes.get_stock_price_data', side_effect=_fake_quote)
+    def test_single_query_and_cached(self, upstream):
+        """Test that holdings are read in one query, and that the valuation is cached until the user trades"""
+        # Session and user lookups, then the holdings
+        with self.assertNumQueries(3):
+            self._get_value()
+        with self.assertNumQueries(2):
+            self._get_value()
+        self.assertEqual(upstream.call_count, 2)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Transaction.objects.create(user=self.user, stock_symbol='IBM', transaction_type='BUY', quantity=5, price=100)
+        valuation = self._get_value()
+        self.assertEqual(valuation['holdings'][1]['quantity'], 15)
+        self.assertEqual(valuation['balance'], '9500.00')
+
+
+    def test_failed_prices_not_cached(self):
+        """Test that holdings that can't be priced are reported, and that partial valuations are not cached"""
+        def upstream(symbol):
+            if symbol == 'AAPL':
+                raise KeyError('Global Quote')
+            return _fake_quote(symbol)
+
+        with mock.patch('trading.quotes.get_stock_price_data', side_effect=upstream):
+            valuation = self._get_value()
+        self.assertEqual(valuation['errors'], {'AAPL': 'Error fetching price'})
+        self.assertEqual(valuation['holdings_value'], '1000.00')
+
+        with mock.patch('trading.quotes.get_stock_price_data', side_effect=_fake_quote):
+            self.assertEqual(self._get_value()['holdings_value'], '1500.00')
+
+
+    async def test_async_portfolio_value(self):
+        """Test that the async view values the portfolio like the sync one"""
+        request = AsyncRequestFactory().get(reverse('portfolio_value'), headers={'X-Requested-With': 'XMLHttpRequest'})
+        async def auser():
+            return self.user
+        request.auser = auser
+        async def get_quote(client, symbol):
+            return _fake_quote(symbol)
+        with mock.patch.object(AsyncAlphaVantageClient, 'get_quote', get_quote):
+            response = await async_views.portfolio_value(request)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content)['total_equity'], '11500.00')
+
+
+
+class PriceHistoryTestCase(TestCase):
+
+    DAILY_CSV = (
+        'timestamp,open,high,low,close,volume\r\n'
+        '2025-02-14,262.0000,263.5000,260.1000,261.2800,3516102\r\n'
+        '2025-02-13,259.9000,262.7300,258.8000,262.0800,3344016\r\n'
+        '2025-02-12,258.0000,260.0000,256.2000,259.5300,3221110\r\n'
+    )
+
+    def _ingest(self, text: str, symbol: str = None, batch_size: int = 5000):
+        """Helper method to ingest CSV text"""
+        return ingest_prices(parse_price_csv(StringIO(text), symbol), batch_size)
+
+
+    def test_ingest_is_idempotent(self):
+        """Test that loading the same prices again inserts nothing, and that overlapping loads only add the new rows"""
+        self.assertEqual(self._ingest(self.DAILY_CSV, 'ibm'), 3)
+        self.assertEqual(self._ingest(self.DAILY_CSV, 'IBM'), 0)
+        self.assertEqual(self._ingest(self.DAILY_CSV + '2025-02-11,255.0000,258.0000,254.0000,257.9000,3100000\r\n', 'IBM', batch_size=2), 1)
+        self.assertEqual(PriceSnapshot.objects.filter(stock_symbol='IBM').count(), 4)
+
+        snapshot = PriceSnapshot.objects.get(stock_symbol='IBM', timestamp__date='2025-02-14')
+        self.assertEqual(snapshot.close, Decimal('261.2800'))
+        self.assertEqual(snapshot.volume, 3516102)
+
+
+    def test_ingest_duplicates_within_a_load(self):
+        """Test that a file repeating a (symbol, timestamp) stores it once"""
+        text = 'symbol,timestamp,close\nIBM,2025-02-14,261.28\nAAPL,2025-02-14,244.60\nIBM,2025-02-14,261.28\n'
+        self.assertEqual(self._ingest(text), 2)
+        snapshot = PriceSnapshot.objects.get(stock_symbol='AAPL')
+        self.assertIsNone(snapshot.open)
+        self.assertIsNone(snapshot.volume)
+
+        # Rows need a symbol
+        with self.assertRaises(ValueError):
+            self._ingest(self.DAILY_CSV)
+
+
+    @override_settings(ALPHA_VANTAGE_RATE_LIMITS=[])
+    def test_load_prices_command(self):
+        """Test backfilling prices from the API and from a file"""
+        cache.clear()
+        user = User.objects.create_user(username="testuser", password="testpassword")
+        StockHolding.objects.create(portfolio=user.portfolio, stock_symbol='AAPL', quantity=5)
+        response = mock.Mock(text=self.DAILY_CSV)
+        with mock.patch.object(AlphaVantageClient, '_get', return_value=response) as get:
+            out = StringIO()
+            call_command('load_prices', 'ibm', '--held', stdout=out)
+        self.assertEqual(sorted(call.args[0]['symbol'] for call in get.call_args_list), ['AAPL', 'IBM'])
+        self.assertEqual(get.call_args.args[0]['datatype'], 'csv')
+        self.assertIn('IBM: 3 prices, 3 new', out.getvalue())
+        self.assertEqual(PriceSnapshot.objects.count(), 6)
+
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as file:
+            file.write(self.DAILY_CSV)
+        self.addCleanup(os.remove, file.name)
+        out = StringIO()
+        call_command('load_prices', '--file', file.name, '--symbol', 'MSFT', stdout=out)
+        self.assertIn('3 new prices', out.getvalue())
+        with self.assertRaises(CommandError):
+            call_command('load_prices')
+
+
+    def test_quota_message_in_csv_response(self):
+        """Test that JSON quota messages sent instead of CSV raise QuotaExceeded"""
+        payload = {'Information': 'Our standard API rate limit is 25 requests per day.'}
+        response = mock.Mock(text=json.dumps(payload), json=lambda: payload)
+        with mock.patch.object(AlphaVantageClient, '_get', return_value=response):
+            with self.assertRaises(QuotaExceeded):
+                AlphaVantageClient(base_url='http://127.0.0.1:1/query').get_daily_csv('IBM')
+
+
+
+class SymbolCatalogTestCase(TestCase):
+
+    def setUp(self):
+        """Write a small listings file to a temporary directory"""
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, 'listing_status.csv')
+        self._write_listing([
+            ('AAA', 'Triple A Corp', 'Stock'),
+            ('BBB', 'Double B Fund', 'ETF'),
+            ('CCC', 'C' * 60, 'Stock'),
+        ])
+        self.settings_override = override_settings(SYMBOL_LISTING_FILE=self.path)
+        self.settings_override.enable()
+
+
+    def tearDown(self):
+        self.settings_override.disable()
+        self.tmpdir.cleanup()
+
+
+    def _write_listing(self, rows, mtime=None):
+        """Helper method to write the listings file"""
+        with open(self.path, 'w') as file:
+            file.write('symbol,name,exchange,assetType,ipoDate,delistingDate,status\n')
+            for symbol, name, asset_type, *exchange in rows:
+                file.write(f'{symbol},{name},{exchange[0] if exchange else "NYSE"},{asset_type},2000-01-01,null,Active\n')
+        if mtime is not None:
+            os.utime(self.path, (mtime, mtime))
+
+
+    def test_catalog_contents(self):
+        """Test that every listing is kept whole, rows have truncated names, and stocks are a view of them"""
+        catalog = get_catalog()
+        self.assertEqual(len(catalog), 3)
+        self.assertEqual(catalog.get('CCC')['name'], 'C' * 50 + '...')
+        self.assertEqual(catalog.listing('BBB'), {
+            'symbol': 'BBB', 'name': 'Double B Fund', 'exchange': 'NYSE', 'asset_type': 'ETF',
+            'ipo_date': date(2000, 1, 1), 'delisting_date': None, 'status': 'Active',
+        })
+        self.assertEqual(catalog.listing('CCC')['name'], 'C' * 60)
+
+        stocks = get_stocks()
+        self.assertEqual(len(stocks), 2)
+        self.assertEqual(stocks[0], {'symbol': 'AAA', 'name': 'Triple A Corp'})
+        self.assertIn('AAA', stocks)
+        self.assertNotIn('BBB', stocks)
+        self.assertIsNone(stocks.listing('BBB'))
+        self.assertEqual(stocks[:], get_valid_symbols()[:])
+
+
+    def test_catalog_loaded_once_and_reloaded_on_change(self):
+        """Test that the catalog is shared between calls until the file changes"""
+        catalog = get_catalog()
+        self.assertIs(get_catalog(), catalog)
+
+        self._write_listing([('DDD', 'Quad D Inc', 'Stock')], mtime=catalog.mtime + 10)
+        reloaded = get_catalog()
+        self.assertIsNot(reloaded, catalog)
+        self.assertEqual(reloaded[:], [{'symbol': 'DDD', 'name': 'Quad D Inc'}])
+
+        # Requests still holding the old catalog or its views keep reading it
+        self.assertIn('AAA', catalog)
+        self.assertEqual([row['symbol'] for row in catalog.search('triple')], ['AAA'])
+        self.assertEqual([row['symbol'] for row in catalog.filter(asset_type='Stock')], ['AAA', 'CCC'])
+        self.assertFalse(catalog.map.closed)
+        stocks = get_stocks()
+        self._write_listing([('EEE', 'Penta E Inc', 'Stock')], mtime=reloaded.mtime + 10)
+        self.assertEqual(get_catalog()[:], [{'symbol': 'EEE', 'name': 'Penta E Inc'}])
+        self.assertIn('DDD', reloaded)
+        self.assertEqual(stocks[:], [{'symbol': 'DDD', 'name': 'Quad D Inc'}])
+
+
+    def test_catalog_file(self):
+        """Test that the listings file is compiled once to a catalog file, recompiled when it changes or is invalid"""
+        catalog = get_catalog()
+        path = os.path.join(self.tmpdir.name, 'listing_status.bin')
+        self.assertEqual(SymbolCatalog(path)[:], catalog[:])
+        self.assertEqual(SymbolCatalog(path).get('BBB'), {'symbol': 'BBB', 'name': 'Double B Fund'})
+
+        # Another process opens the compiled file as is
+        with mock.patch('trading.catalog.compile_catalog') as compile_catalog:
+            self.assertEqual(SymbolCatalog.load(self.path)[:], catalog[:])
+        compile_catalog.assert_not_called()
+
+        # Replaced rather than overwritten, like write_catalog does: other catalogs still map the file
+        with open(path + '.tmp', 'wb') as file:
+            file.write(b'garbage')
+        os.replace(path + '.tmp', path)
+        self.assertEqual(SymbolCatalog.load(self.path)[:], catalog[:])
+
+        out = StringIO()
+        call_command('build_catalog', listing=self.path, output=os.path.join(self.tmpdir.name, 'other.bin'), stdout=out)
+        self.assertIn('3 listings (2 stocks)', out.getvalue())
+
+
+    def test_search_relevance(self):
+        """Test that search ranks exact symbol, symbol prefix, name prefix, then name words"""
+        self._write_listing([
+            ('AB', 'Zeta Holdings', 'Stock'),
+            ('ABC', 'Alpha Beta Corp', 'Stock'),
+            ('XAB', 'Ab Initio Inc', 'Stock'),
+            ('YYY', 'Global Ab Partners', 'Stock'),
+            ('QQQ', 'Quantum Quest', 'Stock'),
+        ], mtime=time.time() + 10)
+        catalog = get_catalog()
+        self.assertEqual([row['symbol'] for row in catalog.search('ab')], ['AB', 'ABC', 'XAB', 'YYY'])
+        self.assertEqual([row['symbol'] for row in catalog.search('ab', limit=2)], ['AB', 'ABC'])
+        self.assertEqual([row['symbol'] for row in catalog.search('  Ab  PARTNERS ')], ['YYY'])
+        self.assertEqual(catalog.search('nothing'), [])
+
+        response = self.client.get(reverse('search_stocks'), {'q': 'quantum q'})
+        self.assertEqual(response.status_code, 200)
+        self.assertJSONEqual(response.content, {'stocks': [{'symbol': 'QQQ', 'name': 'Quantum Quest'}]})
+
+
+    def test_search_substrings_and_unicode(self):
+        """Test that search folds the case of any script, and falls back on substrings of symbols and names"""
+        self._write_listing([
+            ('MSFT', 'Microsoft Corp', 'Stock'),
+            ('SOFT', 'Soft Goods Inc', 'Stock'),
+            ('STRS', 'Großhandel Straße AG', 'Stock'),
+            ('EEE', 'Électricité Énergie SA', 'Stock'),
+            ('ZSOF', 'Zeta Holdings', 'Stock'),
+        ], mtime=time.time() + 10)
+        catalog = get_catalog()
+        # Symbol prefix and name prefix first, then the symbol and name substrings in symbol order
+        self.assertEqual([row['symbol'] for row in catalog.search('soft')], ['SOFT', 'MSFT'])
+        self.assertEqual([row['symbol'] for row in catalog.search('sof')], ['SOFT', 'ZSOF', 'MSFT'])
+        self.assertEqual([row['symbol'] for row in catalog.search('crosoft c')], ['MSFT'])
+        self.assertEqual([row['symbol'] for row in catalog.search('STRASSE')], ['STRS'])
+        self.assertEqual([row['symbol'] for row in catalog.search('grosshandel')], ['STRS'])
+        self.assertEqual([row['symbol'] for row in catalog.search('énergie')], ['EEE'])
+        self.assertEqual([row['symbol'] for row in catalog.search('ÉLECTRI')], ['EEE'])
+        self.assertEqual([row['symbol'] for row in catalog.search('tricité')], ['EEE'])
+        self.assertEqual([row['symbol'] for row in catalog.search('sof', limit=1)], ['SOFT'])
+        # Matches don't run across two names
+        self.assertEqual(catalog.search('corpsoft'), [])
+
+
+    def test_filters(self):
+        """Test that the catalog, search and buy pages filter on exchange and asset type"""
+        self._write_listing([
+            ('AAA', 'Alpha Corp', 'Stock', 'NYSE'),
+            ('AAB', 'Alpha Fund', 'ETF', 'NYSE'),
+            ('AAC', 'Alpha Tech', 'Stock', 'NASDAQ'),
+            ('AAD', 'Alpha Bank', 'Stock', 'NYSE'),
+        ], mtime=time.time() + 10)
+        catalog = get_catalog()
+        self.assertEqual([row['symbol'] for row in catalog.filter(exchange='NYSE')], ['AAA', 'AAB', 'AAD'])
+        self.assertEqual([row['symbol'] for row in catalog.filter(asset_type='ETF')], ['AAB'])
+        self.assertEqual([row['symbol'] for row in get_stocks('NYSE')], ['AAA', 'AAD'])
+        self.assertEqual(get_stocks('NYSE')[-1], {'symbol': 'AAD', 'name': 'Alpha Bank'})
+        self.assertEqual(len(get_stocks('LSE')), 0)
+        self.assertNotIn('AAC', get_stocks('NYSE'))
+        self.assertEqual([row['symbol'] for row in get_stocks('NYSE').search('alpha')], ['AAD', 'AAA'])
+
+        response = self.client.get(reverse('search_stocks'), {'q': 'alpha', 'exchange': 'NASDAQ'})
+        self.assertJSONEqual(response.content, {'stocks': [{'symbol': 'AAC', 'name': 'Alpha Tech'}]})
+
+        User.objects.create_user(username="testuser", password="testpassword")
+        self.client.login(username="testuser", password="testpassword")
+        response = self.client.get(reverse('buy'), {'exchange': 'NASDAQ'})
+        self.assertContains(response, 'data-symbol="AAC"')
+        self.assertNotContains(response, 'data-symbol="AAA"')
+        self.assertNotContains(self.client.get(reverse('buy'), {'exchange': 'LSE'}), 'data-symbol=')
+        self.assertContains(self.client.get(reverse('buy')), 'data-symbol="AAA"')
+
+
+    def test_asset_type_filter(self):
+        """Test that search and the buy page list another asset type when asked, and stocks by default"""
+        self._write_listing([
+            ('AAA', 'Alpha Corp', 'Stock', 'NYSE'),
+            ('AAB', 'Alpha Fund', 'ETF', 'NYSE'),
+            ('AAC', 'Alpha Index', 'ETF', 'NASDAQ'),
+        ], mtime=time.time() + 10)
+        response = self.client.get(reverse('search_stocks'), {'q': 'alpha'})
+        self.assertJSONEqual(response.content, {'stocks': [{'symbol': 'AAA', 'name': 'Alpha Corp'}]})
+        response = self.client.get(reverse('search_stocks'), {'q': 'alpha', 'asset_type': 'ETF'})
+        self.assertJSONEqual(response.content, {'stocks': [
+            {'symbol': 'AAB', 'name': 'Alpha Fund'}, {'symbol': 'AAC', 'name': 'Alpha Index'},
+        ]})
+        response = self.client.get(reverse('search_stocks'), {'q': 'alpha', 'asset_type': 'ETF', 'exchange': 'NASDAQ'})
+        self.assertJSONEqual(response.content, {'stocks': [{'symbol': 'AAC', 'name': 'Alpha Index'}]})
+        response = self.client.get(reverse('search_stocks'), {'q': 'alpha', 'asset_type': 'Bond'})
+        self.assertEqual(response.json()['stocks'], [])
+
+        User.objects.create_user(username="testuser", password="testpassword")
+        self.client.login(username="testuser", password="testpassword")
+        # Pages of each asset type are cached apart
+        response = self.client.get(reverse('buy'))
+        self.assertContains(response, 'data-symbol="AAA"')
+        self.assertNotContains(response, 'data-symbol="AAB"')
+        response = self.client.get(reverse('buy'), {'asset_type': 'ETF'})
+        self.assertContains(response, 'data-symbol="AAB"')
+        self.assertContains(response, 'data-symbol="AAC"')
+        self.assertNotContains(response, 'data-symbol="AAA"')
+        self.assertContains(response, '&asset_type=ETF')
+        response = self.client.get(reverse('buy'), {'asset_type': 'ETF', 'exchange': 'NYSE'})
+        self.assertContains(response, 'data-symbol="AAB"')
+        self.assertNotContains(response, 'data-symbol="AAC"')
+        self.assertContains(self.client.get(reverse('buy')), 'data-symbol="AAA"')
+
+        # Unknown asset types list nothing, and aren't cached
+        with mock.patch('trading.views.cached_page') as cached_page:
+            self.assertNotContains(self.client.get(reverse('buy'), {'asset_type': 'Bond'}), 'data-symbol=')
+        cached_page.assert_not_called()
+
+
+    def test_buy_unknown_symbol(self):
+        """Test that buying a symbol missing from the catalog, or listed as another asset type than stock, fails without fetching a price"""
+        User.objects.create_user(username="testuser", password="testpassword")
+        self.client.login(username="testuser", password="testpassword")
+        for symbol, error in [('ZZZ', 'Invalid stock symbol'), ('BBB', 'Only stocks can be traded')]:
+            with mock.patch('trading.views.get_quote') as get_quote:
+                response = self.client.post(
+                    reverse('buy'),
+                    json.dumps({'symbol': symbol, 'quantity': 1}),
+                    "application/json",
+                    HTTP_X_REQUESTED_WITH='XMLHttpRequest'
+                )
+            self.assertEqual(response.status_code, 400)
+            self.assertJSONEqual(response.content, {'error': error})
+            get_quote.assert_not_called()
+
+
+
+@skipUnlessDBFeature('has_select_for_update')
+class TransactionExportTestCase(TestCase):
+
+    def setUp(self):
+        """Set up a logged in test user with a few transactions, and another user's transaction"""
+        self.user = User.objects.create_user(username="testuser", password="testpassword")
+        for transaction_type, quantity in [('BUY', 10), ('SELL', 4)]:
+            Transaction.objects.create(user=self.user, stock_symbol='IBM', transaction_type=transaction_type, quantity=quantity, price=Decimal('200.50'))
+        other = User.objects.create_user(username="otheruser", password="testpassword")
+        Transaction.objects.create(user=other, stock_symbol='AAPL', transaction_type='BUY', quantity=1, price=100)
+        self.client.login(username="testuser", password="testpassword")
+
+    def _export(self, export_format: str):
+        """Helper method to download the export and return the response and its content"""
+        response = self.client.get(reverse('export_transactions'), {'format': export_format})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return response, b''.join(response.streaming_content).decode()
+
+
+    def test_export_csv(self):
+        """Test that the CSV export lists the user's transactions, newest first"""
+        response, content = self._export('csv')
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="transactions.csv"')
+        lines = content.splitlines()
+        self.assertEqual(lines[0], 'timestamp,stock_symbol,transaction_type,quantity,price,total')
+        self.assertEqual([line.split(',')[1:] for line in lines[1:]], [
+            ['IBM', 'SELL', '4', '200.50', '802.00'],
+            ['IBM', 'BUY', '10', '200.50', '2005.00'],
+        ])
+
+
+    def test_export_ndjson(self):
+        """Test that the NDJSON export has one JSON record per transaction, and that unknown formats are rejected"""
+        response, content = self._export('ndjson')
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        records = [json.loads(line) for line in content.splitlines()]
+        self.assertEqual([(record['transaction_type'], record['quantity'], record['total']) for record in records], [('SELL', 4, '802.00'), ('BUY', 10, '2005.00')])
+        self.assertEqual(set(records[0]), {'timestamp', 'stock_symbol', 'transaction_type', 'quantity', 'price', 'total'})
+
+        response = self.client.get(reverse('export_transactions'), {'format': 'xml'})
+        self.assertEqual(response.status_code, 400)
+
+
+    def test_export_streamed_in_chunks(self):
+        """Test that the export reads and yields the ledger a chunk of rows at a time (see benchmarks/bench_export.py)"""
+        chunks = list(stream_transactions(Transaction.objects.filter(user=self.user), 'csv', chunk_size=1))
+        # Header, then one chunk per row
+        self.assertEqual([chunk.count('\n') for chunk in chunks], [1, 1, 1])
+
+
+
+class TradingConcurrencyTestCase(TransactionTestCase):
+
+    THREADS = 8
+    TRADES_PER_THREAD = 25
+
+    def setUp(self):
+        """Set up a user holding some stock, so that both buys and sells can succeed"""
+        self.user = User.objects.create_user(username="testuser", password="testpassword")
+        Transaction.objects.create(user=self.user, stock_symbol='EXAMPLE', transaction_type='BUY', quantity=20, price=100.00)
+
+
+    def _trade(self, thread_number: int, barrier: threading.Barrier):
+        """Helper method run by each thread: alternate buys and sells, ignoring rejected trades"""
+        try:
+            barrier.wait()
+            for i in range(self.TRADES_PER_THREAD):
+                transaction_type = 'BUY' if (thread_number + i) % 2 else 'SELL'
+                try:
+                    Transaction.objects.create(user=self.user, stock_symbol='EXAMPLE', transaction_type=transaction_type, quantity=7, price=450.00)
+                except ValidationError:
+                    pass
+        finally:
+            connection.close()
+
+
+    def test_parallel_trades_keep_ledger_consistent(self):
+        """Test that parallel buys and sells of one user never lose an update or overdraw"""
+        barrier = threading.Barrier(self.THREADS)
+        threads = [threading.Thread(target=self._trade, args=(n, barrier)) for n in range(self.THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # Replay the ledger and compare with the stored balance and holding
+        def ledger_sum(transaction_type, field):
+            return Transaction.objects.filter(user=self.user, transaction_type=transaction_type).aggregate(total=Sum(field))['total'] or 0
+
+        portfolio = Portfolio.objects.get(user=self.user)
+        quantity = StockHolding.objects.filter(portfolio=portfolio, stock_symbol='EXAMPLE').values_list('quantity', flat=True).first() or 0
+        self.assertEqual(portfolio.balance, Decimal('10000.00') - ledger_sum('BUY', 'total') + ledger_sum('SELL', 'total'))
+        self.assertEqual(quantity, ledger_sum('BUY', 'quantity') - ledger_sum('SELL', 'quantity'))
+        self.assertGreaterEqual(portfolio.balance, 0)
+        self.assertGreaterEqual(quantity, 0)
+        # Some trades of each kind went through, and some had to be rejected
+        self.assertGreater(Transaction.objects.filter(transaction_type='SELL').count(), 0)
+        self.assertLess(Transaction.objects.count(), 1 + self.THREADS * self.TRADES_PER_THREAD)
+
+
+class OrdersViewTestCase(TestCase):
+
+    def setUp(self):
+        """Set up a test user holding some stock, login with a test client"""
+        cache.clear()
+        self.user = User.objects.create_user(username="testuser", password="testpassword")
+        StockHolding.objects.create(portfolio=self.user.portfolio, stock_symbol='IBM', quantity=10)
+        self.client = Client()
+        self.client.login(username="testuser", password="testpassword")
+
+
+    def _post_orders(self, orders):
+        """Helper method to POST a list of orders with mocked prices"""
+        with mock.patch('trading.quotes.get_stock_price_data', side_effect=_fake_quote) as upstream:
+            response = self.client.post(
+                reverse('orders'),
+                json.dumps({'orders': orders}),
+                "application/json",
+                HTTP_X_REQUESTED_WITH='XMLHttpRequest'
+            )
+        return response, upstream
+
+
+    def test_orders_partial_fill(self):
+        """Test that valid orders are filled in sequence and invalid ones are rejected"""
+        response, upstream = self._post_orders([
+            {'symbol': 'aapl', 'transaction_type': 'BUY', 'quantity': 50},
+            {'symbol': 'IBM', 'transaction_type': 'SELL', 'quantity': 10},
+            {'symbol': 'GOOGL', 'transaction_type': 'BUY', 'quantity': 61}, # Only $6000 left after AAPL and IBM
+            {'symbol': 'IBM', 'transaction_type': 'SELL', 'quantity': 1},   # Already sold by the second order
+            {'symbol': 'NOTASTOCK', 'transaction_type': 'BUY', 'quantity': 1},
+            {'symbol': 'AAPL', 'transaction_type': 'HOLD', 'quantity': 1},
+            {'symbol': 'AAPL', 'transaction_type': 'BUY', 'quantity': 0},
+            {'symbol': 'AAPL'},
+        ])
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual([order['status'] for order in response.json()['orders']], ['filled', 'filled'] + ['rejected'] * 6)
+        self.assertEqual([order.get('error') for order in response.json()['orders']], [
+            None,
+            None,
+            'Insufficient balance',
+            'You do not own 1 shares of IBM',
+            'Invalid stock symbol',
+            'Invalid transaction type',
+            'Invalid quantity provided',
+            'Invalid or missing data',
+        ])
+        # All valid symbols are priced with a single batch
+        self.assertEqual(sorted(call.args[0] for call in upstream.call_args_list), ['AAPL', 'GOOGL', 'IBM'])
+
+        self.assertEqual(Transaction.objects.count(), 2)
+        self.assertEqual(Portfolio.objects.get(user=self.user).balance, 6000)
+        self.assertEqual(dict(StockHolding.objects.values_list('stock_symbol', 'quantity')), {'AAPL': 50})
+
+
+    def test_orders_written_in_one_batch(self):
+        """Test that the number of statements does not grow with the number of orders"""
+        orders = [{'symbol': symbol, 'transaction_type': 'BUY', 'quantity': 1} for symbol in ['AAPL', 'GOOGL', 'MSFT', 'AMZN', 'NVDA']]
+        self._post_orders(orders) # Warm up the quote cache and the session
+        # Session and user, SAVEPOINT, portfolio and holdings locks, Transaction bulk INSERT,
+        # balance UPDATE, holdings upsert, RELEASE SAVEPOINT
+        with self.assertNumQueries(9):
+            response, _ = self._post_orders(orders)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Transaction.objects.count(), 10)
+        self.assertEqual(StockHolding.objects.get(stock_symbol='NVDA').quantity, 2)
+
+
+    def test_orders_invalid_request(self):
+        """Test that malformed requests are rejected as a whole"""
+        response, _ = self._post_orders([])
+        self.assertEqual(response.status_code, 400)
+        self.assertJSONEqual(response.content, {'error': 'Invalid or missing data'})
+
+        response, _ = self._post_orders([{'symbol': 'NOTASTOCK', 'transaction_type': 'BUY', 'quantity': 1}])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Transaction.objects.count(), 0)
+
+
+@skipUnless(connection.vendor == 'postgresql', "Query plans are checked on PostgreSQL only")
+class QueryPlanTestCase(TestCase):
+
+    USERS = 3
+    HOLDINGS_PER_USER = 10
+    TRANSACTIONS_PER_USER = 50
+
+    @classmethod
+    def setUpTestData(cls):
+        """Seed a few users directly with bulk inserts. Plans are checked with sequential scans disabled, so no large dataset is needed"""
+        users = User.objects.bulk_create([User(username=f"user{n}") for n in range(cls.USERS)])
+        portfolios = Portfolio.objects.bulk_create([Portfolio(user=user) for user in users])
+        symbols = [stock['symbol'] for stock in get_valid_symbols()[:cls.HOLDINGS_PER_USER]]
+        StockHolding.objects.bulk_create([
+            StockHolding(portfolio=portfolio, stock_symbol=symbol, quantity=10)
+            for portfolio in portfolios for symbol in symbols
+        ])
+        Transaction.objects.bulk_create([
+            Transaction(user=user, stock_symbol=symbols[n % len(symbols)], transaction_type='BUY', quantity=1, price=10, total=10)
+            for user in users for n in range(cls.TRANSACTIONS_PER_USER)
+        ])
+
+        cls.user = users[cls.USERS // 2]
+        cls.user.set_password("testpassword")
+        cls.user.save()
+
+
+    def setUp(self):
+        self.client = Client()
+        self.client.login(username=self.user.username, password="testpassword")
+
+
+    def _assert_no_seq_scan(self, *args, **kwargs):
+        """
+        Helper method to GET a view and EXPLAIN every SELECT it runs on the trading tables. With
+        sequential scans disabled, the planner only picks one when no index can serve the query
+        """
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(*args, **kwargs)
+        self.assertEqual(response.status_code, 200)
+        explained = 0
+        with connection.cursor() as cursor:
+            cursor.execute("SET enable_seqscan = off")
+            try:
+                for query in queries.captured_queries:
+                    if query['sql'].startswith('SELECT') and '"trading_' in query['sql']:
+                        cursor.execute(f"EXPLAIN {query['sql']}")
+                        plan = '\n'.join(row[0] for row in cursor.fetchall())
+                        self.assertNotIn('Seq Scan', plan, f"{query['sql']}\n{plan}")
+                        explained += 1
+            finally:
+                cursor.execute("RESET enable_seqscan")
+        self.assertGreater(explained, 0)
+        return response
+
+
+    def test_view_query_plans(self):
+        """Test that the queries of every view are served by indexes"""
+        ajax = {'HTTP_X_REQUESTED_WITH': 'XMLHttpRequest'}
+        self._assert_no_seq_scan(reverse('dashboard'))
+        self._assert_no_seq_scan(reverse('sell'))
+        self._assert_no_seq_scan(reverse('get_balance'), **ajax)
+        self._assert_no_seq_scan(reverse('sell_search'), {'q': 'a'}, **ajax)
+        response = self._assert_no_seq_scan(reverse('transactions'))
+        response = self._assert_no_seq_scan(reverse('transactions'), {'after': response.context['next_cursor']})
+        self._assert_no_seq_scan(reverse('transactions'), {'before': response.context['previous_cursor']})
+
+
+
+class StubQuoteHandler(BaseHTTPRequestHandler):
+    """Alpha Vantage stand-in: fails the first 'failures' requests with a 503, then returns quotes"""
+    protocol_version = 'HTTP/1.1' # Keep connections alive
+    failures = 0
+    delay = 0
+
+    def do_GET(self):
+        server = self.server
+        server.requests += 1
+        server.connections.add(self.client_address)
+        time.sleep(self.delay)
+        if server.requests <= self.failures:
+            status, body = 503, b''
+        else:
+            symbol = parse_qs(urlparse(self.path).query)['symbol'][0]
+            status, body = 200, json.dumps({'Global Quote': _fake_quote(symbol)}).encode()
+        try:
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            pass # The client gave up waiting
+
+    def log_message(self, *args):
+        pass
+
+
+class StubQuoteServer(ThreadingHTTPServer):
+    request_queue_size = 64 # Accept bursts of concurrent connections without dropping them
+
+
+def _start_stub(test: TestCase, failures: int = 0, delay: float = 0):
+    """Run a stub API server for the duration of a test. Returns the server and its URL"""
+    handler = type('Handler', (StubQuoteHandler,), {'failures': failures, 'delay': delay})
+    server = StubQuoteServer(('127.0.0.1', 0), handler)
+    server.requests, server.connections = 0, set()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    test.addCleanup(server.server_close)
+    test.addCleanup(server.shutdown)
+    return server, f'http://127.0.0.1:{server.server_port}/query'
+
+
+class AlphaVantageClientTestCase(TestCase):
+
+    def test_connection_reused(self):
+        """Test that consecutive quotes are fetched over one keep-alive connection"""
+        server, url = _start_stub(self)
+        client = AlphaVantageClient(base_url=url, api_key='test')
+        for symbol in ['IBM', 'AAPL', 'GOOGL']:
+            self.assertEqual(client.get_quote(symbol)['01. symbol'], symbol)
+        self.assertEqual(server.requests, 3)
+        self.assertEqual(len(server.connections), 1)
+
+
+    def test_retries_server_errors(self):
+        """Test that 5xx responses are retried up to max_retries times"""
+        server, url = _start_stub(self, failures=2)
+        client = AlphaVantageClient(base_url=url, max_retries=2, retry_backoff=0.01)
+        self.assertEqual(client.get_quote('IBM')['05. price'], '100.00')
+        self.assertEqual(server.requests, 3)
+
+        server, url = _start_stub(self, failures=2)
+        client = AlphaVantageClient(base_url=url, max_retries=1, retry_backoff=0.01)
+        with self.assertRaises(Exception):
+            client.get_quote('IBM')
+        self.assertEqual(server.requests, 2)
+
+
+    def test_read_timeout(self):
+        """Test that a slow upstream fails after the read timeout instead of blocking"""
+        server, url = _start_stub(self, delay=1)
+        client = AlphaVantageClient(base_url=url, read_timeout=0.1, max_retries=0)
+        start = time.monotonic()
+        with self.assertRaises(requests.Timeout):
+            client.get_quote('IBM')
+        self.assertLess(time.monotonic() - start, 1)
+
+
+    def test_client_follows_settings(self):
+        """Test that the shared client is rebuilt when its settings change"""
+        server, url = _start_stub(self)
+        with override_settings(ALPHA_VANTAGE_BASE_URL=url):
+            self.assertEqual(get_client().base_url, url)
+            self.assertEqual(quotes.get_stock_price_data('IBM')['01. symbol'], 'IBM')
+        self.assertNotEqual(get_client().base_url, url)
+
+
+class AsyncViewsTestCase(TestCase):
+
+    def setUp(self):
+        """Set up a test user with a funded portfolio, and a stub API"""
+        self.user = User.objects.create_user(username="testuser", password="testpassword")
+        Portfolio.objects.filter(user=self.user).update(balance=10000)
+        cache.clear()
+        self.server, url = _start_stub(self, delay=0.2)
+        settings_override = override_settings(ALPHA_VANTAGE_BASE_URL=url, ALPHA_VANTAGE_RATE_LIMITS=[])
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def _request(self, method: str, path: str, data=None):
+        """Helper method to build an authenticated AJAX request for an async view"""
+        ajax = {'X-Requested-With': 'XMLHttpRequest'}
+        if method == 'post':
+            request = AsyncRequestFactory().post(path, json.dumps(data), content_type='application/json', headers=ajax)
+        else:
+            request = AsyncRequestFactory().get(path, data, headers=ajax)
+        async def auser():
+            return self.user
+        request.auser = auser
+        return request
+
+
+    async def test_get_price_concurrent(self):
+        """Test that concurrent quote requests wait on the API together, not one after the other"""
+        symbols = ['IBM', 'AAPL', 'GOOGL', 'MSFT', 'AMZN', 'NVDA', 'META', 'TSLA']
+        start = time.monotonic()
+        responses = await asyncio.gather(*(
+            async_views.get_price(self._request('get', reverse('get_price'), {'symbol': symbol})) for symbol in symbols
+        ))
+        self.assertLess(time.monotonic() - start, 0.2 * len(symbols) / 2)
+        for symbol, response in zip(symbols, responses):
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(json.loads(response.content)['symbol'], symbol)
+        self.assertEqual(self.server.requests, len(symbols))
+
+
+    async def test_quote_cache_used_off_event_loop(self):
+        """Test that async quote lookups only use the quote cache from worker threads"""
+        threads = set()
+        class RecordingCache:
+            def __getattr__(self, name):
+                def call(*args, **kwargs):
+                    threads.add(threading.get_ident())
+                    return getattr(cache, name)(*args, **kwargs)
+                return call
+        with mock.patch('trading.quotes._quote_cache', return_value=RecordingCache()):
+            await quotes.aget_quote('IBM')
+            await quotes.aget_quote('IBM')
+            await quotes.aget_quotes(['IBM', 'AAPL'])
+        self.assertTrue(threads)
+        self.assertNotIn(threading.get_ident(), threads)
+
+
+    async def test_get_prices(self):
+        """Test that the async batch endpoint fetches and caches each symbol once"""
+        for _ in range(2):
+            response = await async_views.get_prices(self._request('get', reverse('get_prices'), {'symbols': 'ibm,AAPL,IBM'}))
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(sorted(json.loads(response.content)['prices']), ['AAPL', 'IBM'])
+        self.assertEqual(self.server.requests, 2)
+
+
+    async def test_buy_and_sell(self):
+        """Test that stock can be bought and sold through the async views"""
+        response = await async_views.buy(self._request('post', reverse('buy'), {'symbol': 'ibm', 'quantity': 10}))
+        self.assertEqual(response.status_code, 201)
+        response = await async_views.sell(self._request('post', reverse('sell'), {'symbol': 'IBM', 'quantity': 4}))
+        self.assertEqual(response.status_code, 201)
+        response = await async_views.sell(self._request('post', reverse('sell'), {'symbol': 'IBM', 'quantity': 7}))
+        self.assertEqual(response.status_code, 400)
+
+        holding = await StockHolding.objects.aget(portfolio__user=self.user, stock_symbol='IBM')
+        self.assertEqual(holding.quantity, 6)
+        portfolio = await Portfolio.objects.aget(user=self.user)
+        self.assertEqual(portfolio.balance, Decimal('9400.00'))
+
+
+
+@override_settings(PERFORMANCE_METRICS=True, PERFORMANCE_METRICS_TOKEN='scraper-token', ALPHA_VANTAGE_RATE_LIMITS=[])
+class PerformanceMetricsTestCase(TestCase):
+
+    def setUp(self):
+        """Set up a logged in test user, with empty metrics and quote cache"""
+        cache.clear()
+        registry.reset()
+        self.user = User.objects.create_user(username="testuser", password="testpassword")
+        self.client.login(username="testuser", password="testpassword")
+
+    def _timing(self, response):
+        """Helper method to parse the Server-Timing header of a response into {name: {param: value}}"""
+        timings = {}
+        for metric in response['Server-Timing'].split(', '):
+            name, *params = metric.split(';')
+            timings[name] = dict(param.split('=', 1) for param in params)
+        return timings
+
+
+    def test_server_timing_and_log(self):
+        """Test that a request reports its wall time and database queries in a header and a log line"""
+        with self.assertLogs('trading.metrics', 'INFO') as logs:
+            response = self.client.get(reverse('dashboard'))
+        self.assertEqual(response.status_code, 200)
+        timing = self._timing(response)
+        self.assertGreater(float(timing['total']['dur']), 0)
+        self.assertEqual(timing['db']['desc'], '"3 queries"') # Session, user and portfolio, holdings
+        self.assertEqual(timing['quote'], {'dur': '0.0', 'desc': '"0 calls"'})
+
+        record = logs.records[0].metrics
+        self.assertEqual((record['view'], record['method'], record['status'], record['db_queries']), ('dashboard', 'GET', 200, 3))
+        self.assertTrue(logs.output[0].endswith(f"db_ms={record['db_ms']} quote_calls=0 quote_ms=0.0"))
+
+
+    @mock.patch('trading.quotes.get_stock_price_data', side_effect=_fake_quote)
+    def test_quote_calls_and_cache_events(self, upstream):
+        """Test that upstream quote calls and quote cache events are counted per request, including batch fetches"""
+        ajax = {'HTTP_X_REQUESTED_WITH': 'XMLHttpRequest'}
+        with self.assertLogs('trading.metrics', 'INFO') as logs:
+            first = self.client.get(reverse('get_price'), {'symbol': 'IBM'}, **ajax)
+            second = self.client.get(reverse('get_price'), {'symbol': 'IBM'}, **ajax)
+            batch = self.client.get(reverse('get_prices'), {'symbols': 'IBM,AAPL,MSFT'}, **ajax)
+        self.assertEqual(self._timing(first)['quote']['desc'], '"1 calls"')
+        self.assertEqual(self._timing(first)['quote-cache'], {'desc': '"miss=1"'})
+        self.assertEqual(self._timing(second)['quote']['desc'], '"0 calls"')
+        self.assertEqual(self._timing(second)['quote-cache'], {'desc': '"hit=1"'})
+        # Misses of a batch are fetched by worker threads
+        self.assertEqual(self._timing(batch)['quote']['desc'], '"2 calls"')
+        self.assertEqual(logs.records[2].metrics['quote_calls'], 2)
+
+
+    async def test_async_request(self):
+        """Test that queries run in a thread by the async handler are counted for the request"""
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.get(reverse('transactions'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self._timing(response)['db']['desc'], '"3 queries"') # Session, user, transactions
+
+
+    def test_metrics_endpoint(self):
+        """Test that the metrics endpoint exposes histograms per view, to staff and to the scraper token only"""
+        self.client.get(reverse('dashboard'))
+        self.client.get(reverse('dashboard'))
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+
+        response = Client().get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer scraper-token')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/plain; version=0.0.4; charset=utf-8')
+        lines = response.content.decode().splitlines()
+        self.assertIn('# TYPE stockly_request_duration_seconds histogram', lines)
+        self.assertIn('stockly_request_duration_seconds_count{view="dashboard"} 2', lines)
+        self.assertIn('stockly_request_db_queries_bucket{view="dashboard",le="5"} 2', lines)
+        self.assertIn('stockly_request_db_queries_bucket{view="dashboard",le="2"} 1', lines) # The second one is cached
+        self.assertIn('stockly_requests_total{view="dashboard",method="GET",status="200"} 2', lines)
+
+        self.user.is_staff = True
+        self.user.save()
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 200)
+        with self.settings(PERFORMANCE_METRICS=False):
+            self.assertEqual(self.client.get(reverse('metrics')).status_code, 404)
+
+
+
+class SessionOverheadTestCase(TestCase):
+
+    def setUp(self):
+        """Set up a test user holding some stock"""
+        cache.clear()
+        self.user = User.objects.create_user(username="testuser", password="testpassword")
+        StockHolding.objects.create(portfolio=self.user.portfolio, stock_symbol='IBM', quantity=10)
+
+    def _get(self, client, name, data=None):
+        """Helper method to send an AJAX GET request and return its JSON"""
+        response = client.get(reverse(name), data, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+
+    def test_portfolio_loaded_with_user(self):
+        """Test that the portfolio comes in the same query as the user, with database sessions"""
+        self.client.login(username="testuser", password="testpassword")
+        # Session, user and portfolio
+        with self.assertNumQueries(2):
+            self.assertEqual(self._get(self.client, 'get_balance'), {'balance': '10000.00'})
+        # Session, user and portfolio, holdings
+        with self.assertNumQueries(3):
+            self.assertEqual(self._get(self.client, 'sell_search', {'q': 'i'}), {'stocks': [['IBM', 10]]})
+
+
+    def test_sessions_without_queries(self):
+        """Test that cached and signed cookie sessions leave a single query to the polled endpoints"""
+        for engine in ['django.contrib.sessions.backends.cache', 'django.contrib.sessions.backends.signed_cookies']:
+            with self.subTest(engine=engine), self.settings(SESSION_ENGINE=engine):
+                client = Client()
+                self.assertTrue(client.login(username="testuser", password="testpassword"))
+                with self.assertNumQueries(1):
+                    self.assertEqual(self._get(client, 'get_balance'), {'balance': '10000.00'})
+                with self.assertNumQueries(2):
+                    self._get(client, 'sell_search', {'q': 'IBM'})
+
+
+    def test_sessions_of_model_backend(self):
+        """Test that sessions created with the plain ModelBackend stay valid, loading the portfolio separately"""
+        self.client.force_login(self.user, backend='django.contrib.auth.backends.ModelBackend')
+        with self.assertNumQueries(3):
+            self.assertEqual(self._get(self.client, 'get_balance'), {'balance': '10000.00'})
+
+
+
+class PageCacheTestCase(TestCase):
+
+    def setUp(self):
+        """Set up a logged in test user holding some stock, with an empty page cache"""
+        cache.clear()
+        self.user = User.objects.create_user(username="testuser", password="testpassword")
+        StockHolding.objects.create(portfolio=self.user.portfolio, stock_symbol='IBM', quantity=10)
+        self.client.login(username="testuser", password="testpassword")
+
+
+    def test_pages_cached_until_trade(self):
+        """Test that dashboard and sell pages are served from the cache until the user trades"""
+        for name in ['dashboard', 'sell']:
+            with self.subTest(page=name):
+                first = self.client.get(reverse(name))
+                self.assertContains(first, 'data-symbol="IBM"')
+                # Session, user and portfolio: the holdings are not read again
+                with self.assertNumQueries(2):
+                    second = self.client.get(reverse(name))
+                self.assertEqual(second.content, first.content)
+
+        Transaction.objects.create(user=self.user, stock_symbol='AAPL', transaction_type='BUY', quantity=1, price=100)
+        for name in ['dashboard', 'sell']:
+            with self.subTest(page=name):
+                self.assertContains(self.client.get(reverse(name)), 'data-symbol="AAPL"')
+
+
+    def test_pages_are_per_user(self):
+        """Test that users never see each other's cached pages"""
+        self.client.get(reverse('dashboard'))
+        other = User.objects.create_user(username="otheruser", password="testpassword")
+        client = Client()
+        client.force_login(other)
+        self.assertNotContains(client.get(reverse('dashboard')), 'data-symbol="IBM"')
+
+        # Odd and out of range page numbers are rendered, but not cached
+        for name, page in [('dashboard', 'last'), ('dashboard', '999999'), ('sell', '0'), ('buy', '100000')]:
+            with self.subTest(page=name, number=page):
+                with mock.patch('trading.views.cache') as page_cache:
+                    page_cache.get.return_value = None
+                    self.assertEqual(self.client.get(reverse(name), {'page': page}).status_code, 200)
+                page_cache.set.assert_not_called()
+
+
+    def test_catalog_pages_shared(self):
+        """Test that pages of the catalog are rendered once for all users"""
+        first = self.client.get(reverse('buy'), {'page': 2})
+        other = User.objects.create_user(username="otheruser", password="testpassword")
+        client = Client()
+        client.force_login(other)
+        with mock.patch.object(SymbolCatalog, '__getitem__', side_effect=AssertionError):
+            second = client.get(reverse('buy'), {'page': 2})
+        self.assertEqual(second.content, first.content)
+
+
+class ConditionalRequestTestCase(TestCase):
+
+    def setUp(self):
+        """Set up a logged in test user holding some stock, with empty caches"""
+        cache.clear()
+        quotes.reset_quote_cache_stats()
+        self.user = User.objects.create_user(username="testuser", password="testpassword")
+        StockHolding.objects.create(portfolio=self.user.portfolio, stock_symbol='IBM', quantity=10)
+        self.client.login(username="testuser", password="testpassword")
+
+    def _get(self, name, data=None, etag=None):
+        """Helper method to send an AJAX GET request, revalidating 'etag' if given"""
+        headers = {'X-Requested-With': 'XMLHttpRequest'}
+        if etag:
+            headers['If-None-Match'] = etag
+        return self.client.get(reverse(name), data, headers=headers)
+
+
+    def test_balance_not_modified_until_trade(self):
+        """Test that balance and holdings polls get empty 304s until the user trades"""
+        for name, data in [('get_balance', None), ('sell_search', {'q': 'I'})]:
+            with self.subTest(view=name):
+                first = self._get(name, data)
+                self.assertEqual(first.status_code, 200)
+                self.assertIn('private', first['Cache-Control'])
+                # Session, user and portfolio: the response is not built
+                with self.assertNumQueries(2):
+                    response = self._get(name, data, etag=first['ETag'])
+                self.assertEqual(response.status_code, 304)
+                self.assertEqual(response.content, b'')
+
+                Transaction.objects.create(user=self.user, stock_symbol='IBM', transaction_type='SELL', quantity=1, price=100)
+                response = self._get(name, data, etag=first['ETag'])
+                self.assertEqual(response.status_code, 200)
+                self.assertNotEqual(response['ETag'], first['ETag'])
+
+
+    def test_etags_are_per_user(self):
+        """Test that the ETag of another user's balance is never matched"""
+        etag = self._get('get_balance')['ETag']
+        other = User.objects.create_user(username="otheruser", password="testpassword")
+        self.client.force_login(other)
+        self.assertEqual(self._get('get_balance', etag=etag).status_code, 200)
+
+
+    @mock.patch('trading.quotes.get_stock_price_data', side_effect=_fake_quote)
+    def test_quote_not_modified_until_refetched(self, upstream):
+        """Test that quote polls get 304s while the cached quote is fresh, without it being looked up"""
+        first = self._get('get_price', {'symbol': 'IBM'})
+        self.assertEqual(first.status_code, 200)
+        self.assertIn('Last-Modified', first)
+
+        with mock.patch('trading.views.serve_quote') as serve_quote:
+            self.assertEqual(self._get('get_price', {'symbol': 'IBM'}, etag=first['ETag']).status_code, 304)
+            response = self.client.get(reverse('get_price'), {'symbol': 'IBM'}, headers={
+                'X-Requested-With': 'XMLHttpRequest', 'If-Modified-Since': first['Last-Modified'],
+            })
+            self.assertEqual(response.status_code, 304)
+        serve_quote.assert_not_called()
+
+        # Another symbol, and an expired quote
+        self.assertEqual(self._get('get_price', {'symbol': 'AAPL'}, etag=first['ETag']).status_code, 200)
+        with mock.patch('trading.quotes.time.time', return_value=time.time() + 3600):
+            response = self._get('get_price', {'symbol': 'IBM'}, etag=first['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['price'], '100.00')
+
+
+    @mock.patch('trading.quotes.get_stock_price_data', side_effect=_fake_quote)
+    def test_quote_read_once(self, upstream):
+        """Test that serving a cached quote reads its cache entry once, and writes nothing to the cache"""
+        first = self._get('get_price', {'symbol': 'IBM'})
+        quote_cache = quotes._quote_cache()
+        with mock.patch.object(quote_cache, 'get', wraps=quote_cache.get) as get, \
+                mock.patch.object(quote_cache, 'set', wraps=quote_cache.set) as set_, \
+                mock.patch.object(quote_cache, 'incr', wraps=quote_cache.incr) as incr:
+            response = self._get('get_price', {'symbol': 'IBM'})
+        self.assertEqual(response.json(), first.json())
+        self.assertEqual(response['ETag'], first['ETag'])
+        get.assert_called_once_with(f'{quotes.QUOTE_KEY_PREFIX}IBM')
+        set_.assert_not_called()
+        incr.assert_not_called()
+        self.assertEqual(quotes.get_quote_cache_stats()['hit'], 1)
+
+
+    @mock.patch('trading.quotes.get_stock_price_data', side_effect=_fake_quote)
+    def test_portfolio_value_not_modified_until_trade(self, upstream):
+        """Test that portfolio valuations are revalidated against the cached valuation"""
+        first = self._get('portfolio_value')
+        self.assertEqual(first.status_code, 200)
+        response = self._get('portfolio_value', etag=first['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Transaction.objects.create(user=self.user, stock_symbol='IBM', transaction_type='SELL', quantity=1, price=100)
+        response = self._get('portfolio_value', etag=first['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['holdings'][0]['quantity'], 9)
+
+
+    @mock.patch('trading.quotes.get_stock_price_data', side_effect=_fake_quote)
+    async def test_async_get_price_not_modified(self, upstream):
+        """Test that the async quote view answers 304s too"""
+        async def auser():
+            return self.user
+        request = AsyncRequestFactory().get(reverse('get_price'), {'symbol': 'IBM'}, headers={'X-Requested-With': 'XMLHttpRequest'})
+        request.auser = auser
+        quotes.get_quote('IBM')
+        first = await async_views.get_price(request)
+        self.assertEqual(first.status_code, 200)
+
+        request = AsyncRequestFactory().get(reverse('get_price'), {'symbol': 'IBM'}, headers={
+            'X-Requested-With': 'XMLHttpRequest', 'If-None-Match': first['ETag'],
+        })
+        request.auser = auser
+        self.assertEqual((await async_views.get_price(request)).status_code, 304)
+
+
+@override_settings(QUOTE_STREAM_INTERVAL=0.01, QUOTE_STREAM_HEARTBEAT=0.05)
+class QuoteStreamTestCase(TestCase):
+
+    def setUp(self):
+        """Set up a test user holding some stock, and a fake batch quote lookup"""
+        self.user = User.objects.create_user(username="testuser", password="testpassword")
+        StockHolding.objects.create(portfolio=self.user.portfolio, stock_symbol='IBM', quantity=10)
+        self.prices = {'IBM': '100.00', 'AAPL': '200.00'}
+        self.lookups = []
+        async def aget_quotes(symbols):
+            self.lookups.append(symbols)
+            return {symbol: _fake_quote(symbol, self.prices[symbol]) for symbol in symbols}, {}
+        patcher = mock.patch('trading.streaming.aget_quotes', side_effect=aget_quotes)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def _next_quote(self, stream):
+        """Helper method to return the next quote event of a stream within a second, skipping other lines"""
+        async with asyncio.timeout(1):
+            while True:
+                event = await anext(stream)
+                if event.startswith('event: quote'):
+                    return json.loads(event.split('data: ', 1)[1])
+
+
+    async def test_one_lookup_for_all_subscribers(self):
+        """Test that subscribers share one lookup of the distinct symbols, and only get changed quotes of theirs"""
+        broadcaster = streaming.QuoteBroadcaster()
+        streams = [streaming.stream_quotes(symbols, broadcaster) for symbols in (['IBM', 'AAPL'], ['ibm'], ['IBM'])]
+        first = [await self._next_quote(stream) for stream in streams]
+        self.assertEqual([quote['symbol'] for quote in first], ['AAPL', 'IBM', 'IBM'])
+        self.assertEqual(await self._next_quote(streams[0]), {'symbol': 'IBM', 'price': '100.00', 'open': '99.00', 'previous_close': '98.00'})
+        self.assertTrue(all(symbols == ['AAPL', 'IBM'] for symbols in self.lookups))
+
+        # Only changes are pushed, to the subscribers of the symbol
+        self.prices['AAPL'] = '201.00'
+        self.assertEqual(await self._next_quote(streams[0]), {'symbol': 'AAPL', 'price': '201.00', 'open': '99.00', 'previous_close': '98.00'})
+        with self.assertRaises(asyncio.TimeoutError):
+            await self._next_quote(streams[1])
+
+        for stream in streams:
+            await stream.aclose()
+        self.assertEqual(broadcaster.subscribers, {})
+        await asyncio.sleep(0.05)
+        self.assertTrue(broadcaster.task.done())
+
+
+    async def test_stream_view(self):
+        """Test that the stream view sends the quotes of the user's holdings as Server-Sent Events"""
+        request = AsyncRequestFactory().get('/trading/quote_stream')
+        async def auser():
+            return self.user
+        request.auser = auser
+        response = await async_views.quote_stream(request)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        stream = aiter(response.streaming_content)
+        self.assertTrue((await anext(stream)).startswith(b'retry: '))
+        self.assertEqual(await anext(stream), b'event: quote\ndata: {"symbol": "IBM", "price": "100.00", "open": "99.00", "previous_close": "98.00"}\n\n')
+        self.assertEqual(await asyncio.wait_for(anext(stream), timeout=1), b': keep-alive\n\n')
+        await stream.aclose()
@@ -1,7 +1,11 @@
 from django.urls import path, reverse_lazy
-from . import views
+from django.conf import settings
+from . import views, async_views
 from django.contrib.auth import views as auth_views
 
+# Views that wait on the quote API, async when served over ASGI
+quote_views = async_views if settings.TRADING_ASYNC_VIEWS else views
+
 urlpatterns = [
     # Login handled by Django
     path("login", auth_views.LoginView.as_view(redirect_authenticated_user=True), name="login"),
@@ -29,19 +33,41 @@ urlpatterns = [
     # Transaction history page
     path("transactions", views.transactions, name="transactions"),
 
+    # Download the whole transaction history (CSV or NDJSON)
+    path("transactions/export", views.export_transactions, name="export_transactions"),
+
     # Buy page
-    path("buy", views.buy, name="buy"),
+    path("buy", quote_views.buy, name="buy"),
 
     # API: Search for stocks in Buy page
     path("search_stocks", views.search_stocks, name="search_stocks"),
 
     # Get stock price for a symbol
-    path("get_price", views.get_price, name="get_price"),
+    path("get_price", quote_views.get_price, name="get_price"),
+
+    # Get stock prices for several symbols
+    path("get_prices", quote_views.get_prices, name="get_prices"),
+
+    # API: Value of the user's holdings and total equity
+    path("portfolio_value", quote_views.portfolio_value, name="portfolio_value"),
+
+    # API: Quote cache counters (staff only)
+    path("quote_cache_stats", views.quote_cache_stats, name="quote_cache_stats"),
+
+    # Prometheus metrics of the requests served by this process (PERFORMANCE_METRICS)
+    path("metrics", views.metrics, name="metrics"),
 
     # Sell page
-    path("sell", views.sell, name="sell"),
+    path("sell", quote_views.sell, name="sell"),
+
+    # API: Buy and sell several stocks at once
+    path("orders", views.orders, name="orders"),
 
     # API: Search for owned stocks in Sell page
     path("sell_search", views.sell_search, name="sell_search"),
 
 ]
+
+# Server-Sent Events holding a connection open, so only served over ASGI
+if settings.TRADING_ASYNC_VIEWS:
+    urlpatterns.append(path("quote_stream", async_views.quote_stream, name="quote_stream"))
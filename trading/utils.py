@@ -1,11 +1,13 @@
 # File to store helper functions for views.py
-from django.contrib.auth.models import User
-
-
-
-import requests
-import os
+import base64
 import csv
+import json
+from datetime import datetime
+from itertools import islice
+from django.db.models import Q
+
+from .alphavantage import get_client
+from .catalog import get_stocks
 
 
 def get_stock_price_data(symbol: str):
@@ -14,16 +16,21 @@ def get_stock_price_data(symbol: str):
 
     Returns: A dictionary containing stock price data for the symbol
     """
-    api_key = os.environ.get('ALPHA_VANTAGE_API_KEY')
-    url = 'https://www.alphavantage.co/query'
-    params = {
-        'function': 'GLOBAL_QUOTE',
+    return get_client().get_quote(symbol)
+
+
+def format_quote(symbol: str, price_data: dict):
+    """Return the current, open and previous close prices of a 'Global Quote' as sent to the client"""
+    quote = {
         'symbol': symbol,
-        'apikey': api_key
+        'price': price_data['05. price'],
+        'open': price_data['02. open'],
+        'previous_close': price_data['08. previous close'],
     }
-    response = requests.get(url, params)
-    price_data = response.json()['Global Quote'] # API contains price data inside 'Global Quote'
-    return price_data
+    # Last known quote, served while the API is unavailable
+    if price_data.get('stale'):
+        quote.update(stale=True, as_of=price_data['as_of'])
+    return quote
 
 
 def format_price(price: str):
@@ -31,15 +38,100 @@ def format_price(price: str):
     return format(round(float(price), 2), '.2f')
 
 
+def encode_cursor(timestamp: datetime, pk: int):
+    """Return an opaque pagination cursor for the row with the given timestamp and id"""
+    return base64.urlsafe_b64encode(f"{timestamp.isoformat()}|{pk}".encode()).decode()
+
+
+def decode_cursor(cursor: str):
+    """Return the (timestamp, id) of a cursor made by encode_cursor, or None if it is invalid"""
+    try:
+        timestamp, pk = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        return datetime.fromisoformat(timestamp), int(pk)
+    except (ValueError, UnicodeError):
+        return None
+
+
+def paginate_by_keyset(queryset, page_size: int, after: str = None, before: str = None):
+    """
+    Return one page of a queryset ordered by descending (timestamp, id).
+
+    Instead of an OFFSET, pages are located by seeking from the cursor of the last ('after')
+    or first ('before') row of the neighbouring page, so every page costs the same as the
+    first one. Returns a dict with the rows and the cursors of the next and previous pages.
+    """
+    after, before = decode_cursor(after or ''), decode_cursor(before or '')
+    if before:
+        # Walk backwards from the first row of the current page, then restore the order
+        timestamp, pk = before
+        rows = list(
+            queryset.filter(Q(timestamp__gt=timestamp) | Q(timestamp=timestamp, id__gt=pk))
+            .order_by('timestamp', 'id')[:page_size + 1]
+        )
+        has_previous, has_next = len(rows) > page_size, True
+        rows = rows[:page_size][::-1]
+    else:
+        if after:
+            timestamp, pk = after
+            queryset = queryset.filter(Q(timestamp__lt=timestamp) | Q(timestamp=timestamp, id__lt=pk))
+        rows = list(queryset.order_by('-timestamp', '-id')[:page_size + 1])
+        has_previous, has_next = after is not None, len(rows) > page_size
+        rows = rows[:page_size]
+
+    if not rows:
+        has_previous = has_next = False
+    return {
+        'rows': rows,
+        'previous_cursor': encode_cursor(rows[0].timestamp, rows[0].id) if has_previous else None,
+        'next_cursor': encode_cursor(rows[-1].timestamp, rows[-1].id) if has_next else None,
+    }
+
+
+# Columns of the transaction history export, in order
+EXPORT_COLUMNS = ('timestamp', 'stock_symbol', 'transaction_type', 'quantity', 'price', 'total')
+
+
+class _Echo:
+    """File-like object handing back what is written to it, so csv.writer returns its lines"""
+    def write(self, value):
+        return value
+
+
+def _csv_lines():
+    """Return the header line and a function formatting an export row as a CSV line"""
+    writer = csv.writer(_Echo())
+    return writer.writerow(EXPORT_COLUMNS), lambda row: writer.writerow((row[0].isoformat(), *row[1:]))
+
+
+def _ndjson_line(row):
+    timestamp, symbol, transaction_type, quantity, price, total = row
+    return json.dumps({
+        'timestamp': timestamp.isoformat(),
+        'stock_symbol': symbol,
+        'transaction_type': transaction_type,
+        'quantity': quantity,
+        'price': str(price),
+        'total': str(total),
+    }) + '\n'
+
+
+def stream_transactions(queryset, export_format: str, chunk_size: int = 2000):
+    """
+    Yield the transactions of a queryset, newest first, as CSV ('csv') or NDJSON ('ndjson') text.
+
+    Rows are read through a server-side cursor 'chunk_size' at a time, and each chunk is yielded
+    as one string, so memory use stays the same whatever the length of the history.
+    """
+    rows = queryset.order_by('-timestamp', '-id').values_list(*EXPORT_COLUMNS).iterator(chunk_size=chunk_size)
+    if export_format == 'csv':
+        header, format_row = _csv_lines()
+        yield header
+    else:
+        format_row = _ndjson_line
+    while chunk := list(islice(rows, chunk_size)):
+        yield ''.join(map(format_row, chunk))
+
+
 def get_valid_symbols():
-    """Return active stock symbols from a listings file"""
-    with open("/code/trading/data/listing_status.csv", "r") as file:
-        reader = csv.DictReader(file)
-        stocks = [
-            {
-            'symbol': row['symbol'],
-            'name': row['name'] if len(row['name']) < 50 else row['name'][:50]+'...',
-            }
-            for row in reader if row['assetType'] == 'Stock'
-        ]
-    return stocks
\ No newline at end of file
+    """Return the catalog view of the active stocks. Indexing and slicing it only decode the rows used"""
+    return get_stocks()
@@ -0,0 +1,128 @@
+# Server-side portfolio valuation, cached per user for a short time
+from datetime import datetime, timezone
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import Portfolio
+from .quotes import aget_quotes, get_quotes
+
+
+PORTFOLIO_VALUE_KEY_PREFIX = 'portfolio-value:'
+
+
+def _portfolio_value_key(user_id: int):
+    return f'{PORTFOLIO_VALUE_KEY_PREFIX}{user_id}'
+
+
+def invalidate_portfolio_value(user_id: int):
+    """Drop the cached valuation of a user's portfolio, e.g. after a trade"""
+    cache.delete(_portfolio_value_key(user_id))
+
+
+def _portfolio_rows(user_id: int):
+    """
+    Return a query of the cash balance, realized P&L and holdings of a user, as
+    (balance, realized P&L, symbol, quantity, cost basis) rows.
+
+    The portfolio is joined to its holdings, so a portfolio without holdings still yields its balance.
+    """
+    return Portfolio.objects.filter(user_id=user_id).values_list(
+        'balance', 'realized_pnl', 'holdings__stock_symbol', 'holdings__quantity', 'holdings__cost_basis'
+    ).order_by('holdings__stock_symbol')
+
+
+def _split_rows(rows):
+    """Return the balance, the realized P&L and the (symbol, quantity, cost basis) holdings of _portfolio_rows"""
+    if not rows:
+        raise Portfolio.DoesNotExist
+    return rows[0][0], rows[0][1], [row[2:] for row in rows if row[2] is not None]
+
+
+def _percent(change: Decimal, base: Decimal):
+    return f"{change / base * 100:.2f}" if base else None
+
+
+def _value(balance: Decimal, realized_pnl: Decimal, holdings, quotes: dict, failed: dict):
+    """
+    Return the valuation of a portfolio from its holdings and a batch quote lookup of their symbols.
+
+    Each holding gets its market value, its day change from the previous close, and its unrealized
+    P&L against its cost basis. The totals only cover holdings that could be priced; the others are
+    listed in 'errors'.
+    """
+    positions, errors = [], {symbol: 'Error fetching price' for symbol in failed}
+    holdings_value = previous_value = unrealized_pnl = Decimal(0)
+    for symbol, quantity, cost_basis in holdings:
+        if symbol in errors:
+            continue
+        price_data = quotes.get(symbol)
+        try:
+            price, open_price, previous_close = (Decimal(price_data[key]) for key in ('05. price', '02. open', '08. previous close'))
+        except (TypeError, KeyError, InvalidOperation):
+            errors[symbol] = 'Error fetching price'
+            continue
+        market_value = price * quantity
+        day_change = (price - previous_close) * quantity
+        holdings_value += market_value
+        previous_value += previous_close * quantity
+        unrealized_pnl += market_value - cost_basis
+        position = {
+            'symbol': symbol,
+            'quantity': quantity,
+            'price': f"{price:.2f}",
+            'open': f"{open_price:.2f}",
+            'previous_close': f"{previous_close:.2f}",
+            'market_value': f"{market_value:.2f}",
+            'day_change': f"{day_change:.2f}",
+            'day_change_percent': _percent(day_change, previous_close * quantity),
+            'cost_basis': f"{cost_basis:.2f}",
+            'average_cost': f"{cost_basis / quantity:.2f}",
+            'unrealized_pnl': f"{market_value - cost_basis:.2f}",
+            'unrealized_pnl_percent': _percent(market_value - cost_basis, cost_basis),
+        }
+        # Last known quote, served while the API is unavailable
+        if price_data.get('stale'):
+            position.update(stale=True, as_of=price_data['as_of'])
+        positions.append(position)
+
+    day_change = holdings_value - previous_value
+    return {
+        'holdings': positions,
+        'errors': errors,
+        'balance': f"{balance:.2f}",
+        'holdings_value': f"{holdings_value:.2f}",
+        'day_change': f"{day_change:.2f}",
+        'day_change_percent': _percent(day_change, previous_value),
+        'total_equity': f"{balance + holdings_value:.2f}",
+        'realized_pnl': f"{realized_pnl:.2f}",
+        'unrealized_pnl': f"{unrealized_pnl:.2f}",
+        'as_of': datetime.now(timezone.utc).isoformat(),
+    }
+
+
+def get_portfolio_value(user_id: int):
+    """
+    Return the valuation of a user's portfolio: one query for the holdings, one batch quote lookup.
+
+    Complete valuations are cached for PORTFOLIO_VALUE_TTL seconds, or until the user trades.
+    """
+    valuation = cache.get(_portfolio_value_key(user_id))
+    if valuation is None:
+        balance, realized_pnl, holdings = _split_rows(list(_portfolio_rows(user_id)))
+        valuation = _value(balance, realized_pnl, holdings, *get_quotes([symbol for symbol, _, _ in holdings]))
+        if not valuation['errors']:
+            cache.set(_portfolio_value_key(user_id), valuation, timeout=settings.PORTFOLIO_VALUE_TTL)
+    return valuation
+
+
+async def aget_portfolio_value(user_id: int):
+    """Async version of get_portfolio_value"""
+    valuation = await cache.aget(_portfolio_value_key(user_id))
+    if valuation is None:
+        balance, realized_pnl, holdings = _split_rows([row async for row in _portfolio_rows(user_id)])
+        valuation = _value(balance, realized_pnl, holdings, *await aget_quotes([symbol for symbol, _, _ in holdings]))
+        if not valuation['errors']:
+            await cache.aset(_portfolio_value_key(user_id), valuation, timeout=settings.PORTFOLIO_VALUE_TTL)
+    return valuation
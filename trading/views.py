@@ -1,17 +1,31 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.urls import reverse
-from django.http import HttpRequest, HttpResponse, HttpResponseRedirect, JsonResponse, HttpResponseBadRequest, HttpResponseForbidden
+from django.http import HttpRequest, HttpResponse, HttpResponseRedirect, JsonResponse, HttpResponseBadRequest, HttpResponseForbidden, StreamingHttpResponse
 from django.contrib.auth import login, logout, authenticate, decorators
-from django.contrib.auth.decorators import login_required
+from django.contrib.auth.decorators import login_required, user_passes_test
 from django.contrib.auth.forms import UserCreationForm, AuthenticationForm
-from django.views.decorators.http import require_http_methods, require_GET, require_POST
+from django.views.decorators.http import require_http_methods, require_GET, require_POST, condition
+from django.views.decorators.cache import cache_control
 from django.core.paginator import Paginator
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
 from .models import User, Transaction, Portfolio, StockHolding
-from .utils import get_stock_price_data, format_price, get_valid_symbols
+from .utils import format_price, format_quote, paginate_by_keyset, stream_transactions
+from .catalog import get_catalog, get_stocks
+from .alphavantage import UnknownSymbol
+from .governor import QuoteUnavailable
+from .quotes import get_quote, get_quote_entry, get_quotes, get_quote_cache_stats, quote_fetched_at, serve_quote, trade_price
+from .valuation import get_portfolio_value
+from .metrics import registry
 
 import json
+import math
 import requests
 import os
+import secrets
 
 
 # Login view handled by Django
@@ -41,23 +55,106 @@ def index(request: HttpRequest):
         return redirect('login')
     
 
+def portfolio_etag(request: HttpRequest):
+    """ETag of the responses derived from the user's portfolio (balance, holdings): see portfolio_scope"""
+    return f'"{portfolio_scope(request)}"'
+
+
+def quote_validators(symbol: str, entry):
+    """Return the ETag and Last-Modified time of the cache entry of a symbol's quote while it is fresh, else Nones"""
+    fetched_at = quote_fetched_at(symbol, entry)
+    if fetched_at is None:
+        return None, None
+    return f'"{symbol}-{fetched_at.timestamp()}"', int(fetched_at.timestamp())
+
+
+def quote_not_modified(request: HttpRequest, symbol: str, entry):
+    """Return the validators of a symbol's cache entry, and a 304 if the client already has its quote so that it isn't served"""
+    etag, last_modified = validators = quote_validators(symbol, entry)
+    if etag:
+        return validators, get_conditional_response(request, etag=etag, last_modified=last_modified)
+    return validators, None
+
+
+def quote_response(symbol: str, entry, served, validators):
+    """Return the quote served from the cache entry of a symbol, with 'validators' of that entry, or of the new one it was fetched to"""
+    if served is not entry:
+        validators = quote_validators(symbol, served)
+    response = JsonResponse(format_quote(symbol, served['data']), status=200)
+    etag, last_modified = validators
+    if etag:
+        response.headers['ETag'] = etag
+        response.headers['Last-Modified'] = http_date(last_modified)
+    return response
+
+
+def valuation_response(request: HttpRequest, user_id: int, valuation: dict):
+    """
+    Return a portfolio valuation, or a 304 if the client already has it. Valuations are cached
+    until the user trades or the cache entry expires, so 'as_of' identifies one
+    """
+    etag = f'"{user_id}-{valuation["as_of"]}"'
+    response = get_conditional_response(request, etag=etag) or JsonResponse(valuation, status=200)
+    response.headers.setdefault('ETag', etag)
+    return response
+
+
 @login_required
 @require_GET
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=portfolio_etag)
 def get_balance(request: HttpRequest):
     """Gets the user's cash balance. For AJAX"""
     if not request.headers.get('X-Requested-With') == 'XMLHttpRequest':
         return HttpResponseBadRequest()
     # Get the user's balance object
-    balance = Portfolio.objects.get(user=request.user).balance
+    balance = request.portfolio.balance
     formatted_balance = f"{balance:.2f}" # Convert to str with 2 decimal places
     return JsonResponse({'balance': formatted_balance}, status=200)
 
 
+# Rendered pages, see cached_page
+PAGE_KEY_PREFIX = 'page:'
+
+
+def cached_page(request: HttpRequest, name: str, scope: str, render_page):
+    """
+    Return a page from the page cache, rendering it on a miss with render_page(), which returns
+    the response and the number of the page it rendered.
+
+    Pages are cached per 'scope' (e.g. a user's portfolio version, so that trades make new
+    keys) and page number. Requests for odd or out of range page numbers are rendered without
+    being cached, so they can't fill the cache.
+    """
+    page = request.GET.get('page', '1')
+    if not (page.isascii() and page.isdigit()):
+        return render_page()[0]
+    key = f'{PAGE_KEY_PREFIX}{name}:{scope}:{page}'
+    content = cache.get(key)
+    if content is not None:
+        return HttpResponse(content)
+    response, page_number = render_page()
+    # The paginator falls back to the last page for numbers past it
+    if str(page_number) == page:
+        cache.set(key, response.content, timeout=settings.PAGE_CACHE_TTL)
+    return response
+
+
+def portfolio_scope(request: HttpRequest):
+    """Return the page cache scope of the user's pages: it changes as soon as a trade of theirs commits"""
+    return f'{request.portfolio.user_id}:{request.portfolio.version}'
+
+
 @login_required
 @require_GET
 def dashboard(request: HttpRequest):
+    return cached_page(request, 'dashboard', portfolio_scope(request), lambda: render_dashboard(request))
+
+
+def render_dashboard(request: HttpRequest):
+    """Return the rendered dashboard, and the number of the page rendered"""
     # Retrieve the stock symbols owned by the user
-    portfolio = Portfolio.objects.get(user=request.user)
+    portfolio = request.portfolio
     holdings = StockHolding.objects.filter(portfolio=portfolio).values('stock_symbol', 'quantity').order_by("stock_symbol")
 
     stocks_data = []
@@ -76,67 +173,171 @@ def dashboard(request: HttpRequest):
     
     return render(request, 'trading/dashboard.html', {
         'stocks_data': stocks_data,
+        'realized_pnl': portfolio.realized_pnl,
+        'quote_stream_url': reverse('quote_stream') if settings.TRADING_ASYNC_VIEWS else None,
         'current_page': page_obj.number,
         'previous_page_exists': page_obj.has_previous(),
         'previous_page_number': page_obj.previous_page_number() if page_obj.has_previous() else None,
         'next_page_exists': page_obj.has_next(),
         'next_page_number': page_obj.next_page_number() if page_obj.has_next() else None,
-    })
+    }), page_obj.number
     
 
 @login_required
 @require_GET
 def transactions(request: HttpRequest):
     """Loads a page containing the user's transaction history"""
-    transactions = Transaction.objects.filter(user=request.user).order_by("-timestamp").all()
-    paginator = Paginator(transactions, 10)
-    page_number = request.GET.get('page', 1)
-    page_obj = paginator.get_page(page_number)
-    transactions_data = [transaction for transaction in page_obj]
+    # Paginate with cursors, so that deep pages of long histories stay as cheap as the first one
+    page = paginate_by_keyset(
+        Transaction.objects.filter(user=request.user),
+        10,
+        after=request.GET.get('after'),
+        before=request.GET.get('before'),
+    )
     return render(request, "trading/transactions.html", {
-        'transactions_data': transactions_data,
-        'current_page': page_obj.number,
-        'previous_page_exists': page_obj.has_previous(),
-        'previous_page_number': page_obj.previous_page_number() if page_obj.has_previous() else None,
-        'next_page_exists': page_obj.has_next(),
-        'next_page_number': page_obj.next_page_number() if page_obj.has_next() else None,
+        'transactions_data': page['rows'],
+        'previous_page_exists': page['previous_cursor'] is not None,
+        'previous_cursor': page['previous_cursor'],
+        'next_page_exists': page['next_cursor'] is not None,
+        'next_cursor': page['next_cursor'],
     })
 
 
+# Content types of the transaction history export formats
+EXPORT_FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+
+
+@login_required
+@require_GET
+def export_transactions(request: HttpRequest):
+    """Download the user's whole transaction history, as CSV or NDJSON ('format' parameter)"""
+    export_format = request.GET.get('format', 'csv')
+    if export_format not in EXPORT_FORMATS:
+        return HttpResponseBadRequest()
+    # Streamed, so the history is never held in memory as a whole
+    response = StreamingHttpResponse(
+        stream_transactions(Transaction.objects.filter(user=request.user), export_format),
+        content_type=EXPORT_FORMATS[export_format],
+    )
+    response['Content-Disposition'] = f'attachment; filename="transactions.{export_format}"'
+    return response
+
+
 @login_required
 @require_GET
+@cache_control(private=True, no_cache=True)
 def get_price(request: HttpRequest):
     """Return the stock price of a symbol"""
     # AJAX requests only
     if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
         symbol = request.GET.get('symbol')
         try:
+            # The cache entry is read once, to revalidate the client's quote and to serve it
+            symbol = symbol.upper()
+            entry = get_quote_entry(symbol)
+            validators, not_modified = quote_not_modified(request, symbol, entry)
+            if not_modified:
+                return not_modified
             # Retrieve current, open, and previous close prices from API
-            price_data = get_stock_price_data(symbol)
-            price = price_data['05. price']
-            open_price = price_data['02. open']
-            close_price = price_data['08. previous close']
-            return JsonResponse({
-                'symbol': symbol,
-                'price': price,
-                'open': open_price,
-                'previous_close': close_price,
-            }, status=200)
+            return quote_response(symbol, entry, serve_quote(symbol, entry), validators)
+        except UnknownSymbol:
+            return JsonResponse({'error': 'Unknown stock symbol'}, status=404)
+        except QuoteUnavailable as e:
+            return quote_unavailable(e)
         except Exception:
             return JsonResponse({'error': 'Error fetching price'}, status=500)
     else:
         return HttpResponseBadRequest()
+
+
+@login_required
+@require_GET
+def get_prices(request: HttpRequest):
+    """Return the stock prices of several comma-separated symbols. Failed symbols are listed in 'errors'"""
+    # AJAX requests only
+    if request.headers.get('X-Requested-With') != 'XMLHttpRequest':
+        return HttpResponseBadRequest()
+
+    symbols, error = parse_symbols(request)
+    if error:
+        return error
+    return prices_response(*get_quotes(symbols))
+
+
+def quote_unavailable(e: QuoteUnavailable):
+    """Return the response to a request that needs a price while the quote API is rate limited or failing"""
+    return JsonResponse(
+        {'error': 'Stock prices are temporarily unavailable. Please try again later'},
+        status=503,
+        headers={'Retry-After': str(max(1, math.ceil(e.retry_after)))},
+    )
+
+
+def parse_symbols(request: HttpRequest):
+    """Return the symbols of a get_prices request, and an error response if they are invalid"""
+    symbols = [symbol.strip().upper() for symbol in request.GET.get('symbols', '').split(',') if symbol.strip()]
+    if not symbols:
+        return symbols, JsonResponse({'message': "Missing query parameter 'symbols'"}, status=400)
+    if len(symbols) > settings.QUOTE_BATCH_MAX_SYMBOLS:
+        return symbols, JsonResponse({'message': f"At most {settings.QUOTE_BATCH_MAX_SYMBOLS} symbols can be requested at once"}, status=400)
+    return symbols, None
+
+
+def prices_response(quotes: dict, failed: dict):
+    """Format the result of a batch quote lookup"""
+    prices = {}
+    errors = {symbol: 'Unknown stock symbol' if isinstance(e, UnknownSymbol) else 'Error fetching price' for symbol, e in failed.items()}
+    for symbol, price_data in quotes.items():
+        try:
+            prices[symbol] = format_quote(symbol, price_data)
+        except KeyError:
+            errors[symbol] = 'Error fetching price'
+    return JsonResponse({'prices': prices, 'errors': errors}, status=200)
+
+
+@login_required
+@require_GET
+@cache_control(private=True, no_cache=True)
+def portfolio_value(request: HttpRequest):
+    """Return the market value and day change of each holding, the cash balance and the total equity. For AJAX"""
+    if request.headers.get('X-Requested-With') != 'XMLHttpRequest':
+        return HttpResponseBadRequest()
+    return valuation_response(request, request.user.pk, get_portfolio_value(request.user.pk))
+
+
+@user_passes_test(lambda user: user.is_staff)
+@require_GET
+def quote_cache_stats(request: HttpRequest):
+    """Return the quote cache hit/miss/stale counters. Staff only"""
+    return JsonResponse(get_quote_cache_stats(), status=200)
+
+
+@require_GET
+def metrics(request: HttpRequest):
+    """Return the request metrics of this process in the Prometheus text format. Staff, or a scraper with the metrics token"""
+    if not settings.PERFORMANCE_METRICS:
+        return HttpResponse(status=404)
+    token = settings.PERFORMANCE_METRICS_TOKEN
+    authorization = request.headers.get('Authorization', '')
+    if not (request.user.is_staff or (token and secrets.compare_digest(authorization, f'Bearer {token}'))):
+        return HttpResponseForbidden()
+    return HttpResponse(registry.expose(), content_type='text/plain; version=0.0.4; charset=utf-8')
     
 
 
 @require_GET
 def search_stocks(request: HttpRequest):
-    """Returns a list of valid stock symbols matching the search query in JSON format"""
+    """
+    Returns a list of valid stock symbols matching the search query in JSON format, on the 'exchange'
+    given if any. Listings of another 'asset_type' (e.g. 'ETF') are searched if given
+    """
     q = request.GET.get('q')
     if q:
-        all_stocks = get_valid_symbols()
-        # Loop through all stocks to check if the query is found in stock symbol or name
-        stocks = [s for s in all_stocks if q.lower() in s['symbol'].lower() or q.lower() in s['name'].lower()][:10] # Return first five results
+        # Match the query against stock symbols and names
+        stocks = get_stocks(request.GET.get('exchange') or None, request.GET.get('asset_type') or 'Stock').search(q, limit=10)
         
         if stocks:
             return JsonResponse({'stocks': stocks}, status=200)
@@ -146,6 +347,29 @@ def search_stocks(request: HttpRequest):
         return JsonResponse({'message': "Missing search query parameter 'q'"}, status=400)
 
 
+def buy_symbol_error(symbol: str):
+    """
+    Return why an upper-cased symbol can't be bought, or None. Only stocks are traded, like on the
+    buy page: other listings (ETFs) are refused
+    """
+    if symbol in get_stocks():
+        return None
+    if symbol in get_catalog():
+        return 'Only stocks can be traded'
+    return 'Invalid stock symbol'
+
+
+def parse_trade(request: HttpRequest):
+    """Return the symbol and quantity of a buy/sell request, and an error response if the body is invalid"""
+    try:
+        data = json.loads(request.body)
+        return data['symbol'], int(data['quantity']), None
+    except json.JSONDecodeError:
+        return None, None, JsonResponse({'error': 'Invalid JSON'}, status=400)
+    except (KeyError, ValueError):
+        return None, None, JsonResponse({'error': 'Invalid or missing data'}, status=400)
+
+
 @login_required
 @require_http_methods(['GET', 'POST'])
 def buy(request: HttpRequest):
@@ -157,33 +381,31 @@ def buy(request: HttpRequest):
         # Only accept AJAX requests
         if request.headers.get('X-Requested-With') != 'XMLHttpRequest':
             return HttpResponseBadRequest()
-        try:
-            data = json.loads(request.body)
-            symbol = data['symbol']
-            quantity = int(data['quantity'])
-        except json.JSONDecodeError:
-            return JsonResponse({'error': 'Invalid JSON'}, status=400)
-        except (KeyError, ValueError):
-            return JsonResponse({'error': 'Invalid or missing data'}, status=400)
+        symbol, quantity, error = parse_trade(request)
+        if error:
+            return error
         
         # Verify that quantiity is valid
         if quantity <= 0:
             return JsonResponse({'error': 'Invalid quantity provided'}, status=400)
 
+        # Verify that the symbol is a listed stock before asking the API for its price
+        symbol = str(symbol).upper()
+        error = buy_symbol_error(symbol)
+        if error:
+            return JsonResponse({'error': error}, status=400)
+
         # Get the actual stock price
         try:
-            price = float(get_stock_price_data(symbol)['05. price'])
+            price = trade_price(get_quote(symbol))
+        except UnknownSymbol:
+            return JsonResponse({'error': 'Invalid stock symbol'}, status=400)
+        except QuoteUnavailable as e:
+            return quote_unavailable(e)
         except Exception:
             return JsonResponse({'error': 'Failed to fetch stock price. Please try again later'}, status=500)
         
-        # Get user's portfolio
-        portfolio = get_object_or_404(Portfolio, user=request.user)
-        balance = portfolio.balance
-
-        if balance < quantity * price:
-            return JsonResponse({'error': 'Insufficient balance'}, status=400)
-        
-        # Perform the transaction
+        # Perform the transaction. The balance is checked inside it, against the locked portfolio
         try:
             Transaction.objects.create(
             user=request.user,
@@ -192,27 +414,45 @@ def buy(request: HttpRequest):
             quantity=quantity,
             price=price
             )
+        except ValidationError as e:
+            if e.code == 'insufficient_balance':
+                return JsonResponse({'error': 'Insufficient balance'}, status=400)
+            return JsonResponse({'error': 'An error occurred while buying stock. Please try again later'}, status=500)
         except Exception:
             return JsonResponse({'error': 'An error occurred while buying stock. Please try again later'}, status=500)
         
         return JsonResponse({'message': 'Stock purchased successfully'}, status=201)
 
     else:
-        # Render page for GET requests
-        stocks = get_valid_symbols()
-        paginator = Paginator(stocks, 20)
-        page_number = request.GET.get('page', 1)
-        page_obj = paginator.get_page(page_number)
-        stocks_data = [{'symbol': item['symbol'], 'name': item['name']} for item in page_obj]
-        
-        return render(request, "trading/buy.html", {
-            'stocks': stocks_data,
-            'current_page': page_obj.number,
-            'previous_page_exists': page_obj.has_previous(),
-            'previous_page_number': page_obj.number - 1 if page_obj.has_previous() else None,
-            'next_page_exists': page_obj.has_next(),
-            'next_page_number': page_obj.number + 1 if page_obj.has_next() else None,
-        })
+        # Render page for GET requests. Pages of the catalog are the same for every user
+        exchange = request.GET.get('exchange') or None
+        asset_type = request.GET.get('asset_type') or 'Stock'
+        stocks = get_stocks(exchange, asset_type)
+        if (exchange is not None and exchange not in stocks.exchange_names) or asset_type not in stocks.asset_type_names:
+            # Not cached, so that odd values can't fill the cache
+            return render_buy(request, stocks, exchange, asset_type)[0]
+        return cached_page(request, 'buy', f'{stocks.mtime}:{exchange or ""}:{asset_type}', lambda: render_buy(request, stocks, exchange, asset_type))
+
+
+def render_buy(request: HttpRequest, stocks, exchange: str = None, asset_type: str = 'Stock'):
+    """Return the rendered buy page, and the number of the page rendered"""
+    paginator = Paginator(stocks, 20)
+    page_number = request.GET.get('page', 1)
+    page_obj = paginator.get_page(page_number)
+    stocks_data = list(page_obj)
+
+    return render(request, "trading/buy.html", {
+        'stocks': stocks_data,
+        'exchanges': stocks.exchange_names,
+        'exchange': exchange,
+        'asset_types': stocks.asset_type_names,
+        'asset_type': asset_type,
+        'current_page': page_obj.number,
+        'previous_page_exists': page_obj.has_previous(),
+        'previous_page_number': page_obj.number - 1 if page_obj.has_previous() else None,
+        'next_page_exists': page_obj.has_next(),
+        'next_page_number': page_obj.number + 1 if page_obj.has_next() else None,
+    }), page_obj.number
 
 
 @login_required
@@ -228,23 +468,17 @@ def sell(request: HttpRequest):
             return HttpResponseBadRequest()
         
         # Extract the stock symbol and quantity
-        try:
-            data = json.loads(request.body)
-            symbol = data['symbol']
-            quantity = int(data['quantity'])
-        except json.JSONDecodeError:
-            return JsonResponse({'error': 'Invalid JSON'}, status=400)
-        except (KeyError, ValueError):
-            return JsonResponse({'error': 'Invalid or missing data'}, status=400)
+        symbol, quantity, error = parse_trade(request)
+        if error:
+            return error
                 
-        # Get the user's holdings
-        portfolio = Portfolio.objects.get(user=request.user)
-        holdings = StockHolding.objects.filter(portfolio=portfolio, stock_symbol=symbol).first()
-        if not holdings:
+        # Get the user's holdings. This only avoids fetching a price for stock the user
+        # doesn't own: the quantity is checked again inside the transaction
+        quantity_owned = StockHolding.objects.filter(portfolio=request.portfolio, stock_symbol=str(symbol).upper()).values_list('quantity', flat=True).first()
+        if not quantity_owned:
             return JsonResponse({'error': f'You do not own any stock of {symbol}'}, status=400)
 
         # Ensure quantity provided is valid
-        quantity_owned = holdings.quantity
         if quantity > quantity_owned:
             return JsonResponse({'error': f'You do not own {quantity} shares of {symbol}'}, status=400)
         elif quantity <= 0:
@@ -252,7 +486,11 @@ def sell(request: HttpRequest):
         
         # Get stock price
         try:
-            price = float(get_stock_price_data(symbol)['05. price'])
+            price = trade_price(get_quote(symbol))
+        except UnknownSymbol:
+            return JsonResponse({'error': 'Invalid stock symbol'}, status=400)
+        except QuoteUnavailable as e:
+            return quote_unavailable(e)
         except Exception:
             return JsonResponse({'error': 'Failed to fetch stock price. Please try again later'}, status=500)
         
@@ -265,41 +503,128 @@ def sell(request: HttpRequest):
             quantity=quantity,
             price=price
             )
+        except ValidationError as e:
+            if e.code == 'insufficient_quantity':
+                return JsonResponse({'error': f'You do not own {quantity} shares of {symbol}'}, status=400)
+            return JsonResponse({'error': 'An error occurred when selling stock. Please try again later'}, status=500)
         except Exception:
             return JsonResponse({'error': 'An error occurred when selling stock. Please try again later'}, status=500)
         
         return JsonResponse({'message': 'Stock(s) sold successfully!'}, status=201)
 
     else:
-        # Get user portfolio and holdings
-        portfolio = Portfolio.objects.get(user=request.user)
-        holdings = StockHolding.objects.filter(portfolio=portfolio).values('stock_symbol', 'quantity').order_by('stock_symbol')
-        
-        # Paginate the holdings
-        paginator = Paginator(holdings, 20)
-        page_number = request.GET.get('page', 1)
-        page_obj = paginator.get_page(page_number)
-
-        stocks_data = [
-            {
-                'symbol': holding['stock_symbol'],
-                'quantity': holding['quantity'],
+        return cached_page(request, 'sell', portfolio_scope(request), lambda: render_sell(request))
+
+
+def render_sell(request: HttpRequest):
+    """Return the rendered sell page, and the number of the page rendered"""
+    # Get user portfolio and holdings
+    portfolio = request.portfolio
+    holdings = StockHolding.objects.filter(portfolio=portfolio).values('stock_symbol', 'quantity').order_by('stock_symbol')
+
+    # Paginate the holdings
+    paginator = Paginator(holdings, 20)
+    page_number = request.GET.get('page', 1)
+    page_obj = paginator.get_page(page_number)
+
+    stocks_data = [
+        {
+            'symbol': holding['stock_symbol'],
+            'quantity': holding['quantity'],
+        }
+        for holding in page_obj
+    ]
+
+    return render(request, 'trading/sell.html', {
+        'stocks_data': stocks_data,
+        'current_page': page_obj.number,
+        'previous_page_exists': page_obj.has_previous(),
+        'previous_page_number': page_obj.number - 1 if page_obj.has_previous() else None,
+        'next_page_exists': page_obj.has_next(),
+        'next_page_number': page_obj.number + 1 if page_obj.has_next() else None,
+    }), page_obj.number
+
+
+@login_required
+@require_POST
+def orders(request: HttpRequest):
+    """
+    Buy and/or sell several stocks at once. For AJAX
+
+    Expects {'orders': [{'symbol', 'transaction_type', 'quantity'}, ...]}, prices every order
+    with one batched quote lookup and executes them in one atomic batch. Returns the status
+    of each order, in the order given.
+    """
+    if request.headers.get('X-Requested-With') != 'XMLHttpRequest':
+        return HttpResponseBadRequest()
+    try:
+        legs = json.loads(request.body)['orders']
+        if not isinstance(legs, list) or not legs:
+            raise ValueError
+    except json.JSONDecodeError:
+        return JsonResponse({'error': 'Invalid JSON'}, status=400)
+    except (KeyError, TypeError, ValueError):
+        return JsonResponse({'error': 'Invalid or missing data'}, status=400)
+    if len(legs) > settings.ORDERS_MAX_LEGS:
+        return JsonResponse({'error': f'At most {settings.ORDERS_MAX_LEGS} orders can be placed at once'}, status=400)
+
+    # Validate each order on its own
+    results = []
+    for leg in legs:
+        try:
+            result = {
+                'symbol': str(leg['symbol']).upper(),
+                'transaction_type': str(leg['transaction_type']).upper(),
+                'quantity': int(leg['quantity']),
             }
-            for holding in page_obj
-        ]
+        except (KeyError, TypeError, ValueError):
+            results.append({'status': 'rejected', 'error': 'Invalid or missing data'})
+            continue
+        if result['transaction_type'] not in (Transaction.BUY, Transaction.SELL):
+            result.update(status='rejected', error='Invalid transaction type')
+        elif result['quantity'] <= 0:
+            result.update(status='rejected', error='Invalid quantity provided')
+        elif result['transaction_type'] == Transaction.BUY and (error := buy_symbol_error(result['symbol'])):
+            result.update(status='rejected', error=error)
+        results.append(result)
+
+    # Price all remaining orders with one batched lookup
+    pending = [result for result in results if 'status' not in result]
+    quotes, _ = get_quotes({result['symbol'] for result in pending})
+    priced = []
+    for result in pending:
+        try:
+            result['price'] = trade_price(quotes[result['symbol']])
+            priced.append(result)
+        except (KeyError, ValueError, QuoteUnavailable):
+            result.update(status='rejected', error='Failed to fetch stock price. Please try again later')
+
+    # Execute the priced orders against the locked portfolio
+    if priced:
+        try:
+            outcomes = Transaction.create_batch(request.user, priced)
+        except Exception:
+            return JsonResponse({'error': 'An error occurred while placing orders. Please try again later'}, status=500)
+        for result, outcome in zip(priced, outcomes):
+            if isinstance(outcome, Transaction):
+                result.update(status='filled', price=f"{outcome.price:.2f}", total=f"{outcome.total:.2f}")
+            elif outcome.code == 'insufficient_balance':
+                result.update(status='rejected', error='Insufficient balance')
+            else:
+                result.update(status='rejected', error=f"You do not own {result['quantity']} shares of {result['symbol']}")
 
-        return render(request, 'trading/sell.html', {
-            'stocks_data': stocks_data,
-            'current_page': page_obj.number,
-            'previous_page_exists': page_obj.has_previous(),
-            'previous_page_number': page_obj.number - 1 if page_obj.has_previous() else None,
-            'next_page_exists': page_obj.has_next(),
-            'next_page_number': page_obj.number + 1 if page_obj.has_next() else None,
-        })
+    # Prices of rejected orders are not reported
+    for result in results:
+        if result['status'] == 'rejected':
+            result.pop('price', None)
+    filled = any(result['status'] == 'filled' for result in results)
+    return JsonResponse({'orders': results}, status=201 if filled else 400)
 
 
 @login_required
 @require_GET
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=portfolio_etag)
 def sell_search(request: HttpRequest):
     """Search for stocks owned by a user"""
     # Only accept AJAX requests
@@ -308,8 +633,8 @@ def sell_search(request: HttpRequest):
     
     q = request.GET.get('q', '').strip()
     if q:
-        portfolio = Portfolio.objects.get(user=request.user)
-        stocks = StockHolding.objects.filter(portfolio=portfolio, stock_symbol__icontains=q).values_list('stock_symbol', 'quantity')
+        # Symbols are stored upper-case, so a case-sensitive prefix match can use an index
+        stocks = StockHolding.objects.filter(portfolio=request.portfolio, stock_symbol__startswith=q.upper()).values_list('stock_symbol', 'quantity').order_by('stock_symbol')
         return JsonResponse({'stocks': list(stocks)}, status=200)
     else:
         return JsonResponse({'message': "Missing search query parameter 'q'"}, status=400)
\ No newline at end of file